@@ -1 +1,6 @@
+from .archive import glitch_archive
+from .augment import glitch_batch
+from .cache import ArrayCache, InputCache
+from .estimate import CostModel
+from .scheduler import GlitchScheduler
 from .glitch_this import ImageGlitcher
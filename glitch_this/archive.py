@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+ Glitching of zip/tar archives, without extracting them
+
+ Members are read out of the input archive one at a time, glitched in memory on a pool
+ of worker processes and written into the output archive under the same names, in the same order
+ Only a few members per worker are held in memory at once, and nothing is written to disk
+ but the output archive (written to a temp file next to it and then renamed, like other outputs)
+
+ Members that aren't images (by their extension) are left out, or copied as they are with keep_others
+ Still images turned into GIFs (gif preset) get a .gif extension
+
+ Usage: glitch_this archive <input archive> -l <glitch_level> [-o <output archive>] [options]
+        (see glitch_this archive -h)
+"""
+import argparse
+import io
+import os
+import tarfile
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from time import localtime, mktime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+from glitch_this.utils import get_worker_glitcher
+from glitch_this.watch import PRESET_DEFAULTS, load_preset
+from glitch_this.workqueue import add_preset_arguments
+
+# Output archive extensions, mapped to (archive type, compression)
+ARCHIVE_FORMATS = {
+    '.zip': ('zip', None),
+    '.tar': ('tar', ''),
+    '.tar.gz': ('tar', 'gz'),
+    '.tgz': ('tar', 'gz'),
+    '.tar.bz2': ('tar', 'bz2'),
+    '.tbz2': ('tar', 'bz2'),
+    '.tar.xz': ('tar', 'xz'),
+    '.txz': ('tar', 'xz'),
+}
+
+
+def archive_format(path: str) -> Tuple[str, Optional[str]]:
+    # (archive type, compression) of path, from its extension
+    lowered = path.lower()
+    for extension, archive in ARCHIVE_FORMATS.items():
+        if lowered.endswith(extension):
+            return archive
+    raise ValueError(f'Cannot tell archive format from path: {path}, must be one of {", ".join(ARCHIVE_FORMATS)}')
+
+
+def is_image_member(name: str) -> bool:
+    # Whether the member name is an image's, skipping hidden files (i.e macOS' __MACOSX/._* resource forks)
+    parts = name.split('/')
+    if parts[-1].startswith('.') or '__MACOSX' in parts:
+        return False
+    return os.path.splitext(parts[-1])[1].lower() in Image.registered_extensions()
+
+
+class Member:
+    # A file of an archive: its name, content and what is kept of its metadata
+    def __init__(self, name: str, data: bytes, mtime: float, mode: int = 0o644):
+        self.name = name
+        self.data = data
+        self.mtime = mtime
+        self.mode = mode
+
+
+def read_members(src_path: str) -> Iterator[Member]:
+    """
+     Yields the files of the zip/tar archive at src_path, in archive order, one at a time
+     Directories, links and other special entries are skipped
+    """
+    if zipfile.is_zipfile(src_path):
+        with zipfile.ZipFile(src_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                # Unix permissions, if the archive was made on unix
+                mode = (info.external_attr >> 16) & 0o777 or 0o644
+                # Zip timestamps are in local time
+                yield Member(info.filename, archive.read(info), mktime(info.date_time + (0, 0, -1)), mode)
+    elif tarfile.is_tarfile(src_path):
+        # Stream mode, members are read sequentially without seeking back
+        with tarfile.open(src_path, 'r|*') as archive:
+            for info in archive:
+                if not info.isfile():
+                    continue
+                yield Member(info.name, archive.extractfile(info).read(), info.mtime, info.mode)
+    else:
+        raise Exception('File format not supported - must be a zip or tar archive')
+
+
+class ArchiveWriter:
+    # Writes members into a zip/tar archive, of the format given by the extension of path
+    def __init__(self, path: str, out_file):
+        self.type, compression = archive_format(path)
+        if self.type == 'zip':
+            self.archive = zipfile.ZipFile(out_file, 'w')
+        else:
+            self.archive = tarfile.open(fileobj=out_file, mode=f'w|{compression}')
+
+    def write(self, member: Member, compress: bool = True):
+        if self.type == 'zip':
+            # Zip timestamps can't go back before 1980
+            info = zipfile.ZipInfo(member.name, date_time=max(localtime(member.mtime)[:6], (1980, 1, 1, 0, 0, 0)))
+            info.external_attr = (0o100000 | member.mode) << 16
+            # Images are compressed already, they're only stored
+            info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+            self.archive.writestr(info, member.data)
+        else:
+            info = tarfile.TarInfo(member.name)
+            info.size = len(member.data)
+            info.mtime = member.mtime
+            info.mode = member.mode
+            self.archive.addfile(info, io.BytesIO(member.data))
+
+    def close(self):
+        self.archive.close()
+
+
+def glitch_member(name: str, data: bytes, preset: Dict) -> Tuple[str, bytes]:
+    """
+     Glitches the encoded image data of member name with preset, returns the output's name and content
+     Animated GIFs go through glitch_gif, every other image through glitch_image (see watch.glitch_file)
+    """
+    glitcher = get_worker_glitcher()
+    params = {key: preset[key] for key in ('color_offset', 'scan_lines', 'seed', 'glitch_change', 'cycle', 'step', 'threads')}
+    with Image.open(io.BytesIO(data)) as img:
+        animated = getattr(img, 'is_animated', False) and img.format == 'GIF'
+    if not animated:
+        params.update(gif=preset['gif'], frames=preset['frames'], mode=preset['mode'])
+    output = glitcher.glitch_bytes(data, preset['glitch_amount'], duration=preset['duration'], loop=preset['loop'],
+                                   optimize_gif=preset['optimize_gif'], **params)
+    if not animated and preset['gif'] and not name.lower().endswith('.gif'):
+        name = f'{os.path.splitext(name)[0]}.gif'
+    return name, output
+
+
+def glitch_archive(src_path: str, dst_path: str, preset: Dict, workers: int = 1, use_threads: bool = False,
+                   keep_others: bool = False) -> Dict[str, int]:
+    """
+     Glitches every image of the zip/tar archive at src_path into the archive at dst_path
+     Returns the number of glitched, skipped (not images) and failed members
+
+     PARAMETERS:-
+
+     src_path: Path to the input zip/tar (optionally gz, bz2 or xz compressed) archive
+
+     dst_path: Path to the output archive, its format is told from its extension (see ARCHIVE_FORMATS)
+
+     preset: glitch parameters, see watch.PRESET_DEFAULTS
+
+     workers: Number of worker processes
+
+     use_threads: Use worker threads instead of processes
+
+     keep_others: Copy members that aren't images into the output archive, instead of leaving them out
+                  Images that fail to glitch are left out either way
+    """
+    if preset.get('glitch_amount') is None:
+        raise ValueError('glitch_amount must be given in the preset')
+    if not (isinstance(workers, int) and workers > 0):
+        raise ValueError('workers parameter must be a positive integer value greater than 0')
+    unknown = set(preset) - set(PRESET_DEFAULTS)
+    if unknown:
+        raise ValueError(f'Unknown preset keys: {", ".join(sorted(unknown))}')
+    preset = dict(PRESET_DEFAULTS, **preset)
+    # Fail before reading anything if the output format is unknown
+    archive_format(dst_path)
+    if os.path.abspath(src_path) == os.path.abspath(dst_path):
+        raise ValueError('The output archive must not be the input archive')
+
+    counts = {'glitched': 0, 'skipped': 0, 'failed': 0}
+    executor_class = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', dir=os.path.dirname(os.path.abspath(dst_path)))
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file, executor_class(max_workers=workers) as executor:
+            writer = ArchiveWriter(dst_path, tmp_file)
+            # (member, future of its glitch, or None to copy it), written out in archive order
+            inflight = deque()
+
+            def write_next():
+                member, future = inflight.popleft()
+                if future is None:
+                    writer.write(member)
+                    return
+                try:
+                    name, output = future.result()
+                except Exception as error:
+                    counts['failed'] += 1
+                    print(f'Failed: "{member.name}" ({type(error).__name__}: {error})')
+                    return
+                counts['glitched'] += 1
+                writer.write(Member(name, output, member.mtime, member.mode), compress=False)
+
+            for member in read_members(src_path):
+                if not is_image_member(member.name):
+                    counts['skipped'] += 1
+                    if keep_others:
+                        inflight.append((member, None))
+                else:
+                    inflight.append((member, executor.submit(glitch_member, member.name, member.data, preset)))
+                    # Members are in memory until written, the glitched ones no longer need their input
+                    member.data = None
+                # Keep a small backlog per worker
+                while len(inflight) > workers * 2:
+                    write_next()
+            while inflight:
+                write_next()
+            writer.close()
+        # mkstemp creates the file readable by the owner only
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, dst_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return counts
+
+
+def get_parser() -> argparse.ArgumentParser:
+    argparser = argparse.ArgumentParser(prog='glitch_this archive',
+                                        description='Glitch every image of a zip/tar archive into a new archive')
+    argparser.add_argument('src_path', metavar='Input', type=str,
+                           help='Zip or tar (optionally gz, bz2 or xz compressed) archive')
+    argparser.add_argument('-o', '--output', dest='output', type=str, default=None,
+                           help='Output archive, its format is told from its extension ('
+                                + ', '.join(ARCHIVE_FORMATS) + '), default - glitched_<input name>')
+    add_preset_arguments(argparser)
+    argparser.add_argument('-w', '--workers', dest='workers', type=int, default=os.cpu_count() or 1,
+                           help='Number of worker processes, default - number of CPUs')
+    argparser.add_argument('--threads', dest='use_threads', action='store_true',
+                           help='Use worker threads instead of processes')
+    argparser.add_argument('-k', '--keep-others', dest='keep_others', action='store_true',
+                           help='Copy members that are not images as they are, instead of leaving them out')
+    return argparser
+
+
+def main(argv: Optional[List[str]] = None):
+    args = get_parser().parse_args(argv)
+    preset = load_preset(args)
+
+    # Sanity check inputs
+    if not os.path.isfile(args.src_path):
+        raise FileNotFoundError(f'No file found at given path: {args.src_path}')
+    if preset['glitch_amount'] is None:
+        raise ValueError('Glitch level must be given, either with -l/--level or in the preset')
+    if not args.workers > 0:
+        raise ValueError('Workers must be greater than 0')
+
+    out_path = args.output or os.path.join(os.path.dirname(args.src_path),
+                                           f'glitched_{os.path.basename(args.src_path)}')
+    counts = glitch_archive(args.src_path, out_path, preset, workers=args.workers, use_threads=args.use_threads,
+                            keep_others=args.keep_others)
+    print(f'Done! Glitched: {counts["glitched"]}, Skipped: {counts["skipped"]}, Failed: {counts["failed"]}')
+    print(f'Archive saved in "{out_path}"')
+
+
+if __name__ == '__main__':
+    main()
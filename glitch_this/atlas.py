@@ -0,0 +1,103 @@
+"""
+ Sprite sheet (texture atlas) output for glitched animations
+
+ Every frame is copied straight into one preallocated atlas array, as it is glitched,
+ the atlas is then encoded once, along with a JSON frame map telling where each frame is
+ So clients fetch and decode one image instead of a GIF or one file per frame
+"""
+import json
+import math
+import os
+from typing import Dict, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+
+class AtlasBuilder:
+    """
+     Tiles frames row by row into one preallocated array
+
+     The array is allocated on the first frame, from its size and mode
+     Palette frames are stored as RGBA (their palettes may differ),
+     later frames are converted to the atlas' mode if needed
+
+     PARAMETERS:-
+
+     frame_count: Number of frames the atlas holds
+
+     columns: Number of frames per row, defaults to a roughly square atlas
+    """
+
+    def __init__(self, frame_count: int, columns: Optional[int] = None):
+        if not (isinstance(frame_count, int) and frame_count > 0):
+            raise ValueError('frame_count parameter must be a positive integer value greater than 0')
+        if columns is not None and not (isinstance(columns, int) and columns > 0):
+            raise ValueError('columns parameter must be a positive integer value greater than 0')
+        self.frame_count = frame_count
+        self.columns = min(columns or math.ceil(math.sqrt(frame_count)), frame_count)
+        self.rows = -(-frame_count // self.columns)
+        self.frame_size = None
+        self.mode = None
+        self.count = 0
+        self.atlasarr = None
+
+    def put(self, frame: Image.Image):
+        # Copies the next frame into its cell of the atlas
+        if self.count >= self.frame_count:
+            raise ValueError(f'Atlas only holds {self.frame_count} frames')
+        if self.atlasarr is None:
+            self.mode = 'RGBA' if frame.mode in ('P', 'PA') else frame.mode
+            self.frame_size = frame.size
+            sample = np.asarray(Image.new(self.mode, (1, 1)))
+            width, height = self.frame_size
+            self.atlasarr = np.zeros((self.rows * height, self.columns * width) + sample.shape[2:], dtype=sample.dtype)
+        if frame.size != self.frame_size:
+            raise ValueError('Every frame of an atlas must have the same size')
+        if frame.mode != self.mode:
+            frame = frame.convert(self.mode)
+        row, column = divmod(self.count, self.columns)
+        width, height = self.frame_size
+        self.atlasarr[row * height:(row + 1) * height, column * width:(column + 1) * width] = np.asarray(frame)
+        self.count += 1
+
+    def image(self) -> Image.Image:
+        # The atlas as an Image, once every frame is in
+        if self.count != self.frame_count:
+            raise ValueError(f'Atlas has {self.count} of its {self.frame_count} frames')
+        if np.dtype(self.atlasarr.dtype).itemsize == 1:
+            return Image.fromarray(self.atlasarr, self.mode)
+        return Image.fromarray(self.atlasarr)
+
+    def frame_map(self, duration: Union[int, float] = 200, loop: int = 0, image: Optional[str] = None) -> Dict:
+        """
+         The JSON frame map of the atlas:
+         frames: x, y, w, h (in pixels) and duration (in milliseconds) of every frame, in order
+         meta: image file name, atlas size, frame size, columns, rows and loop count (0 means infinite)
+        """
+        width, height = self.frame_size
+        frames = []
+        for index in range(self.count):
+            row, column = divmod(index, self.columns)
+            frames.append({'x': column * width, 'y': row * height, 'w': width, 'h': height,
+                           'duration': round(duration)})
+        return {
+            'frames': frames,
+            'meta': {'image': image, 'size': {'w': self.columns * width, 'h': self.rows * height},
+                     'frame_size': {'w': width, 'h': height}, 'columns': self.columns, 'rows': self.rows,
+                     'loop': loop},
+        }
+
+
+def save_atlas(atlas: Image.Image, frame_map: Dict, image_path: str, json_path: Optional[str] = None,
+               format: Optional[str] = None):
+    """
+     Saves the atlas to image_path and its frame map to json_path
+     (defaults to image_path with a .json extension), the map's image is set to image_path's file name
+    """
+    if json_path is None:
+        json_path = os.path.splitext(image_path)[0] + '.json'
+    atlas.save(image_path, format=format, compress_level=3)
+    frame_map = dict(frame_map, meta=dict(frame_map['meta'], image=os.path.basename(image_path)))
+    with open(json_path, 'w') as json_file:
+        json.dump(frame_map, json_file, indent=2)
@@ -0,0 +1,174 @@
+"""
+ Batched glitch augmentation, for ML data loaders
+
+ glitch_batch glitches every sample of a (B, H, W, C) uint8 array at once, with its own random draw,
+ in a few vectorized numpy calls and without any PIL conversion
+ The glitch is the same as glitch_image's (see kernels.py): shifted row bands, the color offset
+ and the scan lines. Shifts all read from the input, so every output row is simply its input row
+ rotated by the offset of the last band covering it. Rows are then copied as runs of rows with
+ the same offset (two slab copies per run), or for small images with one gather of rows for the whole batch
+
+ Randomness only comes from the numpy Generator passed in, give every loader worker one of its own
+ (i.e np.random.default_rng([seed, epoch, worker_id])) for thread/process safe, reproducible epochs
+"""
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Average size (in bytes) of the runs of equally shifted rows, below which rows are shifted with one gather
+RUN_MIN_BYTES = 2048
+
+
+def draw_plans(rng: np.random.Generator, batch_size: int, height: int, width: int, channels: int,
+               glitch_amount: Union[int, float, Tuple[float, float]], color_offset: bool) -> Dict[str, np.ndarray]:
+    """
+     Draws the glitches of a batch from rng, like glitch_image draws one (see ImageGlitcher.__draw_plan)
+
+     Returns a dict of (B,) glitch_amounts, (B, shifts) offsets, start_ys and stop_ys
+     (shifts past a sample's own number of shifts, and shifts by 0, have an offset of 0),
+     and (B, 3) colors of (channel, offset_x, offset_y) if color_offset is set, None otherwise
+    """
+    if isinstance(glitch_amount, tuple):
+        amounts = rng.uniform(glitch_amount[0], glitch_amount[1], batch_size)
+    else:
+        amounts = np.full(batch_size, float(glitch_amount))
+    max_offsets = (amounts ** 2 / 100 * width).astype(np.int64)
+    doubled_amounts = (amounts * 2).astype(np.int64)
+    shifts = int(doubled_amounts.max())
+
+    offsets = rng.integers(-max_offsets[:, None], max_offsets[:, None], size=(batch_size, shifts), endpoint=True)
+    start_ys = rng.integers(0, height, size=(batch_size, shifts), endpoint=True)
+    chunk_heights = rng.integers(1, max(1, int(height / 4)), size=(batch_size, shifts), endpoint=True)
+    # Every sample only gets int(glitch_amount * 2) shifts
+    offsets[np.arange(shifts)[None, :] >= doubled_amounts[:, None]] = 0
+
+    colors = None
+    if color_offset:
+        colors = np.stack([rng.integers(0, channels - 1, size=batch_size, endpoint=True),
+                           rng.integers(-doubled_amounts, doubled_amounts, endpoint=True),
+                           rng.integers(-doubled_amounts, doubled_amounts, endpoint=True)], axis=1)
+    return {'glitch_amounts': amounts, 'offsets': offsets, 'start_ys': start_ys,
+            'stop_ys': np.minimum(start_ys + chunk_heights, height), 'colors': colors}
+
+
+def row_offsets(plans: Dict[str, np.ndarray], height: int) -> np.ndarray:
+    # (B, H) offset every row ends up shifted by, the one of the last shift covering it (0 if none)
+    offsets = plans['offsets']
+    if offsets.shape[1] == 0:
+        # Glitch amounts below 0.5 don't shift anything
+        return np.zeros((offsets.shape[0], height), dtype=np.int64)
+    rows = np.arange(height)[None, None, :]
+    covered = ((rows >= plans['start_ys'][:, :, None]) & (rows < plans['stop_ys'][:, :, None])
+               & (offsets != 0)[:, :, None])
+    # Index of the last covering shift, searched from the end
+    last = offsets.shape[1] - 1 - np.argmax(covered[:, ::-1], axis=1)
+    return np.where(covered.any(axis=1), np.take_along_axis(offsets, last, axis=1), 0)
+
+
+def shift_rows_gather(batch: np.ndarray, offsets: np.ndarray, out: np.ndarray):
+    # Writes every row of batch into out, rotated right by its (B, H) offset, with one gather of rows
+    batch_size, height, width, channels = batch.shape
+    row_size = width * channels
+    offsets = offsets.ravel()
+    out[...] = batch
+    shifted = np.flatnonzero(offsets)
+    if not shifted.size:
+        return
+    # Each row followed by itself, so every rotation of it is a contiguous window of pixels
+    doubled = np.empty((shifted.size, 2 * row_size), dtype=batch.dtype)
+    np.take(batch.reshape(batch_size * height, row_size), shifted, axis=0, out=doubled[:, :row_size])
+    doubled[:, row_size:] = doubled[:, :row_size]
+    windows = sliding_window_view(doubled, row_size, axis=1)[:, ::channels]
+    out.reshape(batch_size * height, row_size)[shifted] = windows[np.arange(shifted.size), -offsets[shifted] % width]
+
+
+def shift_rows_runs(batch: np.ndarray, offsets: np.ndarray, out: np.ndarray, runs: Tuple[np.ndarray, np.ndarray]):
+    # Same as shift_rows_gather, copying every run (sample, first row) of equally shifted rows as two slabs
+    height, width = batch.shape[1:3]
+    samples, starts = runs
+    stops = np.append(starts[1:], height)
+    # A sample's last run ends at the last row
+    stops[np.append(samples[1:] != samples[:-1], True)] = height
+    for sample, start_y, stop_y, offset in zip(samples.tolist(), starts.tolist(), stops.tolist(),
+                                               (offsets[samples, starts] % width).tolist()):
+        src, dst = batch[sample, start_y:stop_y], out[sample, start_y:stop_y]
+        if offset == 0:
+            dst[...] = src
+        else:
+            dst[:, offset:] = src[:, :width - offset]
+            dst[:, :offset] = src[:, width - offset:]
+
+
+def glitch_batch(batch: np.ndarray, glitch_amount: Union[int, float, Tuple[float, float]], rng: np.random.Generator,
+                 color_offset: bool = False, scan_lines: bool = False, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+     Glitches every sample of batch with its own random draw, returns the glitched batch
+
+     PARAMETERS:-
+
+     batch: uint8 array of shape (B, H, W, C), C being 1 (L), 2 (LA), 3 (RGB) or 4 (RGBA)
+
+     glitch_amount: Level of glitch intensity, [0.1, 10.0] (inclusive)
+                    Or a (low, high) tuple, to draw every sample's level uniformly from
+
+     rng: numpy Generator every random value is drawn from
+
+     color_offset: Offset a random channel of every sample by a random amount
+
+     scan_lines: Make every other row of every sample black (alpha is left untouched)
+
+     out: Array (like batch, not batch itself) to write the output into, a new one by default
+    """
+    if not (isinstance(batch, np.ndarray) and batch.dtype == np.uint8 and batch.ndim == 4):
+        raise ValueError('batch parameter must be a uint8 array of shape (B, H, W, C)')
+    batch_size, height, width, channels = batch.shape
+    if not 1 <= channels <= 4:
+        raise ValueError(f'batch parameter must have 1 to 4 channels, not {channels}')
+    amounts = glitch_amount if isinstance(glitch_amount, tuple) else (glitch_amount, glitch_amount)
+    if not (len(amounts) == 2 and all(isinstance(amount, (int, float)) and 0.1 <= amount <= 10.0 for amount in amounts)
+            and amounts[0] <= amounts[1]):
+        raise ValueError('glitch_amount parameter must be a number, or a (low, high) tuple, in [0.1, 10.0]')
+    if not isinstance(rng, np.random.Generator):
+        raise ValueError('rng parameter must be a numpy.random.Generator')
+    if not isinstance(color_offset, bool):
+        raise ValueError('color_offset param must be a boolean')
+    if not isinstance(scan_lines, bool):
+        raise ValueError('scan_lines param must be a boolean')
+    if out is not None and (out.shape != batch.shape or out.dtype != batch.dtype or not out.flags.c_contiguous
+                            or np.shares_memory(out, batch)):
+        raise ValueError('out parameter must be a contiguous array like batch, not sharing its memory')
+    if out is None:
+        out = np.empty_like(batch)
+    if batch_size == 0:
+        return out
+
+    plans = draw_plans(rng, batch_size, height, width, channels, glitch_amount, color_offset)
+
+    # Shifts: every row (of every sample) is its input row, rotated right by its offset
+    offsets = row_offsets(plans, height)
+    run_starts = np.ones((batch_size, height), dtype=bool)
+    run_starts[:, 1:] = offsets[:, 1:] != offsets[:, :-1]
+    runs = np.nonzero(run_starts)
+    if batch.nbytes >= RUN_MIN_BYTES * runs[0].size:
+        shift_rows_runs(batch, offsets, out, runs)
+    else:
+        shift_rows_gather(batch, offsets, out)
+
+    if color_offset:
+        # One channel of every sample is replaced by the input's, moved down by offset_y rows (wrapping around)
+        # The row it lands on at offset_y is the input's first row, moved right by offset_x
+        samples = np.arange(batch_size)
+        channel_indices, offset_xs, offset_ys = plans['colors'].T
+        offset_ys = offset_ys % height
+        source_rows = (np.arange(height)[None, :] - offset_ys[:, None]) % height
+        out[samples[:, None], np.arange(height)[None, :], :, channel_indices[:, None]] = \
+            batch[samples[:, None], source_rows, :, channel_indices[:, None]]
+        first_rows = batch[samples, 0, :, channel_indices]
+        source_columns = (np.arange(width)[None, :] - offset_xs[:, None] % width) % width
+        out[samples, offset_ys, :, channel_indices] = np.take_along_axis(first_rows, source_columns, axis=1)
+
+    if scan_lines:
+        # Color channels only, like glitch_image does for L, LA, RGB and RGBA
+        out[:, ::2, :, :channels - 1 if channels in (2, 4) else channels] = 0
+    return out
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+ Resumable batch jobs for the glitch_this library
+
+ Glitches every image in a list of files/directories with a preset, on a pool
+ of worker processes, and records every input in a SQLite manifest:
+ its path, size, modification time and hash, the preset, the output path and the status
+ Outputs are written atomically, so an output only ever counts as complete once it is
+
+ Running the same job again (i.e after a crash or preemption) skips inputs that were
+ already glitched with the same preset (and haven't changed since), and retries failed ones
+
+ Usage: glitch_this batch <inputs...> -l <glitch_level> -o <out_dir> [options] (see glitch_this batch -h)
+"""
+import argparse
+import hashlib
+import json
+import os
+import signal
+import sqlite3
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from time import monotonic, time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+from glitch_this.watch import PRESET_DEFAULTS, glitch_file, load_preset, output_name
+
+MANIFEST_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS presets (
+    preset_hash TEXT PRIMARY KEY,
+    preset TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    input_path TEXT NOT NULL,
+    preset_hash TEXT NOT NULL,
+    input_size INTEGER NOT NULL,
+    input_mtime_ns INTEGER NOT NULL,
+    input_hash TEXT,
+    output_path TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    PRIMARY KEY (input_path, preset_hash)
+);
+'''
+
+
+def hash_file(path: str) -> str:
+    # sha1 of the file's content
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(2 ** 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def glitch_job(src_path: str, out_dir: str, preset: Dict) -> Tuple[str, str]:
+    # Hashes and glitches src_path into out_dir, returns (input hash, output path)
+    input_hash = hash_file(src_path)
+    os.makedirs(out_dir, exist_ok=True)
+    return input_hash, glitch_file(src_path, out_dir, preset)
+
+
+def list_inputs(inputs: List[str], out_dir: str, gif: bool = False) -> Iterator[Tuple[str, str]]:
+    """
+     Yields (input path, output directory) for every image in inputs, in sorted order, once each
+     Directories are walked recursively (except for out_dir), their layout is kept under out_dir
+
+     Outputs are named the way watch.glitch_file names them (see watch.output_name), inputs whose
+     outputs would have the same name in the same output directory (i.e a/x.png and b/x.png) get the
+     input's parent directory mirrored under out_dir instead
+     gif: Whether still images are turned into GIFs, their outputs then have a .gif extension
+    """
+    extensions = Image.registered_extensions()
+    out_dir_abspath = os.path.abspath(out_dir)
+    # Absolute paths of the inputs, and (output directory, output name) of their outputs, so far
+    seen = set()
+    taken = set()
+
+    def unique_out_dir(path: str, input_out_dir: str) -> str:
+        # Only the header is read, to tell the format
+        try:
+            with Image.open(path) as img:
+                img_format = img.format
+        except OSError:
+            img_format = None
+        # Animated GIFs are always glitched into GIFs, still GIFs stay GIFs either way
+        name = output_name(path, img_format, gif or img_format == 'GIF').lower()
+        key = (os.path.abspath(input_out_dir), name)
+        if key in taken:
+            parent = os.path.dirname(os.path.abspath(path))
+            relative = os.path.relpath(parent)
+            if relative.startswith(os.pardir):
+                relative = os.path.splitdrive(parent)[1].lstrip(os.sep)
+            input_out_dir = os.path.normpath(os.path.join(out_dir, relative))
+            key = (os.path.abspath(input_out_dir), name)
+            if key in taken:
+                raise ValueError(f'More than one input would be glitched into the same output, rename one: {path}')
+        taken.add(key)
+        return input_out_dir
+
+    for path in inputs:
+        if not os.path.isdir(path):
+            if os.path.abspath(path) not in seen:
+                seen.add(os.path.abspath(path))
+                yield path, unique_out_dir(path, out_dir)
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            # Walk in sorted order, skipping hidden/temp files and directories
+            dirnames[:] = sorted(name for name in dirnames if not name.startswith('.')
+                                 and os.path.abspath(os.path.join(dirpath, name)) != out_dir_abspath)
+            relative = os.path.relpath(dirpath, path)
+            for filename in sorted(filenames):
+                if filename.startswith('.') or os.path.splitext(filename)[1].lower() not in extensions:
+                    continue
+                file_path = os.path.join(dirpath, filename)
+                if os.path.abspath(file_path) in seen:
+                    continue
+                seen.add(os.path.abspath(file_path))
+                yield file_path, unique_out_dir(file_path, os.path.normpath(os.path.join(out_dir, relative)))
+
+
+class BatchJob:
+    """
+     Runs a preset over many inputs, keeping track of them in a SQLite manifest
+
+     An input is skipped if the manifest has it as done with the same preset, its output
+     still exists and its content hasn't changed (its hash is only recomputed if its size
+     or modification time did). Failed inputs are retried until they failed max_attempts times
+     Results are committed to the manifest every commit_interval seconds, and on exit
+    """
+
+    def __init__(self, manifest_path: str, preset: Dict, out_dir: str, workers: int = 1, use_threads: bool = False,
+                 max_attempts: int = 3, commit_interval: float = 2.0):
+        self.preset = preset
+        self.out_dir = out_dir
+        self.workers = workers
+        self.use_threads = use_threads
+        self.max_attempts = max_attempts
+        self.commit_interval = commit_interval
+
+        self.db = sqlite3.connect(manifest_path)
+        self.db.executescript(MANIFEST_SCHEMA)
+        preset_json = json.dumps(preset, sort_keys=True)
+        self.preset_hash = hashlib.sha1(preset_json.encode()).hexdigest()
+        self.db.execute('INSERT OR IGNORE INTO presets VALUES (?, ?)', (self.preset_hash, preset_json))
+        self.db.commit()
+
+        # future -> (input path, size, mtime_ns, attempts so far)
+        self.inflight = {}
+        self.processed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.running = False
+        self.last_commit = monotonic()
+
+    def is_done(self, path: str, stat: os.stat_result, row: Optional[Tuple]) -> bool:
+        # Whether the manifest row of path says it was glitched already, and still holds
+        if row is None or row[0] != 'done' or not os.path.isfile(row[4]):
+            return False
+        size, mtime_ns, input_hash = row[1], row[2], row[3]
+        if (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns):
+            return True
+        # Touched, but maybe not changed
+        if hash_file(path) != input_hash:
+            return False
+        self.db.execute('UPDATE jobs SET input_size = ?, input_mtime_ns = ? WHERE input_path = ? AND preset_hash = ?',
+                        (stat.st_size, stat.st_mtime_ns, path, self.preset_hash))
+        return True
+
+    def record(self, path: str, size: int, mtime_ns: int, input_hash: Optional[str], output_path: Optional[str],
+               status: str, error: Optional[str], attempts: int):
+        self.db.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (path, self.preset_hash, size, mtime_ns, input_hash, output_path, status, error, attempts, time()))
+        if monotonic() - self.last_commit >= self.commit_interval:
+            self.db.commit()
+            self.last_commit = monotonic()
+
+    def collect(self, finished):
+        # Records the results of finished jobs in the manifest
+        for future in finished:
+            path, size, mtime_ns, attempts = self.inflight.pop(future)
+            try:
+                input_hash, out_path = future.result()
+            except Exception:
+                self.failed += 1
+                self.record(path, size, mtime_ns, None, None, 'failed', traceback.format_exc(), attempts + 1)
+                print(f'Failed: "{path}"')
+                continue
+            self.processed += 1
+            self.record(path, size, mtime_ns, input_hash, out_path, 'done', None, attempts + 1)
+
+    def run(self, inputs: List[str]):
+        """
+         Glitches every input that isn't done yet, until all are or stop() is called (i.e on SIGINT/SIGTERM)
+         Jobs already handed out to workers are always finished and recorded
+        """
+        executor_class = ThreadPoolExecutor if self.use_threads else ProcessPoolExecutor
+        self.running = True
+        try:
+            with executor_class(max_workers=self.workers) as executor:
+                for path, out_dir in list_inputs(inputs, self.out_dir, gif=self.preset['gif']):
+                    if not self.running:
+                        break
+                    # Recorded by absolute path, so the job can be resumed from any directory
+                    path = os.path.abspath(path)
+                    row = self.db.execute('SELECT status, input_size, input_mtime_ns, input_hash, output_path, attempts '
+                                          'FROM jobs WHERE input_path = ? AND preset_hash = ?',
+                                          (path, self.preset_hash)).fetchone()
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        print(f'Missing: "{path}"')
+                        continue
+                    # Inputs that were done but changed since start over
+                    attempts = row[5] if row is not None and row[0] == 'failed' else 0
+                    if self.is_done(path, stat, row) or (row is not None and row[0] == 'failed'
+                                                         and attempts >= self.max_attempts):
+                        self.skipped += 1
+                        continue
+                    if len(self.inflight) >= self.workers * 2:
+                        # Keep a small backlog per worker, wait for some to finish before handing out more
+                        finished, _ = wait(list(self.inflight), return_when=FIRST_COMPLETED)
+                        self.collect(finished)
+                    future = executor.submit(glitch_job, path, out_dir, self.preset)
+                    self.inflight[future] = (path, stat.st_size, stat.st_mtime_ns, attempts)
+                # Let the jobs that were already handed out finish
+                finished, _ = wait(list(self.inflight))
+                self.collect(finished)
+        finally:
+            self.db.commit()
+
+    def stop(self, *_):
+        self.running = False
+
+    def close(self):
+        self.db.close()
+
+
+def get_parser() -> argparse.ArgumentParser:
+    argparser = argparse.ArgumentParser(prog='glitch_this batch',
+                                        description='Glitch many images, resumably, keeping track of them in a manifest')
+    argparser.add_argument('inputs', metavar='Input', type=str, nargs='+',
+                           help='Image files, or directories to glitch every image in (recursively)')
+    argparser.add_argument('-l', '--level', dest='glitch_level', metavar='Glitch_Level', type=float, default=None,
+                           help='Number between 0.1 and 10.0, inclusive (optional if given by --preset)')
+    argparser.add_argument('--preset', dest='preset', type=str, default=None,
+                           help='JSON file with glitch parameters, keys: ' + ', '.join(PRESET_DEFAULTS))
+    argparser.add_argument('-c', '--color', dest='color', action='store_true', help='Add color offset')
+    argparser.add_argument('-s', '--scan', dest='scan_lines', action='store_true', help='Add scan lines')
+    argparser.add_argument('-g', '--gif', dest='gif', action='store_true', help='Turn still images into GIFs')
+    argparser.add_argument('-sd', '--seed', dest='seed', type=float, default=None, help='Seed for the glitches')
+    argparser.add_argument('-o', '--outdir', dest='out_dir', type=str, required=True,
+                           help='Directory for outputs, the layout of input directories is kept under it')
+    argparser.add_argument('-m', '--manifest', dest='manifest', type=str, default=None,
+                           help='SQLite manifest of the job, default - <outdir>/manifest.sqlite')
+    argparser.add_argument('-w', '--workers', dest='workers', type=int, default=os.cpu_count() or 1,
+                           help='Number of worker processes, default - number of CPUs')
+    argparser.add_argument('--threads', dest='use_threads', action='store_true',
+                           help='Use worker threads instead of processes')
+    argparser.add_argument('--max-attempts', dest='max_attempts', type=int, default=3,
+                           help='Stop retrying inputs that failed this many times, default - 3')
+    return argparser
+
+
+def main(argv: Optional[List[str]] = None):
+    args = get_parser().parse_args(argv)
+    preset = load_preset(args)
+
+    # Sanity check inputs
+    for path in args.inputs:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'No file or directory found at given path: {path}')
+    if preset['glitch_amount'] is None:
+        raise ValueError('Glitch level must be given, either with -l/--level or in the preset')
+    if not args.workers > 0:
+        raise ValueError('Workers must be greater than 0')
+    if not args.max_attempts > 0:
+        raise ValueError('Max attempts must be greater than 0')
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    job = BatchJob(args.manifest or os.path.join(args.out_dir, 'manifest.sqlite'), preset, args.out_dir,
+                   workers=args.workers, use_threads=args.use_threads, max_attempts=args.max_attempts)
+    # Finish the jobs in flight on ctrl+c / kill, record them, then exit
+    signal.signal(signal.SIGINT, job.stop)
+    signal.signal(signal.SIGTERM, job.stop)
+    try:
+        job.run(args.inputs)
+    finally:
+        job.close()
+    print(f'Done! Glitched: {job.processed}, Skipped: {job.skipped}, Failed: {job.failed}')
+
+
+if __name__ == '__main__':
+    main()
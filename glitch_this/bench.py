@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+ Load generator and soak tester for the glitch_this library
+
+ Drives glitch_image/glitch_gif with a configurable mix of sizes, modes,
+ job kinds and concurrency, then reports throughput, latency percentiles
+ and memory usage
+
+ Usage: glitch_this bench [options] (see glitch_this bench -h)
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import product
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from glitch_this import ImageGlitcher
+from glitch_this.utils import get_worker_glitcher
+
+try:
+    import resource
+except ImportError:
+    # Not on a unix (i.e Windows), memory usage isn't reported then
+    resource = None
+
+JOB_KINDS = ('image', 'gif', 'gif-in')
+
+
+def current_rss() -> int:
+    # Resident set size of this process (in bytes) right now, 0 if it can't be told
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Not on linux, fall back to the peak
+        return peak_rss()
+
+
+def peak_rss() -> int:
+    # Peak resident set size of this process (in bytes), ru_maxrss is in bytes on macOS only
+    # 0 without the resource module
+    if resource is None:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def parse_size(size: str) -> Tuple[int, int]:
+    # '640x480' -> (640, 480)
+    try:
+        width, height = (int(value) for value in size.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Size must look like WIDTHxHEIGHT, got: {size}')
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f'Size must be positive, got: {size}')
+    return width, height
+
+
+def make_source(size: Tuple[int, int], mode: str, frames: int = 1) -> bytes:
+    """
+     Creates a synthetic source image (gradient + noise) and returns it encoded
+     PNG for stills, GIF for animations (frames > 1)
+    """
+    width, height = size
+    rng = np.random.default_rng(width * 31 + height)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    imgs = []
+    for i in range(frames):
+        noise = rng.integers(0, 64, (height, width, 3), dtype=np.uint8)
+        arr = ((gradient + i * 8) % 256).astype(np.uint8) + noise
+        imgs.append(Image.fromarray(arr, 'RGB').convert(mode if frames == 1 else 'P'))
+    buffer = io.BytesIO()
+    if frames == 1:
+        imgs[0].save(buffer, format='PNG', compress_level=1)
+    else:
+        imgs[0].save(buffer, format='GIF', save_all=True, append_images=imgs[1:], duration=40, loop=0)
+    return buffer.getvalue()
+
+
+def retained_bytes(glitcher: ImageGlitcher) -> int:
+    # Bytes still held by the arrays a glitcher keeps around between calls
+    return sum(arr.nbytes for arr in (glitcher.inputarr, glitcher.outputarr) if arr is not None)
+
+
+def run_job(job: Dict, source: bytes) -> Dict:
+    """
+     Runs a single job and returns its measurements
+     Latency covers decoding the source, glitching and (optionally) encoding the output
+    """
+    glitcher = get_worker_glitcher()
+    t0 = perf_counter()
+    img = Image.open(io.BytesIO(source))
+    params = {'color_offset': job['color'], 'scan_lines': job['scan'], 'threads': job['threads']}
+    if job['kind'] == 'image':
+        output = [glitcher.glitch_image(img, job['level'], mode=job['mode'], **params)]
+    elif job['kind'] == 'gif':
+        output = glitcher.glitch_image(img, job['level'], gif=True, frames=job['frames'], mode=job['mode'], **params)
+    else:
+        # Input GIFs are palette GIFs whatever the mode, glitch_gif glitches their frames as RGBA
+        output, _, _ = glitcher.glitch_gif(img, job['level'], **params)
+    if job['encode']:
+        buffer = io.BytesIO()
+        if len(output) == 1:
+            output[0].save(buffer, format='PNG', compress_level=3)
+        else:
+            output[0].save(buffer, format='GIF', append_images=output[1:], save_all=True, duration=40, loop=0)
+    latency = perf_counter() - t0
+    return {'latency': latency, 'pid': os.getpid(), 'rss': current_rss(), 'peak_rss': peak_rss(),
+            'retained': retained_bytes(glitcher)}
+
+
+def build_jobs(args: argparse.Namespace) -> List[Dict]:
+    # Every combination of the requested mix, jobs are drawn from these at random
+    return [{'kind': kind, 'size': size, 'mode': mode, 'level': None, 'color': args.color, 'scan': args.scan,
+             'frames': args.frames, 'threads': args.threads, 'encode': args.encode}
+            for kind, size, mode in product(args.kinds, args.sizes, args.modes)]
+
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99), 'max': float(max(latencies))}
+
+
+def run_bench(args: argparse.Namespace) -> Dict:
+    """
+     Runs the load described by args and returns the report as a dict
+
+     Stops after args.requests jobs, or after args.duration seconds if given
+     In soak mode, a sample (throughput, latency, memory) is taken every args.interval seconds
+    """
+    rng = random.Random(args.seed)
+    templates = build_jobs(args)
+    sources = {}
+    for template in templates:
+        key = (template['kind'], template['size'], template['mode'])
+        if key not in sources:
+            frames = args.frames if template['kind'] == 'gif-in' else 1
+            sources[key] = make_source(template['size'], template['mode'], frames)
+
+    executor_class = ProcessPoolExecutor if args.processes else ThreadPoolExecutor
+    latencies = []
+    samples = []
+    worker_rss, worker_peak, worker_retained = {}, {}, {}
+    window = []
+    done_count = 0
+    t_start = perf_counter()
+    t_sample = t_start
+    with executor_class(max_workers=args.concurrency) as executor:
+        pending = set()
+
+        def should_submit() -> bool:
+            if args.duration is not None:
+                return perf_counter() - t_start < args.duration
+            return done_count + len(pending) < args.requests
+
+        while True:
+            # Keep concurrency jobs in flight
+            while len(pending) < args.concurrency and should_submit():
+                job = dict(rng.choice(templates))
+                job['level'] = round(rng.uniform(args.min_level, args.max_level), 1)
+                pending.add(executor.submit(run_job, job, sources[(job['kind'], job['size'], job['mode'])]))
+            if not pending:
+                break
+            finished, pending = wait(pending, timeout=args.interval, return_when=FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                done_count += 1
+                if done_count <= args.warmup:
+                    continue
+                latencies.append(result['latency'])
+                window.append(result['latency'])
+                worker_rss[result['pid']] = result['rss']
+                worker_peak[result['pid']] = result['peak_rss']
+                worker_retained[result['pid']] = result['retained']
+
+            now = perf_counter()
+            if args.soak and now - t_sample >= args.interval:
+                sample = {'elapsed': now - t_start, 'throughput': len(window) / (now - t_sample),
+                          'p95': percentiles(window)['p95'], 'rss': total_rss(worker_rss, args.processes)}
+                samples.append(sample)
+                if not args.json:
+                    print(f"[{sample['elapsed']:8.1f}s] {sample['throughput']:8.2f} jobs/s | "
+                          f"p95 {sample['p95'] * 1000:8.1f} ms | RSS {sample['rss'] / 2 ** 20:8.1f} MiB")
+                window = []
+                t_sample = now
+
+    elapsed = perf_counter() - t_start
+
+    report = {
+        'jobs': len(latencies),
+        'elapsed': elapsed,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'latency': percentiles(latencies),
+        'peak_rss': max([peak_rss()] + list(worker_peak.values())),
+        'retained_per_glitcher': max(worker_retained.values(), default=0),
+    }
+    if args.soak:
+        report['samples'] = samples
+        report.update(soak_summary(samples))
+    return report
+
+
+def total_rss(worker_rss: Dict[int, int], processes: bool) -> int:
+    # Threads share this process' memory, processes each have their own
+    if not processes:
+        return current_rss()
+    return current_rss() + sum(worker_rss.values())
+
+
+def soak_summary(samples: List[Dict]) -> Dict:
+    """
+     Memory growth and throughput drift over the soak run
+
+     rss_growth_per_hour: Slope of a linear fit over RSS samples (bytes/hour)
+     throughput_drift: Relative change between the first and last quarter of samples
+    """
+    # The first sample is still warming up caches and pools
+    samples = samples[1:]
+    if len(samples) < 2:
+        return {'rss_growth_per_hour': 0.0, 'throughput_drift': 0.0}
+    elapsed = np.array([sample['elapsed'] for sample in samples])
+    rss = np.array([sample['rss'] for sample in samples], dtype=np.float64)
+    slope = np.polyfit(elapsed, rss, 1)[0]
+    quarter = max(len(samples) // 4, 1)
+    first = np.mean([sample['throughput'] for sample in samples[:quarter]])
+    last = np.mean([sample['throughput'] for sample in samples[-quarter:]])
+    return {'rss_growth_per_hour': float(slope * 3600),
+            'throughput_drift': float((last - first) / first) if first else 0.0}
+
+
+def print_report(report: Dict):
+    latency = report['latency']
+    print(f"Jobs: {report['jobs']} in {report['elapsed']:.2f}s -> {report['throughput']:.2f} jobs/s")
+    print(f"Latency (ms): p50 {latency['p50'] * 1000:.1f} | p95 {latency['p95'] * 1000:.1f} | "
+          f"p99 {latency['p99'] * 1000:.1f} | max {latency['max'] * 1000:.1f}")
+    print(f"Peak RSS: {report['peak_rss'] / 2 ** 20:.1f} MiB")
+    print(f"Arrays retained per ImageGlitcher after a job: {report['retained_per_glitcher'] / 2 ** 20:.1f} MiB")
+    if 'rss_growth_per_hour' in report:
+        print(f"RSS growth: {report['rss_growth_per_hour'] / 2 ** 20:.1f} MiB/hour | "
+              f"Throughput drift: {report['throughput_drift'] * 100:+.1f}%")
+
+
+def get_parser() -> argparse.ArgumentParser:
+    argparser = argparse.ArgumentParser(prog='glitch_this bench',
+                                        description='Load generator and soak tester for glitch_this')
+    argparser.add_argument('-n', '--requests', dest='requests', type=int, default=100,
+                           help='Number of jobs to run, default - 100')
+    argparser.add_argument('-d', '--duration', dest='duration', type=float, default=None,
+                           help='Run for this many seconds instead of a fixed number of jobs')
+    argparser.add_argument('-c', '--concurrency', dest='concurrency', type=int, default=1,
+                           help='Number of jobs in flight at once, default - 1')
+    argparser.add_argument('-p', '--processes', dest='processes', action='store_true',
+                           help='Use worker processes instead of threads')
+    argparser.add_argument('--sizes', dest='sizes', type=parse_size, nargs='+', default=[(640, 480)],
+                           help='Source sizes to mix, as WIDTHxHEIGHT, default - 640x480')
+    argparser.add_argument('--modes', dest='modes', nargs='+', default=['RGB'],
+                           help='Source image modes to mix, images are glitched in that mode '
+                                '(input GIFs are always palette GIFs), default - RGB')
+    argparser.add_argument('--kinds', dest='kinds', nargs='+', choices=JOB_KINDS, default=['image'],
+                           help='Jobs to mix: image (glitch_image), gif (glitch_image with gif=True) '
+                                'and gif-in (glitch_gif), default - image')
+    argparser.add_argument('--frames', dest='frames', type=int, default=10,
+                           help='Frames of gif and gif-in jobs, default - 10')
+    argparser.add_argument('--min-level', dest='min_level', type=float, default=1.0,
+                           help='Lowest glitch level drawn for a job, default - 1.0')
+    argparser.add_argument('--max-level', dest='max_level', type=float, default=5.0,
+                           help='Highest glitch level drawn for a job, default - 5.0')
+    argparser.add_argument('--color', dest='color', action='store_true', help='Add color offset in every job')
+    argparser.add_argument('--scan', dest='scan', action='store_true', help='Add scan lines in every job')
+    argparser.add_argument('--threads', dest='threads', type=int, default=1,
+                           help='threads parameter passed to every job, default - 1')
+    argparser.add_argument('--encode', dest='encode', action='store_true',
+                           help='Also encode every output (PNG or GIF) as part of the job')
+    argparser.add_argument('--warmup', dest='warmup', type=int, default=0,
+                           help='Number of initial jobs left out of the report, default - 0')
+    argparser.add_argument('--soak', dest='soak', action='store_true',
+                           help='Sample throughput and memory every interval, report growth and drift')
+    argparser.add_argument('--interval', dest='interval', type=float, default=10.0,
+                           help='Seconds between soak samples, default - 10')
+    argparser.add_argument('--seed', dest='seed', type=int, default=None,
+                           help='Seed for the job mix')
+    argparser.add_argument('--json', dest='json', action='store_true', help='Print the report as JSON')
+    return argparser
+
+
+def main(argv: Optional[List[str]] = None):
+    args = get_parser().parse_args(argv)
+
+    # Sanity check inputs
+    if not args.requests > 0:
+        raise ValueError('Requests must be greater than 0')
+    if args.duration is not None and not args.duration > 0:
+        raise ValueError('Duration must be greater than 0')
+    if not args.concurrency > 0:
+        raise ValueError('Concurrency must be greater than 0')
+    if not args.frames > 1:
+        raise ValueError('Frames must be greater than 1')
+    if not 0.1 <= args.min_level <= args.max_level <= 10.0:
+        raise ValueError('Levels must satisfy 0.1 <= min-level <= max-level <= 10.0')
+    if not args.interval > 0:
+        raise ValueError('Interval must be greater than 0')
+
+    report = run_bench(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
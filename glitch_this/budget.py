@@ -0,0 +1,130 @@
+"""
+ Fitting glitched GIFs into a byte size and/or time budget
+
+ A small pilot render (a downscaled copy of the source, a few frames) is timed and
+ encoded with every palette size, the full render's encoded size and time are then
+ extrapolated from it, in proportion to the area and the number of frames
+ The frame count, scale and palette size are chosen from that up front, so the
+ full render is done once, see ImageGlitcher.glitch_budgeted
+"""
+import io
+import math
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from PIL import Image
+
+from glitch_this.gif_optimizer import save_optimized_gif
+
+# Area (in pixels) the source is downscaled to for the pilot render
+PILOT_PIXELS = 2 ** 17
+# Number of frames of the pilot render
+PILOT_FRAMES = 4
+# Scales, fractions of the frame count and palette sizes the choice is made from
+SCALES = (1.0, 0.9, 0.8, 0.7, 0.6, 0.5, 0.4, 0.3, 0.25, 0.2, 0.15, 0.1)
+FRAME_FRACTIONS = (1.0, 0.8, 0.6, 0.5, 0.4, 0.3, 0.2)
+COLORS = (255, 128, 64, 32, 16)
+# Predictions must fit in this fraction of the budget, the extrapolation is not exact
+SAFETY_MARGIN = 0.9
+# Smallest width/height frames are downscaled to
+MIN_SIDE = 16
+
+
+def encode_gif(frames: Sequence[Image.Image], duration: Union[int, float], loop: int = 0, colors: int = 255) -> bytes:
+    # Encodes frames with gif_optimizer.save_optimized_gif, in memory
+    # Always with a palette of colors colors, so the palette size chosen is the one used (and reported)
+    buffer = io.BytesIO()
+    save_optimized_gif(frames, buffer, duration=duration, loop=loop, colors=colors, plain_fallback=False)
+    return buffer.getvalue()
+
+
+def scaled_size(size: Tuple[int, int], scale: float) -> Tuple[int, int]:
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+class BudgetModel:
+    """
+     Encoded size and render time of a glitched GIF, extrapolated from a pilot render
+
+     PARAMETERS:-
+
+     size: (width, height) of the full size source
+
+     pilot_size: (width, height) of the pilot render
+
+     pilot_frames: Number of frames of the pilot render
+
+     first_bytes: Palette size -> encoded size of the pilot's first frame alone
+
+     all_bytes: Palette size -> encoded size of every pilot frame
+
+     seconds_per_pixel: Time to glitch and encode one frame, per pixel (as measured on the pilot)
+
+     resize_seconds_per_pixel: Time to downscale the source, per source pixel
+    """
+
+    def __init__(self, size: Tuple[int, int], pilot_size: Tuple[int, int], pilot_frames: int,
+                 first_bytes: Dict[int, int], all_bytes: Dict[int, int],
+                 seconds_per_pixel: float, resize_seconds_per_pixel: float):
+        self.size = size
+        self.pilot_size = pilot_size
+        self.pilot_frames = pilot_frames
+        self.first_bytes = first_bytes
+        self.all_bytes = all_bytes
+        self.seconds_per_pixel = seconds_per_pixel
+        self.resize_seconds_per_pixel = resize_seconds_per_pixel
+
+    def predict(self, scale: float, frames: int, colors: int) -> Tuple[float, float]:
+        # (encoded bytes, seconds) of a render of frames frames, at scale, with a palette of colors colors
+        width, height = scaled_size(self.size, scale)
+        area_ratio = (width * height) / (self.pilot_size[0] * self.pilot_size[1])
+        first = self.first_bytes[colors]
+        if self.pilot_frames > 1:
+            # Every frame after the first is (mostly) encoded as a diff of the previous one
+            per_frame = (self.all_bytes[colors] - first) / (self.pilot_frames - 1)
+        else:
+            per_frame = first
+        predicted_bytes = area_ratio * (first + (frames - 1) * per_frame)
+
+        predicted_seconds = frames * width * height * self.seconds_per_pixel
+        if scale < 1.0:
+            predicted_seconds += self.size[0] * self.size[1] * self.resize_seconds_per_pixel
+        return predicted_bytes, predicted_seconds
+
+    def choose(self, frames: int, max_bytes: Optional[int] = None,
+               max_seconds: Optional[float] = None) -> Dict[str, Union[int, float]]:
+        """
+         Returns the settings (scale, frames, colors) predicted to fit the budget that keep the most
+         of the output (area weighs the most, then frames, then palette size), along with their
+         predicted bytes and seconds
+         If nothing fits, the settings with the smallest predicted output are returned
+        """
+        frame_counts = sorted({max(min(frames, 2), round(frames * fraction)) for fraction in FRAME_FRACTIONS},
+                              reverse=True)
+        scales = [scale for scale in SCALES if min(scaled_size(self.size, scale)) >= MIN_SIDE] or [SCALES[0]]
+
+        best, best_score, smallest = None, -1.0, None
+        for scale in scales:
+            for frame_count in frame_counts:
+                for colors in COLORS:
+                    predicted_bytes, predicted_seconds = self.predict(scale, frame_count, colors)
+                    settings = {'scale': scale, 'frames': frame_count, 'colors': colors,
+                                'predicted_bytes': int(predicted_bytes), 'predicted_seconds': predicted_seconds}
+                    if smallest is None or predicted_bytes < smallest['predicted_bytes']:
+                        smallest = settings
+                    if max_bytes is not None and predicted_bytes > max_bytes * SAFETY_MARGIN:
+                        continue
+                    if max_seconds is not None and predicted_seconds > max_seconds * SAFETY_MARGIN:
+                        continue
+                    # Area matters most, then frames, palette size the least
+                    score = scale ** 2 * (frame_count / frames) ** 0.75 * math.sqrt(math.log2(colors) / 8)
+                    if score > best_score:
+                        best, best_score = settings, score
+        return best or smallest
+
+
+def downscale_frames(frames: List[Image.Image], scale: float) -> List[Image.Image]:
+    # Downscales every frame by scale (at least to MIN_SIDE pixels)
+    size = scaled_size(frames[0].size, scale)
+    if min(size) < MIN_SIDE:
+        size = scaled_size(frames[0].size, MIN_SIDE / min(frames[0].size))
+    return [frame.resize(size, Image.LANCZOS) for frame in frames]
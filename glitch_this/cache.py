@@ -0,0 +1,157 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Hashable, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+
+class LRUCache:
+    """
+     A size bounded, thread safe LRU cache
+
+     Stored values are made read-only (see freeze), callers must copy them before writing
+     When the total size goes over max_bytes, the least recently used values are evicted
+     Subclasses tell the size of their values (see size_of)
+
+     PARAMETERS:-
+
+     max_bytes: Maximum total size (in bytes) of the cached values
+    """
+
+    def __init__(self, max_bytes: int):
+        if not (isinstance(max_bytes, int) and max_bytes > 0):
+            raise ValueError('max_bytes parameter must be a positive integer value greater than 0')
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.__values = OrderedDict()
+        self.__lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.__values)
+
+    def size_of(self, value) -> int:
+        # Size (in bytes) value counts for
+        raise NotImplementedError
+
+    def freeze(self, value):
+        # Makes value read-only before it is stored
+        pass
+
+    def get(self, key: Hashable):
+        # Returns the value stored under key (read-only) or None
+        with self.__lock:
+            value = self.__values.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.__values.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value):
+        # Stores value under key, value must not be written to afterwards
+        if self.size_of(value) > self.max_bytes:
+            # Would evict everything else and still not fit
+            return
+        self.freeze(value)
+        with self.__lock:
+            if key in self.__values:
+                self.current_bytes -= self.size_of(self.__values.pop(key))
+            self.__values[key] = value
+            self.current_bytes += self.size_of(value)
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self.__values.popitem(last=False)
+                self.current_bytes -= self.size_of(evicted)
+
+    def clear(self):
+        with self.__lock:
+            self.__values.clear()
+            self.current_bytes = 0
+
+
+class ArrayCache(LRUCache):
+    """
+     A size bounded, thread safe LRU cache of numpy arrays
+
+     Stored arrays are made read-only, callers must copy them before writing
+     When the total size goes over max_bytes, the least recently used arrays are evicted
+
+     PARAMETERS:-
+
+     max_bytes: Maximum total size (in bytes) of the cached arrays
+    """
+
+    def size_of(self, arr: np.ndarray) -> int:
+        return arr.nbytes
+
+    def freeze(self, arr: np.ndarray):
+        arr.setflags(write=False)
+
+
+class DecodedImage:
+    """
+     The decoded frames of an input image (one for still images), as pixel arrays
+     Along with what it takes to make the same Images of them again:
+     the mode, palette and info of every frame, and its duration (GIF frames)
+    """
+
+    def __init__(self):
+        self.arrays = []
+        self.modes = []
+        self.palettes = []
+        self.infos = []
+        self.durations = []
+        self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self.arrays)
+
+    def add(self, img: Image.Image, duration: Optional[Union[int, float]] = None):
+        # Appends the pixels (and what else is needed to rebuild it) of img as the next frame
+        arr = np.asarray(img)
+        self.arrays.append(arr)
+        self.modes.append(img.mode)
+        self.palettes.append((img.palette.mode, img.getpalette(img.palette.mode)) if img.palette is not None else None)
+        self.infos.append(dict(img.info))
+        self.durations.append(duration)
+        self.nbytes += arr.nbytes
+
+    def image(self, index: int = 0) -> Image.Image:
+        # The frame at index as an Image, with the pixels, mode, palette and info it was added with
+        arr, mode = self.arrays[index], self.modes[index]
+        # Wider dtypes (i.e 16 bit) and bool (mode '1') already tell pillow their mode
+        if arr.dtype.itemsize == 1 and arr.dtype != bool:
+            img = Image.fromarray(arr, mode)
+        else:
+            img = Image.fromarray(arr)
+        if self.palettes[index] is not None:
+            palette_mode, palette = self.palettes[index]
+            img.putpalette(palette, palette_mode)
+        img.info.update(self.infos[index])
+        return img
+
+
+class InputCache(LRUCache):
+    """
+     A size bounded, thread safe LRU cache of decoded inputs (DecodedImage)
+
+     Set ImageGlitcher.input_cache to one, so that glitching the same input again skips decoding it
+     Entries are keyed by the path, modification time and size of input files
+     (or by a hash of the bytes given to glitch_bytes), so changed files are decoded again
+     Stored arrays are made read-only, when the total size goes over max_bytes,
+     the least recently used inputs are evicted
+
+     PARAMETERS:-
+
+     max_bytes: Maximum total size (in bytes) of the cached pixel arrays
+    """
+
+    def size_of(self, decoded: DecodedImage) -> int:
+        return decoded.nbytes
+
+    def freeze(self, decoded: DecodedImage):
+        for arr in decoded.arrays:
+            arr.setflags(write=False)
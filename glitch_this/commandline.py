@@ -1,12 +1,20 @@
 #!/usr/bin/env python3
 import argparse
+import importlib
+import io
 import os
+import sys
 from datetime import datetime
 from pathlib import Path
 from time import time
 from typing import Dict
 
+from PIL import Image
+
 from glitch_this import ImageGlitcher
+from glitch_this.atlas import save_atlas
+from glitch_this.gif_optimizer import save_optimized_gif
+from glitch_this.renditions import check_renditions, convert_for_format, parse_rendition, render_renditions
 
 
 def read_version() -> str:
@@ -51,11 +59,23 @@ def is_latest(version: str) -> bool:
     return version == latest_version
 
 
+# Subcommands (i.e `glitch_this bench ...`), mapped to the module whose main() handles them
+subcommands = {
+    'archive': 'glitch_this.archive',
+    'batch': 'glitch_this.batch',
+    'bench': 'glitch_this.bench',
+    'calibrate': 'glitch_this.estimate',
+    'enqueue': 'glitch_this.workqueue:enqueue_main',
+    'watch': 'glitch_this.watch',
+    'worker': 'glitch_this.workqueue',
+}
+
+
 def get_help(glitch_min: float, glitch_max: float) -> Dict:
     help_text = dict()
-    help_text['path'] = 'Relative or Absolute string path to source image'
-    help_text['level'] = f'Number between {glitch_min} and {
-        glitch_max}, inclusive, representing amount of glitchiness'
+    help_text['path'] = 'Relative or Absolute string path to source image, "-" to read it from stdin'
+    help_text['level'] = (f'Number between {glitch_min} and {glitch_max}, '
+                          'inclusive, representing amount of glitchiness')
     help_text['color'] = 'Include if you want to add color offset'
     help_text['scan'] = 'Include if you want to add scan lines effect\nDefaults to False'
     help_text['seed'] = 'Set a random seed for generating similar images across runs'
@@ -63,20 +83,40 @@ def get_help(glitch_min: float, glitch_max: float) -> Dict:
     help_text['frames'] = 'Number of frames to include in output GIF, default - 23'
     help_text['step'] = 'Glitch every step\'th frame of output GIF, default - 1 (every frame)'
     help_text['increment'] = 'Increment glitch_amount by given value after glitching every frame of output GIF'
-    help_text['cycle'] = f'Include if glitch_amount should be cycled back to {
-        glitch_min} or {glitch_max} if it over/underflows'
+    help_text['cycle'] = ('Include if glitch_amount should be cycled back to '
+                          f'{glitch_min} or {glitch_max} if it over/underflows')
     help_text['duration'] = 'How long to display each frame (in centiseconds), default - 200'
     help_text['relative_duration'] = 'Multiply given value to input GIF\'s original duration and use that as duration'
     help_text['loop'] = 'How many times the glitched GIF should loop, default - 0 (infinite loop)'
+    help_text['optimize_gif'] = 'Include to merge duplicate frames and only encode the changed part of each frame of output GIF'
     help_text['inputgif'] = 'Include if input image is GIF'
+    help_text['keep_palette'] = 'Include to glitch the palette indices of the input GIF directly, without RGBA conversion'
+    help_text['pipelined'] = 'Include to decode, glitch and encode the frames of the input GIF at the same time, on separate threads'
     help_text['force'] = 'Forcefully overwrite output file'
-    help_text['out'] = 'Explcitly supply full/relative path to output file'
+    help_text['mode'] = 'Image mode to glitch in (i.e L, RGB, CMYK), "native" keeps the input\'s own mode and bit depth'
+    help_text['threads'] = 'Number of threads to glitch each image/frame with, default - 1'
+    help_text['roi'] = 'Only glitch the box with the given left, upper, right and lower pixel coordinates'
+    help_text['mask'] = 'Path to a mask image of the same size as the input, only its nonzero pixels are glitched'
+    help_text['out'] = 'Explcitly supply full/relative path to output file, "-" to write it to stdout\nDefaults to stdout if input is read from stdin'
+    help_text['format'] = 'Image format of the output (i.e PNG, JPEG), defaults to the output file\'s extension\nFor stdout, defaults to GIF for GIF output and to the input image\'s format otherwise'
     help_text["output_frames"] = "Output individual frames of the glitched GIF as separate images"
+    help_text['max_bytes'] = 'Fit the output GIF in this many bytes, by choosing its frames, scale and palette size up front'
+    help_text['max_seconds'] = 'Fit the glitching and saving of the output GIF in this many seconds (best effort), like --max-bytes'
+    help_text['atlas'] = ('Include to save the frames of the output GIF as one sprite sheet image (PNG, unless -fmt is given) '
+                          'instead\nAlong with a <outfile>.json frame map')
+    help_text['rendition'] = ('Also save the output as SIZE:FORMAT[:QUALITY] (i.e full:png, 1200:jpeg:85, 320x240:webp), '
+                              'can be given multiple times\nSaved as <outfile>_<SIZE>.<format>, instead of the outfile itself')
 
     return help_text
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in subcommands:
+        # Hand over the remaining arguments to the subcommand
+        # As module[:function], the function defaults to main
+        module, _, function = subcommands[sys.argv[1]].partition(':')
+        return getattr(importlib.import_module(module), function or 'main')(sys.argv[2:])
+
     glitch_min, glitch_max = 0.1, 10.0
     current_version = ImageGlitcher.__version__
     help_text = get_help(glitch_min, glitch_max)
@@ -84,7 +124,8 @@ def main():
     argparser = argparse.ArgumentParser(description='glitch_this: Glitchify images and GIFs, with highly customizable options!\n\n'
                                         '* Website: https://github.com/TotallyNotChase/glitch-this \n'
                                         f'* Version: {current_version}\n'
-                                        '* Changelog: https://github.com/TotallyNotChase/glitch-this/blob/master/CHANGELOG.md',
+                                        '* Changelog: https://github.com/TotallyNotChase/glitch-this/blob/master/CHANGELOG.md\n'
+                                        f'* Subcommands: {", ".join(subcommands)} (see glitch_this <subcommand> -h)',
                                         formatter_class=argparse.RawTextHelpFormatter)
     argparser.add_argument('--version', action='version',
                            version=f'glitch_this {current_version}')
@@ -100,6 +141,8 @@ def main():
                            help=help_text['gif'])
     argparser.add_argument('-ig', '--inputgif', dest='input_gif', action='store_true',
                            help=help_text['inputgif'])
+    argparser.add_argument('-kp', '--keep-palette', dest='keep_palette', action='store_true',
+                           help=help_text['keep_palette'])
     argparser.add_argument('-f', '--force', dest='force', action='store_true',
                            help=help_text['force'])
     argparser.add_argument('-sd', '--seed', dest='seed', metavar='Seed', type=float, default=None,
@@ -118,10 +161,31 @@ def main():
                            help=help_text['relative_duration'])
     argparser.add_argument('-l', '--loop', dest='loop', metavar='Loop_Count', type=int, default=0,
                            help=help_text['loop'])
+    argparser.add_argument('-og', '--optimize-gif', dest='optimize_gif', action='store_true',
+                           help=help_text['optimize_gif'])
+    argparser.add_argument('-m', '--mode', dest='mode', metavar='Mode', type=str, default=None,
+                           help=help_text['mode'])
+    argparser.add_argument('-pl', '--pipelined', dest='pipelined', action='store_true',
+                           help=help_text['pipelined'])
+    argparser.add_argument('-t', '--threads', dest='threads', metavar='Threads', type=int, default=1,
+                           help=help_text['threads'])
+    argparser.add_argument('-r', '--roi', dest='roi', metavar=('Left', 'Upper', 'Right', 'Lower'), type=int, nargs=4,
+                           default=None, help=help_text['roi'])
+    argparser.add_argument('-mk', '--mask', dest='mask', metavar='Mask_Path', type=str, default=None,
+                           help=help_text['mask'])
     argparser.add_argument('-o', '--outfile', dest='outfile', metavar='Outfile_path', type=str,
                            help=help_text['out'])
+    argparser.add_argument('-fmt', '--format', dest='format', metavar='Format', type=str, default=None,
+                           help=help_text['format'])
     argparser.add_argument("-of", "--output-frames", dest="output_frames",
                            action="store_true", help=help_text["output_frames"])
+    argparser.add_argument('-mb', '--max-bytes', dest='max_bytes', metavar='Max_Bytes', type=int, default=None,
+                           help=help_text['max_bytes'])
+    argparser.add_argument('-ms', '--max-seconds', dest='max_seconds', metavar='Max_Seconds', type=float, default=None,
+                           help=help_text['max_seconds'])
+    argparser.add_argument('-at', '--atlas', dest='atlas', action='store_true', help=help_text['atlas'])
+    argparser.add_argument('-rn', '--rendition', dest='renditions', metavar='Rendition', type=parse_rendition,
+                           action='append', default=None, help=help_text['rendition'])
     args = argparser.parse_args()
 
     # Sanity check inputs
@@ -131,61 +195,187 @@ def main():
         raise ValueError('Loop must be greater than or equal to 0')
     if not args.frames > 0:
         raise ValueError('Frames must be greater than 0')
-    if not os.path.isfile(args.src_img_path):
+    if not args.threads > 0:
+        raise ValueError('Threads must be greater than 0')
+    if args.src_img_path != '-' and not os.path.isfile(args.src_img_path):
         raise FileNotFoundError('No image found at given path')
     if args.output_frames and not args.gif:
         raise ValueError("Cannot output frames without GIF output enabled")
+    if args.keep_palette and not args.input_gif:
+        raise ValueError('Cannot keep palette unless input is a GIF')
+    if args.mode and args.input_gif:
+        raise ValueError('Cannot set mode when input is a GIF')
+    if args.pipelined and (not args.input_gif or args.keep_palette):
+        raise ValueError('Can only pipeline input GIFs, without keeping their palette')
+    if (args.roi or args.mask) and args.input_gif:
+        raise ValueError('Cannot set roi or mask when input is a GIF')
+    if args.mask and not os.path.isfile(args.mask):
+        raise FileNotFoundError('No mask image found at given path')
+    if args.optimize_gif and args.output_frames:
+        raise ValueError('Cannot optimize GIF when outputting frames')
+    if args.renditions and (args.output_frames or args.format):
+        raise ValueError('Cannot output frames or set format along with renditions')
+    # Budgeted GIFs are made by glitch_budgeted, which picks frames, scale and palette itself
+    budgeted = args.max_bytes is not None or args.max_seconds is not None
+    if budgeted and (not args.gif or args.input_gif):
+        raise ValueError('Can only set max bytes or max seconds for GIF output from an image')
+    if budgeted and (args.output_frames or args.renditions or args.roi or args.mask):
+        raise ValueError('Cannot output frames or renditions, or set roi or mask, along with max bytes or max seconds')
+    if args.atlas and not (args.gif or args.input_gif):
+        raise ValueError('Can only save an atlas of GIF output')
+    if args.atlas and (args.output_frames or args.optimize_gif or args.renditions or budgeted):
+        raise ValueError('Cannot output frames, renditions or optimized/budgeted GIFs along with an atlas')
+    if args.renditions:
+        args.renditions = check_renditions(args.renditions, animated=args.gif or args.input_gif)
 
-    # Set up full_path, for output saving location
-    out_path, out_file = os.path.split(Path(args.src_img_path))
-    out_filename, out_fileex = out_file.rsplit('.', 1)
-    out_filename = 'glitched_' + out_filename
-    # Output file extension should be '.gif' if output file is going to be a gif
-    if args.gif:
-        out_fileex = "gif"
-    elif args.output_frames:
-        out_fileex = "png"
+    # Output goes to stdout if asked for, or by default when input comes from stdin
+    to_stdout = args.outfile == '-' or (args.src_img_path == '-' and not args.outfile)
+    if to_stdout and (args.output_frames or args.renditions or args.atlas):
+        raise ValueError('Cannot output frames, renditions or an atlas to stdout')
+    # Messages go to stderr when the output image goes to stdout
+    log = sys.stderr if to_stdout else sys.stdout
+
+    if args.src_img_path == '-':
+        # Read the whole input image from stdin, glitch_image/glitch_gif take Image objects too
+        src_img = Image.open(io.BytesIO(sys.stdin.buffer.read()))
+        src_format = src_img.format
     else:
-        out_fileex = out_fileex
-
-    if args.outfile:
-        # If output file path is already given
-        # Overwrite the previous values
-        out_path, out_file = os.path.split(Path(args.outfile))
-        if out_path != "" and not os.path.exists(out_path):
-            raise Exception("Given outfile path, " +
-                            out_path + ", does not exist")
-        # The extension in user provided outfile path is ignored
-        out_filename = out_file.rsplit(".", 1)[0]
-
-    # Now create the full path
-    full_path = os.path.join(out_path, f"{out_filename}.{out_fileex}")
-
-    # If output type is frames, we need to check if files exist for each frame
-    if args.output_frames:
-        for i in range(args.frames):
-            frame_path = os.path.join(
-                out_path, (f"{out_filename}_{i}.{out_fileex}"))
-            if os.path.exists(frame_path) and not args.force:
+        src_img = args.src_img_path
+        src_format = Image.registered_extensions().get(os.path.splitext(src_img)[1].lower())
+    # Format to write stdout output in
+    out_format = args.format or ('GIF' if args.gif or args.input_gif else src_format)
+    if to_stdout and out_format is None:
+        raise ValueError('Cannot tell output format, use -fmt/--format')
+
+    if to_stdout:
+        # Nothing to set up, the output is written to stdout
+        full_path = None
+    else:
+        # Input from stdin always comes with an outfile here, named after it (with the input format's extension)
+        src_name = args.src_img_path
+        if args.src_img_path == '-':
+            src_name = f'{os.path.splitext(args.outfile)[0]}.{src_format.lower()}'
+        # Set up full_path, for output saving location
+        out_path, out_file = os.path.split(Path(src_name))
+        out_filename, out_fileex = out_file.rsplit('.', 1)
+        out_filename = 'glitched_' + out_filename
+        # Output file extension should be '.gif' if output file is going to be a gif
+        # Unless its frames go into an atlas image
+        if args.atlas:
+            out_fileex = (args.format or 'png').lower()
+        elif args.gif:
+            out_fileex = "gif"
+        elif args.format:
+            # Or match the format that was asked for
+            out_fileex = args.format.lower()
+        elif args.output_frames:
+            out_fileex = "png"
+        else:
+            out_fileex = out_fileex
+
+        if args.outfile:
+            # If output file path is already given
+            # Overwrite the previous values
+            out_path, out_file = os.path.split(Path(args.outfile))
+            if out_path != "" and not os.path.exists(out_path):
+                raise Exception("Given outfile path, " +
+                                out_path + ", does not exist")
+            # The extension in user provided outfile path is ignored
+            out_filename = out_file.rsplit(".", 1)[0]
+
+        # Now create the full path
+        full_path = os.path.join(out_path, f"{out_filename}.{out_fileex}")
+
+        # Renditions are saved next to each other, named after their size
+        if args.renditions:
+            rendition_paths = []
+            for size, format, _ in args.renditions:
+                if size is None:
+                    label = 'full'
+                elif isinstance(size, int):
+                    label = str(size)
+                else:
+                    label = f'{size[0]}x{size[1]}'
+                rendition_path = os.path.join(out_path, f"{out_filename}_{label}.{format.lower()}")
+                if rendition_path in rendition_paths:
+                    raise ValueError(f'Renditions must differ in size or format, {rendition_path} is given twice')
+                if os.path.exists(rendition_path) and not args.force:
+                    raise Exception(
+                        rendition_path + " already exists\nCannot overwrite "
+                        "existing file unless -f or --force is included\nProgram Aborted"
+                    )
+                rendition_paths.append(rendition_path)
+        # If output type is frames, we need to check if files exist for each frame
+        elif args.output_frames:
+            for i in range(args.frames):
+                frame_path = os.path.join(
+                    out_path, (f"{out_filename}_{i}.{out_fileex}"))
+                if os.path.exists(frame_path) and not args.force:
+                    raise Exception(
+                        frame_path + " already exists\nCannot overwrite "
+                        "existing file unless -f or --force is included\nProgram Aborted"
+                    )
+        else:
+            if args.atlas and os.path.exists(os.path.join(out_path, f'{out_filename}.json')) and not args.force:
                 raise Exception(
-                    frame_path + " already exists\nCannot overwrite "
+                    os.path.join(out_path, f'{out_filename}.json') + " already exists\nCannot overwrite "
+                    "existing file unless -f or --force is included\nProgram Aborted"
+                )
+            if os.path.exists(full_path) and not args.force:
+                raise Exception(
+                    full_path + " already exists\nCannot overwrite "
                     "existing file unless -f or --force is included\nProgram Aborted"
                 )
-    else:
-        if os.path.exists(full_path) and not args.force:
-            raise Exception(
-                full_path + " already exists\nCannot overwrite "
-                "existing file unless -f or --force is included\nProgram Aborted"
-            )
+
+    # Where the image is saved, full_path or stdout
+    target = sys.stdout.buffer if to_stdout else full_path
+    destination = 'stdout' if to_stdout else f'"{full_path}"'
+    # With -pl, a plain GIF output is encoded as its frames are glitched
+    # Unless its duration is relative to the input GIF's, which is only known once every frame went through
+    streamed = args.pipelined and not (args.rel_duration or args.optimize_gif or args.output_frames or args.renditions
+                                       or args.atlas)
 
     # Actual work begins here
     glitcher = ImageGlitcher()
     global version_filepath
     version_filepath = os.path.join(glitcher.lib_path, 'version.info')
     t0 = time()
-    if not args.input_gif:
+    if budgeted:
+        # Get the encoded GIF, along with the settings that were picked for it
+        glitch_data, budget_settings = glitcher.glitch_budgeted(src_img, args.glitch_level,
+                                                                max_bytes=args.max_bytes,
+                                                                max_seconds=args.max_seconds,
+                                                                frames=args.frames,
+                                                                duration=args.duration,
+                                                                loop=args.loop,
+                                                                mode=args.mode,
+                                                                glitch_change=args.increment,
+                                                                cycle=args.cycle,
+                                                                scan_lines=args.scan_lines,
+                                                                color_offset=args.color,
+                                                                seed=args.seed,
+                                                                step=args.step,
+                                                                threads=args.threads)
+        args.frames, args.duration = budget_settings['frames'], budget_settings['duration']
+    elif args.atlas:
+        # Get the atlas of every glitched frame, and its frame map
+        glitch_kwargs = dict(glitch_change=args.increment, cycle=args.cycle, scan_lines=args.scan_lines,
+                             color_offset=args.color, seed=args.seed, step=args.step, threads=args.threads)
+        if args.input_gif:
+            glitch_kwargs.update(keep_palette=args.keep_palette, pipelined=args.pipelined)
+        else:
+            glitch_kwargs.update(frames=args.frames, mode=args.mode)
+        # The frame map of an input GIF gets its own duration, if a relative one was given
+        glitch_atlas, frame_map = glitcher.glitch_atlas(src_img, args.glitch_level,
+                                                        duration=None if args.rel_duration else args.duration,
+                                                        loop=args.loop, **glitch_kwargs)
+        if args.rel_duration:
+            for frame in frame_map['frames']:
+                frame['duration'] = int(args.rel_duration * frame['duration'])
+        args.frames = len(frame_map['frames'])
+    elif not args.input_gif:
         # Get glitched image or GIF (from image)
-        glitch_img = glitcher.glitch_image(args.src_img_path, args.glitch_level,
+        glitch_img = glitcher.glitch_image(src_img, args.glitch_level,
                                            glitch_change=args.increment,
                                            cycle=args.cycle,
                                            scan_lines=args.scan_lines,
@@ -193,16 +383,36 @@ def main():
                                            seed=args.seed,
                                            gif=args.gif,
                                            frames=args.frames,
-                                           step=args.step)
+                                           step=args.step,
+                                           threads=args.threads,
+                                           mode=args.mode,
+                                           roi=tuple(args.roi) if args.roi else None,
+                                           mask=Image.open(args.mask) if args.mask else None)
+    elif streamed:
+        # Get glitched GIF (from GIF), saved as its frames are glitched
+        src_duration, args.frames = glitcher.glitch_gif_encoded(src_img, args.glitch_level, target,
+                                                                duration=args.duration,
+                                                                loop=args.loop,
+                                                                glitch_change=args.increment,
+                                                                cycle=args.cycle,
+                                                                scan_lines=args.scan_lines,
+                                                                color_offset=args.color,
+                                                                seed=args.seed,
+                                                                step=args.step,
+                                                                threads=args.threads,
+                                                                pipelined=args.pipelined)
     else:
         # Get glitched image or GIF (from GIF)
-        glitch_img, src_duration, args.frames = glitcher.glitch_gif(args.src_img_path, args.glitch_level,
+        glitch_img, src_duration, args.frames = glitcher.glitch_gif(src_img, args.glitch_level,
                                                                     glitch_change=args.increment,
                                                                     cycle=args.cycle,
                                                                     scan_lines=args.scan_lines,
                                                                     color_offset=args.color,
                                                                     seed=args.seed,
-                                                                    step=args.step)
+                                                                    step=args.step,
+                                                                    keep_palette=args.keep_palette,
+                                                                    threads=args.threads,
+                                                                    pipelined=args.pipelined)
         # Set args.gif to true if it isn't already in this case
         args.gif = True
         # Set args.duration to src_duration * relative duration, if one was given
@@ -211,14 +421,58 @@ def main():
     t1 = time()
     # End of glitching
     t2 = time()
-    # Save the image
-    if not args.gif:
-        glitch_img.save(full_path, compress_level=3)
+    # Save the image, to full_path or stdout
+    if budgeted:
+        if to_stdout:
+            sys.stdout.buffer.write(glitch_data)
+        else:
+            with open(full_path, 'wb') as gif_file:
+                gif_file.write(glitch_data)
+        t3 = time()
+        print(
+            f'Budgeted glitched GIF saved in {destination}\nFrames = {args.frames}, Duration = {args.duration}, '
+            f'Size = {budget_settings["size"][0]}x{budget_settings["size"][1]}, Colors = {budget_settings["colors"]}, '
+            f'Bytes = {budget_settings["bytes"]}', file=log
+        )
+    elif streamed:
+        # Already saved while glitching
+        t3 = time()
+        print(
+            f'Glitched GIF saved in {destination}\n'
+            f'Frames = {args.frames}, Duration = {args.duration}, Loop = {args.loop}', file=log
+        )
+    elif args.atlas:
+        save_atlas(glitch_atlas, frame_map, full_path, format=args.format)
+        t3 = time()
+        print(f'Glitched atlas saved in {destination}, with its frame map\nFrames = {args.frames}, '
+              f'Columns = {frame_map["meta"]["columns"]}, Loop = {args.loop}', file=log)
+    elif args.renditions:
+        # One glitch, every rendition encoded in parallel
+        encoded = render_renditions(glitch_img, args.renditions, duration=args.duration, loop=args.loop,
+                                    optimize_gif=args.optimize_gif)
+        for rendition_path, data in zip(rendition_paths, encoded):
+            with open(rendition_path, 'wb') as rendition_file:
+                rendition_file.write(data)
+        t3 = time()
+        print(f'Glitched renditions saved in "{out_filename}_*"', file=log)
+    elif not args.gif:
+        save_format = out_format if to_stdout else args.format
+        # Without -fmt, the format is told from the output file's extension
+        if save_format is None and not to_stdout:
+            save_format = Image.registered_extensions().get(os.path.splitext(target)[1].lower())
+        convert_for_format(glitch_img, save_format).save(target, format=save_format, compress_level=3)
         t3 = time()
-        print('Glitched Image saved in "{}"'.format(full_path))
+        print(f'Glitched Image saved in {destination}', file=log)
+    elif args.optimize_gif:
+        save_optimized_gif(glitch_img, target, duration=args.duration, loop=args.loop)
+        t3 = time()
+        print(
+            f'Optimized glitched GIF saved in {destination}\n'
+            f'Frames = {args.frames}, Duration = {args.duration}, Loop = {args.loop}', file=log
+        )
     elif not args.output_frames:
         glitch_img[0].save(
-            full_path,
+            target,
             format="GIF",
             append_images=glitch_img[1:],
             save_all=True,
@@ -228,22 +482,25 @@ def main():
         )
         t3 = time()
         print(
-            f'Glitched GIF saved in "{full_path}"\nFrames = {
-                args.frames}, Duration = {args.duration}, Loop = {args.loop}'
+            f'Glitched GIF saved in {destination}\n'
+            f'Frames = {args.frames}, Duration = {args.duration}, Loop = {args.loop}', file=log
         )
     else:
         for i, frame in enumerate(glitch_img):
             frame_path = os.path.join(
                 out_path, (f"{out_filename}_{i}.{out_fileex}"))
-            frame.save(frame_path, compress_level=3)
+            frame.save(frame_path, format=args.format, compress_level=3)
         t3 = time()
-        print(f'Glitched frames saved in "{out_filename}_*.png"')
-    print(f"Time taken to glitch: {t1 - t0}")
-    print(f"Time taken to save: {t3 - t2}")
-    print(f"Total Time taken: {t3 - t0}")
+        print(f'Glitched frames saved in "{out_filename}_*.png"', file=log)
+    if to_stdout:
+        sys.stdout.buffer.flush()
+    print(f"Time taken to glitch: {t1 - t0}", file=log)
+    print(f"Time taken to save: {t3 - t2}", file=log)
+    print(f"Total Time taken: {t3 - t0}", file=log)
 
     # Let the user know if new version is available
-    if not is_latest(current_version):
+    # Skipped when writing to stdout, pipelines shouldn't wait on the network
+    if not to_stdout and not is_latest(current_version):
         print('A new version of "glitch-this" is available. Please consider upgrading via `pip3 install --upgrade glitch-this`')
 
 
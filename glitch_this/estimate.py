@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+ Cost estimates of glitch jobs, for admission control
+
+ ImageGlitcher.estimate predicts the peak memory, output size and render time of a job
+ from the header of its input alone (size, mode and number of frames), nothing is decoded
+ Memory is counted from the images and arrays the job holds at once, render time and
+ output size come from per byte rates, measured on the local machine by calibrate
+ The cost of glitching a GIF depends on how well its frames compress, so GIF rates are
+ also per byte of the encoded input, which is known without decoding it
+
+ Usage: glitch_this calibrate [samples...] [-o <model.json>] [options] (see glitch_this calibrate -h)
+"""
+import argparse
+import io
+import json
+import os
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from glitch_this.gif_optimizer import no_dither
+
+# Rates of the default model, measured on a single core of a cloud VM
+DEFAULT_RATES = {
+    # Seconds per byte of decoded pixels, for decoding the input
+    'decode': 1e-8,
+    # Seconds per byte of pixels, for glitching one frame
+    'glitch': 1.2e-9,
+    # Extra seconds per byte of pixels, for the color offset and the scan lines of one frame
+    'color_offset': 1e-10,
+    'scan_lines': 1e-10,
+    # Seconds per byte of pixels, for encoding a frame as PNG in memory and decoding it back
+    'roundtrip': 5e-8,
+    # Encoded bytes per byte of pixels of PNG/JPEG outputs
+    'png': 0.55,
+    'jpeg': 0.05,
+    # Encoded bytes per pixel per frame of GIF outputs
+    'gif': 0.17,
+    # Seconds of glitch_gif per pixel of a frame, plus seconds per byte the frame takes in the input GIF:
+    # for decoding every frame (decode stage), glitching a frame (glitch stage),
+    # and glitching a frame with keep_palette
+    'gif_decode': 6e-9,
+    'gif_decode_data': 9e-9,
+    'gif_glitch': 2e-9,
+    'gif_glitch_data': 0.0,
+    'gif_palette': 8e-9,
+    'gif_palette_data': 1.2e-8,
+    # Seconds each frame takes in the same stages whatever its size (calls, checks, small allocations)
+    'gif_decode_frame': 3.5e-5,
+    'gif_glitch_frame': 7.5e-5,
+    'gif_palette_frame': 1.5e-4,
+    # Encoded bytes of glitch_gif outputs per byte of the input GIF
+    'gif_output': 1.0,
+}
+
+# Number of items a pipelined glitch_gif holds at once, per stage (see pipeline.py)
+PIPELINE_ITEMS = 3
+
+
+def bytes_per_pixel(mode: str) -> int:
+    # Size of one pixel of mode, in an array (as np.asarray gives it)
+    return np.asarray(Image.new(mode, (1, 1))).nbytes
+
+
+def region_fraction(size: Tuple[int, int], roi: Optional[Tuple[int, int, int, int]] = None,
+                    mask: Optional[Union[Image.Image, np.ndarray]] = None) -> float:
+    # Fraction of an image of size that glitch_image glitches with roi/mask: roi, or the mask's bounding box
+    if roi is not None:
+        left, top, right, bottom = roi
+    elif mask is not None:
+        if isinstance(mask, Image.Image):
+            box = (mask if mask.mode in ('1', 'L') else mask.convert('L')).getbbox()
+        else:
+            mask = np.asarray(mask).astype(bool)
+            rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+            box = (cols[0], rows[0], cols[-1] + 1, rows[-1] + 1) if len(rows) else None
+        if box is None:
+            return 0.0
+        left, top, right, bottom = box
+    else:
+        return 1.0
+    return min(max(right - left, 0) * max(bottom - top, 0) / (size[0] * size[1]), 1.0)
+
+
+def encoded_size(src_img: Union[str, bytes, Image.Image]) -> Optional[int]:
+    # Size of the encoded src_img in bytes, None for Image objects
+    if isinstance(src_img, str):
+        return os.path.getsize(src_img)
+    if isinstance(src_img, (bytes, bytearray, memoryview)):
+        return len(src_img)
+    return None
+
+
+def read_header(src_img: Union[str, bytes, Image.Image]) -> Tuple[Image.Image, bool]:
+    # Opens src_img lazily (only the header is read), returns it and whether it's an animated GIF
+    if isinstance(src_img, str):
+        img = Image.open(src_img)
+    elif isinstance(src_img, (bytes, bytearray, memoryview)):
+        img = Image.open(io.BytesIO(src_img))
+    else:
+        img = src_img
+    return img, img.format == 'GIF' and getattr(img, 'n_frames', 1) > 1
+
+
+class CostModel:
+    """
+     Predicts the cost of glitch jobs from per byte rates (see DEFAULT_RATES)
+
+     PARAMETERS:-
+
+     path: JSON file to load calibrated rates from (see calibrate), None uses the default rates
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.rates = dict(DEFAULT_RATES)
+        if path is not None:
+            with open(path, 'r') as rates_file:
+                rates = json.load(rates_file)
+            unknown = set(rates) - set(DEFAULT_RATES)
+            if unknown:
+                raise ValueError(f'Unknown rates: {", ".join(sorted(unknown))}')
+            self.rates.update(rates)
+
+    def save(self, path: str):
+        # Writes the rates to path as JSON, atomically
+        tmp_path = f'{path}.tmp{os.getpid()}'
+        with open(tmp_path, 'w') as rates_file:
+            json.dump(self.rates, rates_file, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def output_bytes(self, pixel_bytes: int, pixels: int, frames: int, format: Optional[str]) -> int:
+        # Encoded size of an output of frames frames (GIF) or of a still image in format
+        if frames > 1 or format == 'GIF':
+            return round(self.rates['gif'] * pixels * frames)
+        return round(self.rates['jpeg' if format == 'JPEG' else 'png'] * pixel_bytes)
+
+    def estimate_image(self, size: Tuple[int, int], src_mode: str, mode: str, format: Optional[str],
+                       gif: bool = False, frames: int = 23, step: int = 1, color_offset: bool = False,
+                       scan_lines: bool = False, seekable: bool = False, workers: int = 1,
+                       roundtrip: bool = True, region: float = 1.0) -> Dict[str, Union[int, float]]:
+        """
+         Cost of glitch_image on an image of size and src_mode, glitched in mode
+         roundtrip: Whether frames of GIF outputs are encoded as PNG and decoded back (mode=None)
+         region: Fraction of the image glitched (roi/mask, see region_fraction), the whole image
+                 is still decoded and every output frame is still whole
+        """
+        pixels = size[0] * size[1]
+        src_bytes = pixels * bytes_per_pixel(src_mode)
+        raw = pixels * bytes_per_pixel(mode)
+        frames = frames if gif else 1
+        glitched = -(-frames // step)
+
+        # Decoded (and converted) input, inputarr, outputarr and the output image
+        peak = src_bytes + 4 * raw
+        seconds = self.rates['decode'] * src_bytes
+        frame_seconds = region * raw * (self.rates['glitch'] + color_offset * self.rates['color_offset']
+                               + scan_lines * self.rates['scan_lines'])
+        render_seconds = glitched * frame_seconds
+        if gif:
+            # Every frame is kept, plus a frame being encoded and decoded back
+            peak += frames * raw + (2 * raw if roundtrip else 0)
+            if roundtrip:
+                render_seconds += glitched * self.rates['roundtrip'] * raw
+            if seekable and workers > 1:
+                # Every worker renders into an outputarr of its own
+                peak += (workers - 1) * raw
+                render_seconds /= min(workers, os.cpu_count() or 1)
+        return {'frames': frames, 'peak_bytes': peak, 'seconds': seconds + render_seconds,
+                'output_bytes': self.output_bytes(raw, pixels, frames, 'GIF' if gif else format)}
+
+    def estimate_gif(self, size: Tuple[int, int], frames: int, step: int = 1, color_offset: bool = False,
+                     scan_lines: bool = False, keep_palette: bool = False, pipelined: bool = False,
+                     data_bytes: Optional[int] = None) -> Dict[str, Union[int, float]]:
+        """
+         Cost of glitch_gif on a GIF of size with frames frames
+         data_bytes: Size of the encoded GIF, None to take a typical GIF's (see the gif rate)
+        """
+        pixels = size[0] * size[1]
+        glitched = -(-frames // step)
+        # Frames are glitched as palette indices with keep_palette, as RGBA otherwise
+        raw = pixels * (1 if keep_palette else 4)
+        if data_bytes is None:
+            data_bytes = self.rates['gif'] * pixels * frames
+        # Bytes each frame takes in the input GIF
+        frame_data = data_bytes / frames
+
+        def stage_seconds(rate: str) -> float:
+            # Seconds of one frame going through the stages of rate
+            return self.rates[rate] * pixels + self.rates[f'{rate}_data'] * frame_data + self.rates[f'{rate}_frame']
+
+        # The GIF's current frame, decoded by pillow (as RGBA after the first one)
+        peak = pixels * 4
+        # Every glitched frame is kept, plus the frame being glitched (as in estimate_image)
+        peak += frames * raw + 4 * raw
+        if keep_palette:
+            seconds = frames * stage_seconds('gif_palette')
+        else:
+            seconds = frames * stage_seconds('gif_decode') + glitched * stage_seconds('gif_glitch')
+            peak += 2 * raw
+            if pipelined:
+                # Frames waiting in the queues after the decode and glitch stages
+                peak += 2 * PIPELINE_ITEMS * raw
+        seconds += glitched * raw * (color_offset * self.rates['color_offset'] + scan_lines * self.rates['scan_lines'])
+        return {'frames': frames, 'peak_bytes': peak, 'seconds': seconds,
+                'output_bytes': round(self.rates['gif_output'] * data_bytes)}
+
+
+def sample_image(size: Tuple[int, int]) -> Image.Image:
+    # A synthetic photo-like RGB image: smooth gradients, a few shapes and some noise
+    width, height = size
+    rng = np.random.RandomState(0)
+    y, x = np.mgrid[0:height, 0:width]
+    arr = np.stack([x * 255 // max(width - 1, 1), y * 255 // max(height - 1, 1),
+                    ((x + y) * 255 // max(width + height - 2, 1))], axis=-1).astype(np.int16)
+    for _ in range(12):
+        cx, cy, radius = rng.randint(width), rng.randint(height), rng.randint(4, max(5, min(size) // 4))
+        arr[(x - cx) ** 2 + (y - cy) ** 2 < radius ** 2] = rng.randint(0, 256, 3)
+    arr += rng.randint(-8, 9, arr.shape)
+    return Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8), 'RGB')
+
+
+def best_time(function, repeats: int) -> float:
+    # Fastest of repeats runs of function, in seconds
+    best = None
+    for _ in range(repeats):
+        started = perf_counter()
+        function()
+        elapsed = perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def extra_time(function, extra, repeats: int) -> float:
+    """
+     Median of how much longer extra takes than function, in seconds
+     Both are timed in turns, so that they see the same load of the machine
+    """
+    differences = []
+    for _ in range(3 * repeats):
+        differences.append(best_time(extra, 1) - best_time(function, 1))
+    return float(np.median(differences))
+
+
+def sample_gif(glitcher, sample: Image.Image, colors: int, frames: int = 6) -> bytes:
+    # An animated GIF of frames glitched out of sample, with a palette of colors colors
+    glitched = glitcher.glitch_image(sample, 3, seed=1, gif=True, frames=frames, glitch_change=1)
+    glitched = [frame.quantize(colors, dither=no_dither()) for frame in glitched]
+    buffer = io.BytesIO()
+    glitched[0].save(buffer, format='GIF', append_images=glitched[1:], save_all=True, duration=100, loop=0)
+    return buffer.getvalue()
+
+
+def gif_stage_seconds(glitcher, data: bytes, repeats: int = 3) -> Dict[str, float]:
+    # Seconds per frame of each stage of glitch_gif (see estimate_gif) on the animated GIF data
+    # Imported here, glitch_this.py imports this module
+    from glitch_this.glitch_this import gif_frames
+
+    def decode() -> List[Image.Image]:
+        with Image.open(io.BytesIO(data)) as gif:
+            return [frame.copy() for frame in gif_frames(gif)]
+    frames = decode()
+    # Each stage is timed on its own, timing glitch_gif with and without glitching frames would leave
+    # the glitch stage to the difference of two much longer timings, which is mostly noise on small GIFs
+    return {'gif_decode': best_time(decode, repeats) / len(frames),
+            'gif_glitch': best_time(lambda: [glitcher.glitch_image(frame, 5, mode='RGBA') for frame in frames],
+                                    repeats) / len(frames),
+            'gif_palette': best_time(lambda: glitcher.glitch_gif(Image.open(io.BytesIO(data)), 5, seed=1,
+                                                                 keep_palette=True), repeats) / len(frames)}
+
+
+def fit_rates(frame_data: List[float], seconds: List[float]) -> Tuple[float, float]:
+    """
+     Fits seconds = pixel_rate + data_rate * frame_data (both per pixel of a frame), by least squares
+     Returns (pixel_rate, data_rate), a rate that comes out negative is left out of the fit
+    """
+    frame_data, seconds = np.asarray(frame_data), np.asarray(seconds)
+    if len(set(frame_data)) > 1:
+        data_rate, pixel_rate = np.polyfit(frame_data, seconds, 1)
+        if data_rate > 0 and pixel_rate >= 0:
+            return float(pixel_rate), float(data_rate)
+        if data_rate > 0:
+            # Proportional to frame_data alone
+            return 0.0, float(np.sum(seconds * frame_data) / np.sum(frame_data ** 2))
+    return float(np.mean(seconds)), 0.0
+
+
+def calibrate(samples: Optional[List[Image.Image]] = None, size: Tuple[int, int] = (768, 512),
+              repeats: int = 3, gif_samples: Optional[List[bytes]] = None) -> CostModel:
+    """
+     Measures the rates of a CostModel on this machine, averaged over samples
+     (RGB images, typical of the inputs to expect), or a synthetic image of size
+
+     GIF rates are fitted on glitch_gif runs over gif_samples (encoded animated GIFs)
+     and over GIFs glitched out of samples, with small and full palettes
+    """
+    # Imported here, glitch_this.py imports this module
+    from glitch_this.glitch_this import ImageGlitcher
+
+    glitcher = ImageGlitcher()
+    samples = samples or [sample_image(size)]
+    measured = {rate: [] for rate in DEFAULT_RATES}
+    gif_samples = list(gif_samples or [])
+    for sample in samples:
+        sample = sample.convert('RGB')
+        raw = sample.width * sample.height * 3
+
+        png = io.BytesIO()
+        sample.save(png, format='PNG', compress_level=3)
+        measured['decode'].append(best_time(lambda: Image.open(io.BytesIO(png.getvalue())).convert('RGB'),
+                                            repeats) / raw)
+
+        def glitch(**params):
+            return lambda: glitcher.glitch_image(sample, 5, seed=1, **params)
+        measured['glitch'].append(best_time(glitch(), repeats) / raw)
+        # Both cost little next to the glitch itself, a single timing of each would be mostly noise
+        for rate in ('color_offset', 'scan_lines'):
+            extra = extra_time(glitch(), glitch(**{rate: True}), repeats) / raw
+            if extra > 0:
+                measured[rate].append(extra)
+
+        def roundtrip():
+            buffer = io.BytesIO()
+            sample.save(buffer, format='PNG', compress_level=3)
+            buffer.seek(0)
+            Image.open(buffer).copy()
+        measured['roundtrip'].append(best_time(roundtrip, repeats) / raw)
+
+        # Frames must differ, or the GIF would be saved with a single one
+        glitched = glitcher.glitch_image(sample, 5, seed=1, gif=True, frames=4, glitch_change=1)
+        for format in ('png', 'jpeg'):
+            buffer = io.BytesIO()
+            glitched[0].save(buffer, format=format.upper())
+            measured[format].append(len(buffer.getvalue()) / raw)
+        buffer = io.BytesIO()
+        glitched[0].save(buffer, format='GIF', append_images=glitched[1:], save_all=True)
+        measured['gif'].append(len(buffer.getvalue()) / (sample.width * sample.height * len(glitched)))
+
+        gif_samples += [sample_gif(glitcher, sample, colors) for colors in (8, 256)]
+
+    # Seconds per frame of each stage on a GIF of a few pixels, which is all the size independent part
+    # Timing it is cheap, more repeats keep the noise out of every per pixel rate it's taken off
+    tiny_gif = sample_gif(glitcher, sample_image((8, 8)), 256)
+    for stage, seconds in gif_stage_seconds(glitcher, tiny_gif, 4 * repeats).items():
+        measured[f'{stage}_frame'].append(seconds)
+    overhead = {stage: sum(measured[f'{stage}_frame']) / len(measured[f'{stage}_frame'])
+                for stage in ('gif_decode', 'gif_glitch', 'gif_palette')}
+
+    # Seconds per pixel of a frame, for each stage, and the bytes per pixel of a frame of each GIF
+    stages = {'gif_decode': [], 'gif_glitch': [], 'gif_palette': []}
+    frame_data = []
+    for data in gif_samples:
+        with Image.open(io.BytesIO(data)) as gif:
+            frames, pixels = gif.n_frames, gif.width * gif.height
+        if frames < 2:
+            raise ValueError('GIF samples must be animated')
+        for stage, seconds in gif_stage_seconds(glitcher, data, repeats).items():
+            stages[stage].append(max(seconds - overhead[stage], 0.0) / pixels)
+        frame_data.append(len(data) / frames / pixels)
+
+        glitched, duration, _ = glitcher.glitch_gif(Image.open(io.BytesIO(data)), 5, seed=1)
+        buffer = io.BytesIO()
+        glitched[0].save(buffer, format='GIF', append_images=glitched[1:], save_all=True, duration=duration, loop=0)
+        measured['gif_output'].append(len(buffer.getvalue()) / len(data))
+
+    model = CostModel()
+    model.rates.update({rate: sum(values) / len(values) for rate, values in measured.items() if values})
+    for stage, seconds in stages.items():
+        model.rates[stage], model.rates[f'{stage}_data'] = fit_rates(frame_data, seconds)
+    return model
+
+
+def get_parser() -> argparse.ArgumentParser:
+    argparser = argparse.ArgumentParser(prog='glitch_this calibrate',
+                                        description='Fit the cost model of ImageGlitcher.estimate on this machine')
+    argparser.add_argument('samples', metavar='Sample', type=str, nargs='*',
+                           help='Images typical of the inputs to expect (animated GIFs are also timed through '
+                                'glitch_gif), default - a synthetic image')
+    argparser.add_argument('-o', '--output', dest='output', type=str, default='cost_model.json',
+                           help='JSON file to write the model to, default - cost_model.json')
+    argparser.add_argument('--size', dest='size', type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'), default=(768, 512),
+                           help='Size of the synthetic image, default - 768 512')
+    argparser.add_argument('--repeats', dest='repeats', type=int, default=3,
+                           help='Times each measurement is repeated (the fastest one counts), default - 3')
+    return argparser
+
+
+def main(argv: Optional[List[str]] = None):
+    args = get_parser().parse_args(argv)
+    if not args.repeats > 0:
+        raise ValueError('Repeats must be greater than 0')
+    if not min(args.size) > 0:
+        raise ValueError('Size must be greater than 0')
+    samples = []
+    gif_samples = []
+    for path in args.samples:
+        with Image.open(path) as sample:
+            if sample.format == 'GIF' and getattr(sample, 'n_frames', 1) > 1:
+                with open(path, 'rb') as gif_file:
+                    gif_samples.append(gif_file.read())
+            samples.append(sample.convert('RGB'))
+
+    model = calibrate(samples, tuple(args.size), args.repeats, gif_samples)
+    model.save(args.output)
+    for rate, value in sorted(model.rates.items()):
+        print(f'{rate}: {value:.4g}')
+    print(f'Cost model saved in "{args.output}", load it with CostModel("{args.output}")')
+
+
+if __name__ == '__main__':
+    main()
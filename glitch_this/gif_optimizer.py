@@ -0,0 +1,268 @@
+"""
+ Smaller, faster GIF output for glitched animations
+
+ Glitched frames only differ from each other in the shifted row bands,
+ so instead of encoding every frame in full:
+ * Identical consecutive frames are merged into one, with a longer duration
+ * Every other frame is cropped to the bounding box of the pixels that changed since
+   the previous one, and pixels that didn't change are set to a transparent index
+   (shown from the previous frame), if that compresses better
+
+ Encode time and file size then scale with the amount of change, not frames x area
+
+ Pillow crops frames to what changed and merges identical ones on its own as well, keeping every
+ frame's own colors, which often compresses better than one shared palette
+ When most of every frame changed (so cropping saves little) and the palette wasn't narrowed down,
+ frames are encoded both ways and the smaller GIF is kept, otherwise they are only encoded once
+"""
+import io
+import zlib
+from typing import BinaryIO, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+# Number of pixels sampled from each frame to build the shared palette
+PALETTE_SAMPLE_PIXELS = 16384
+# Length of the runs of rows of a changed box that are compressed, to tell how well the whole box would
+COMPRESS_SAMPLE_ROWS = 4
+# Fraction of the frames' area that must have changed for a plain pillow save to be tried as well
+PLAIN_MIN_CHANGED = 0.5
+
+
+def optimize_frames(frames: Sequence[Image.Image],
+                    duration: Union[int, float, Sequence[Union[int, float]]],
+                    colors: int = 255) -> Tuple[List[Image.Image], List[int], int, float]:
+    """
+     Diffs consecutive frames, returns the optimized frames, their durations,
+     the GIF disposal method they must be saved with (1 if they were diffed, 0 otherwise)
+     and the fraction of the area of the frames after the first that changed (1.0 if they weren't diffed)
+
+     Palette frames sharing the same palette are diffed on their indices and keep their palette,
+     other frames are quantized to one palette shared by all frames (colors + transparency)
+     Frames with partially transparent pixels can't be diffed, they are only merged
+
+     PARAMETERS:-
+
+     frames: The frames of the GIF, i.e the output of glitch_image(gif=True) or glitch_gif
+
+     duration: Duration of each frame (in milliseconds), or a list with one duration per frame
+
+     colors: Number of colors in the shared palette (1 to 255), fewer colors give smaller files
+    """
+    if not frames:
+        raise ValueError('frames parameter must not be empty')
+    if not (isinstance(colors, int) and 1 <= colors <= 255):
+        raise ValueError('colors parameter must be a positive integer value between 1 and 255, inclusive')
+    if isinstance(duration, (int, float)):
+        durations = [duration] * len(frames)
+    else:
+        durations = list(duration)
+        if len(durations) != len(frames):
+            raise ValueError('duration parameter must have one value per frame')
+
+    palette = shared_palette(frames)
+    if palette is not None:
+        arrays = [np.asarray(frame) for frame in frames]
+    elif any(frame.mode in ('RGBA', 'LA', 'PA') or 'transparency' in frame.info for frame in frames):
+        arrays = [np.asarray(frame.convert('RGBA')) for frame in frames]
+    else:
+        arrays = [np.asarray(frame.convert('RGB')) for frame in frames]
+
+    # Merge identical consecutive frames
+    unique, unique_durations = [0], [durations[0]]
+    for index in range(1, len(frames)):
+        if np.array_equal(arrays[index], arrays[unique[-1]]):
+            unique_durations[-1] += durations[index]
+        else:
+            unique.append(index)
+            unique_durations.append(durations[index])
+    unique_durations = [int(round(value)) for value in unique_durations]
+
+    if palette is None and arrays[0].shape[2] == 4 and any(arr[:, :, 3].min() < 255 for arr in arrays):
+        # Transparent pixels in the frames themselves can't be told apart from unchanged ones
+        return [frames[index] for index in unique], unique_durations, 0, 1.0
+
+    exact_colors = None
+    if palette is not None:
+        palette_bytes, transparency = palette
+    else:
+        palette_img, exact_colors = build_palette([arrays[index] for index in unique], colors)
+        palette_bytes, transparency = palette_img.getpalette(), 255
+    # The transparent index must be part of the palette
+    palette_bytes = palette_bytes + [0] * (768 - len(palette_bytes))
+
+    optimized = []
+    previous = None
+    changed_area = 0
+    for index in unique:
+        arr = arrays[index]
+        if previous is None:
+            # First frame is kept whole
+            changed = np.ones(arr.shape[:2], dtype=bool)
+        else:
+            changed = arr != previous
+            if changed.ndim == 3:
+                changed = changed.any(axis=2)
+        rows = np.flatnonzero(changed.any(axis=1))
+        cols = np.flatnonzero(changed.any(axis=0))
+        start_y, stop_y, start_x, stop_x = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        if previous is not None:
+            changed_area += (stop_y - start_y) * (stop_x - start_x)
+
+        box = arr[start_y:stop_y, start_x:stop_x]
+        if palette is not None:
+            box_indices = box
+        elif exact_colors is not None:
+            # Every color is in the palette, look them up (pillow only maps to the nearest color approximately)
+            box_indices = np.searchsorted(exact_colors, pack_colors(box)).astype(np.uint8)
+        else:
+            # Only the changed bounding box is quantized
+            box_img = Image.fromarray(np.ascontiguousarray(box[:, :, :3]), 'RGB')
+            box_indices = np.asarray(box_img.quantize(palette=palette_img, dither=no_dither()))
+
+        box_indices = np.asarray(box_indices, dtype=np.uint8)
+        if previous is not None:
+            # Unchanged pixels scattered between changed ones can break up runs and compress worse than
+            # just keeping them, the cheaper of the two is used
+            # Deflate on a quarter of the rows (in runs of a few rows) stands in for LZW on the whole box
+            box_changed = changed[start_y:stop_y, start_x:stop_x]
+            diffed = np.where(box_changed, box_indices, np.uint8(transparency))
+            rows = np.flatnonzero(np.arange(stop_y - start_y) // COMPRESS_SAMPLE_ROWS % 4 == 0)
+            if compressed_size(diffed[rows]) < compressed_size(box_indices[rows]):
+                box_indices = diffed
+        indices = np.full(arr.shape[:2], transparency, dtype=np.uint8)
+        indices[start_y:stop_y, start_x:stop_x] = box_indices
+
+        optimized_frame = Image.fromarray(indices, 'P')
+        optimized_frame.putpalette(palette_bytes)
+        optimized_frame.info['transparency'] = transparency
+        optimized.append(optimized_frame)
+        previous = arr
+    if len(unique) == 1:
+        return optimized, unique_durations, 1, 1.0
+    return optimized, unique_durations, 1, changed_area / ((len(unique) - 1) * arr.shape[0] * arr.shape[1])
+
+
+def save_optimized_gif(frames: Sequence[Image.Image], fp: Union[str, BinaryIO],
+                       duration: Union[int, float, Sequence[Union[int, float]]] = 200, loop: int = 0,
+                       colors: int = 255, plain_fallback: bool = True):
+    """
+     Saves frames as a GIF at fp (a path or a binary file object), see optimize_frames
+     If at least PLAIN_MIN_CHANGED of the frames changed and colors is 255, frames saved
+     by pillow as they are are kept instead, if that's smaller (unless plain_fallback is False)
+
+     duration: Duration of each frame (in milliseconds), or a list with one duration per frame
+
+     loop: How many times the GIF should loop, 0 means infinite loop
+
+     colors: Number of colors in the shared palette (1 to 255), see optimize_frames
+
+     plain_fallback: Whether a plain pillow save may be kept instead, False always encodes with the shared palette
+    """
+    optimized, durations, disposal, changed = optimize_frames(frames, duration, colors)
+    encoded = io.BytesIO()
+    # Diffed frames already share one palette, which pillow would otherwise re-map frame by frame
+    optimized[0].save(encoded, format='GIF', save_all=True, append_images=optimized[1:], duration=durations,
+                      loop=loop, disposal=disposal, optimize=disposal != 1)
+    data = encoded.getvalue()
+    # A plain save ignores colors, and is only worth its cost when cropping to what changed saved little
+    if plain_fallback and colors == 255 and changed >= PLAIN_MIN_CHANGED:
+        plain = encode_plain_gif(frames, duration, loop)
+        if len(plain) <= len(data):
+            data = plain
+    if isinstance(fp, str):
+        with open(fp, 'wb') as gif_file:
+            gif_file.write(data)
+    else:
+        fp.write(data)
+
+
+def encode_plain_gif(frames: Sequence[Image.Image], duration: Union[int, float, Sequence[Union[int, float]]] = 200,
+                     loop: int = 0) -> bytes:
+    # frames saved as a GIF by pillow as they are, in memory
+    buffer = io.BytesIO()
+    durations = duration if isinstance(duration, (int, float)) else list(duration)
+    frames[0].save(buffer, format='GIF', save_all=True, append_images=list(frames[1:]), duration=durations, loop=loop)
+    return buffer.getvalue()
+
+
+def shared_palette(frames: Sequence[Image.Image]) -> Union[Tuple[List[int], int], None]:
+    """
+     Returns (palette, transparency index) if every frame is a P mode frame
+     with the same palette and a free (or common transparent) index, otherwise None
+    """
+    if any(frame.mode != 'P' for frame in frames):
+        return None
+    palette = frames[0].getpalette()
+    if any(frame.getpalette() != palette for frame in frames[1:]):
+        return None
+    transparencies = {frame.info.get('transparency') for frame in frames}
+    if len(transparencies) == 1 and isinstance(next(iter(transparencies)), int):
+        # Pixels using the transparent index are already see-through in every frame,
+        # which can't be told apart from unchanged pixels - unless none use it
+        transparency = next(iter(transparencies))
+        if any((np.asarray(frame) == transparency).any() for frame in frames):
+            return None
+        return palette, transparency
+    if transparencies != {None}:
+        return None
+    used = np.zeros(256, dtype=bool)
+    for frame in frames:
+        used[np.unique(np.asarray(frame))] = True
+    free = np.flatnonzero(~used)
+    if not free.size:
+        return None
+    return palette, int(free[0])
+
+
+def build_palette(arrays: Sequence[np.ndarray], colors: int = 255) -> Tuple[Image.Image, Optional[np.ndarray]]:
+    # Returns a palette image of (at most) colors colors, index 255 is left out, for transparency
+    # Frames using few enough colors in total get exactly those (so they aren't quantized at all),
+    # returned as well, packed and sorted in palette order (see pack_colors)
+    # Otherwise the palette is built from a sample of pixels of every frame
+    exact = set()
+    for arr in arrays:
+        frame_colors = Image.fromarray(np.ascontiguousarray(arr[:, :, :3]), 'RGB').getcolors(colors)
+        if frame_colors is None:
+            break
+        exact.update(color for _, color in frame_colors)
+        if len(exact) > colors:
+            break
+    else:
+        exact = sorted(exact)
+        palette_img = Image.new('P', (1, 1))
+        palette_img.putpalette([value for color in exact for value in color])
+        return palette_img, pack_colors(np.array(exact, dtype=np.uint8))
+
+    # Random pixels rather than a resized copy, resizing blends colors (i.e scan lines) away
+    rng = np.random.default_rng(0)
+    samples = []
+    for arr in arrays:
+        pixels = arr.reshape(-1, arr.shape[2])
+        samples.append(pixels[rng.integers(0, len(pixels), min(len(pixels), PALETTE_SAMPLE_PIXELS)), :3])
+    sample_img = Image.fromarray(np.concatenate(samples)[None], 'RGB')
+    # Octree palettes leave flatter areas than median cut ones once pixels are mapped, which compress better
+    sampled = sample_img.quantize(colors=colors, method=fast_octree())
+    palette_img = Image.new('P', (1, 1))
+    palette_img.putpalette(sampled.getpalette()[:colors * 3])
+    return palette_img, None
+
+
+def compressed_size(arr: np.ndarray) -> int:
+    return len(zlib.compress(arr.tobytes(), 1))
+
+
+def pack_colors(arr: np.ndarray) -> np.ndarray:
+    # RGB(A) pixels to 0xRRGGBB integers, which sort like (R, G, B) tuples
+    return (arr[..., 0].astype(np.uint32) << 16) | (arr[..., 1].astype(np.uint32) << 8) | arr[..., 2]
+
+
+def no_dither() -> int:
+    # Image.Dither was added in pillow 9.1
+    return getattr(Image, 'Dither', Image).NONE
+
+
+def fast_octree() -> int:
+    # Image.Quantize was added in pillow 9.1
+    return getattr(Image, 'Quantize', Image).FASTOCTREE
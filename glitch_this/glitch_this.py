@@ -1,11 +1,63 @@
+import hashlib
+import io
+import math
 import os
 import random
-import shutil
-from decimal import Decimal, getcontext
-from typing import List, Literal, Optional, Tuple, Union, overload
+import struct
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from contextlib import closing
+from decimal import Decimal, getcontext, localcontext
+from itertools import product
+from threading import Lock
+from time import monotonic
+from typing import BinaryIO, Callable, Dict, Iterator, List, Literal, Optional, Sequence, Tuple, Union, overload
 
 import numpy as np
-from PIL import Image, ImageSequence
+from PIL import GifImagePlugin, Image, ImageMode, ImageSequence
+
+from glitch_this.atlas import AtlasBuilder
+from glitch_this.budget import (COLORS, MIN_SIDE, PILOT_FRAMES, PILOT_PIXELS, BudgetModel, downscale_frames, encode_gif,
+                                scaled_size)
+from glitch_this.cache import DecodedImage
+from glitch_this.estimate import CostModel, encoded_size, read_header, region_fraction
+from glitch_this.gif_optimizer import save_optimized_gif
+from glitch_this.kernels import color_offset_reference, shift_reference
+from glitch_this.pipeline import pipeline, sequential
+from glitch_this.renditions import check_renditions, convert_for_format, render_renditions
+
+# Guards GifImagePlugin.LOADING_STRATEGY, which is global to the process and read by pillow when
+# seeking GIF frames: glitch_this only seeks frames with it held (see gif_frames), so the strategy
+# a keep_palette job swaps in never leaks into the frames another thread is seeking
+gif_strategy_lock = Lock()
+
+
+def gif_frames(gif: Image.Image, strategy=None) -> Iterator[Image.Image]:
+    """
+     Yields gif at each of its frames, like ImageSequence.Iterator, seeking with gif_strategy_lock held
+     strategy: GifImagePlugin.LoadingStrategy to seek frames with, only while seeking, None keeps the current one
+    """
+    index = 0
+    while True:
+        with gif_strategy_lock:
+            original_strategy = getattr(GifImagePlugin, 'LOADING_STRATEGY', None)
+            if strategy is not None and original_strategy is not None:
+                GifImagePlugin.LOADING_STRATEGY = strategy
+            try:
+                gif.seek(index)
+                if index == 0:
+                    # pillow reads the strategy again when the first frame is done decoding
+                    # (to convert it to RGB/RGBA with RGB_ALWAYS), so it's decoded with the lock held
+                    gif.load()
+            except EOFError:
+                return
+            finally:
+                if strategy is not None and original_strategy is not None:
+                    GifImagePlugin.LOADING_STRATEGY = original_strategy
+        # Decoding the later frames only depends on the mode seeking chose, it's done without the lock
+        # (and seeking to the next frame then has nothing left to decode)
+        gif.load()
+        yield gif
+        index += 1
 
 
 class ImageGlitcher:
@@ -23,14 +75,66 @@ class ImageGlitcher:
         self.inputarr = None
         self.outputarr = None
 
-        # Getting PATH of temp folders
+        # Parameters of the last seekable glitch_image() call, used by render_frame()
+        self.frame_params = None
+
+        # Optional ArrayCache of intermediate (post shift, post color offset) arrays
+        # Set it to reuse earlier stages when only later effects change between renders
+        self.stage_cache = None
+        # Identifies the content of inputarr in stage_cache keys
+        self.input_key = None
+
+        # Optional InputCache of decoded inputs (files by path, modification time and size, glitch_bytes data by hash)
+        # Set it to skip decoding inputs that are glitched again and again
+        self.input_cache = None
+        # (Image, hash of its bytes) of the running glitch_bytes call, for input_cache keys
+        self.__source = None
+
+        # Optional CostModel used by estimate(), None uses the default rates
+        self.cost_model = None
+
+        # Optional KernelRegistry, picks the shift/color offset kernels per image size class
+        # None always uses the reference kernels
+        self.kernel_registry = None
+
+        # AtlasBuilder the frames of the running glitch_atlas call go into, instead of a list
+        self.__atlas = None
+
+        # Called with an iterator of the frames of the running glitch_gif_encoded call,
+        # which it encodes as they come, instead of a list
+        self.__gif_writer = None
+
+        # (whole image array, top, bottom, left, right, mask) when glitch_image was given a roi/mask
+        # inputarr/outputarr then only hold that region
+        self.region = None
+
+        # Getting PATH of the library
         self.lib_path = os.path.split(os.path.abspath(__file__))[0]
-        self.gif_dirpath = os.path.join(self.lib_path, 'Glitched GIF')
 
         # Setting glitch_amount max and min
         self.glitch_max = 10.0
         self.glitch_min = 0.1
 
+        # Number of threads the glitch is split across, as row bands
+        # Every band must cover at least thread_min_pixels pixels,
+        # so small images fall back to fewer (or a single) thread
+        self.threads = 1
+        self.thread_min_pixels = 2 ** 20
+
+        # Scan line value of each channel, per image mode
+        # None leaves the channel untouched (i.e alpha)
+        # 'max' is the highest value of the channel's dtype
+        # Modes not listed here get their first 3 channels set to 0
+        self.scan_line_values = {
+            '1': (0,), 'L': (0,), 'I': (0,), 'F': (0,),
+            'I;16': (0,), 'I;16B': (0,), 'I;16L': (0,), 'I;16N': (0,),
+            'LA': (0, None), 'La': (0, None),
+            'RGB': (0, 0, 0), 'RGBX': (0, 0, 0, None),
+            'RGBA': (0, 0, 0, None), 'RGBa': (0, 0, 0, None),
+            'CMYK': (0, 0, 0, 'max'),
+            'YCbCr': (0, 128, 128), 'LAB': (0, 128, 128), 'HSV': (None, None, 0),
+        }
+
     def __isgif(self, img: Union[str, Image.Image]) -> bool:
         # Returns true if input image is a GIF and/or animated
         if isinstance(img, str):
@@ -45,12 +149,15 @@ class ImageGlitcher:
                 return True
         return False
 
-    def __open_image(self, img_path: str) -> Image.Image:
+    def __open_image(self, img_path: str, mode: Optional[str] = None) -> Image.Image:
         # Returns an Image object
         # Will throw exception if img_path doesn't point to Image
         if img_path.endswith('.gif'):
             # Do not convert GIF file
             return Image.open(img_path)
+        elif mode is not None:
+            # Only convert to the mode that was asked for
+            return self.__convert_image(Image.open(img_path), mode)
         elif img_path.endswith('.png'):
             # Convert the Image to RGBA if it's png
             return Image.open(img_path).convert('RGBA')
@@ -58,7 +165,19 @@ class ImageGlitcher:
             # Otherwise convert it to RGB
             return Image.open(img_path).convert('RGB')
 
-    def __fetch_image(self, src_img: Union[str, Image.Image], gif_allowed: bool) -> Image.Image:
+    def __convert_image(self, img: Image.Image, mode: str) -> Image.Image:
+        # Converts img to given mode
+        # 'native' keeps img's own mode and dtype, except for palette images
+        # Those hold indices rather than colors, so they are converted to RGB(A)
+        if mode != 'native':
+            return img.convert(mode)
+        if img.mode == 'PA' or (img.mode == 'P' and 'transparency' in img.info):
+            return img.convert('RGBA')
+        if img.mode == 'P':
+            return img.convert('RGB')
+        return img
+
+    def __fetch_image(self, src_img: Union[str, Image.Image], gif_allowed: bool, mode: Optional[str] = None) -> Image.Image:
         """
          The following code resolves whether input was a path or an Image
          Then returns an Image object
@@ -78,7 +197,7 @@ class ImageGlitcher:
                 raise FileNotFoundError('Path not found')
             try:
                 # Open the image at given path
-                img = self.__open_image(src_img)
+                img = self.__open_image(src_img, mode)
             except:
                 # File is not an Image
                 raise Exception('Wrong format')
@@ -93,6 +212,9 @@ class ImageGlitcher:
             if src_img.format == 'GIF':
                 # Do not convert GIF file
                 return src_img
+            elif mode is not None:
+                # Only convert to the mode that was asked for
+                img = self.__convert_image(src_img, mode)
             elif src_img.format == 'PNG':
                 # Convert the Image to RGBA if it's png
                 img = src_img.convert('RGBA')
@@ -107,18 +229,66 @@ class ImageGlitcher:
             raise Exception('Wrong format')
         return img
 
+    def __input_cache_key(self, src_img: Union[str, Image.Image], variant: Optional[str]) -> Optional[Tuple]:
+        # Identifies src_img (decoded as variant, i.e its mode) in input_cache
+        # None if there is no input_cache or src_img can't be identified (Image objects)
+        if self.input_cache is None:
+            return None
+        if isinstance(src_img, str):
+            try:
+                stat = os.stat(src_img)
+            except OSError:
+                return None
+            return ('path', os.path.abspath(src_img), stat.st_mtime_ns, stat.st_size, variant)
+        if self.__source is not None and src_img is self.__source[0]:
+            return ('bytes', self.__source[1], variant)
+        return None
+
+    def __fetch_decoded(self, src_img: Union[str, Image.Image], mode: Optional[str] = None) -> DecodedImage:
+        # __fetch_image for non-animated images, returns the decoded image
+        # Taken from input_cache if it was decoded before, stored there otherwise
+        key = self.__input_cache_key(src_img, mode)
+        decoded = self.input_cache.get(key) if key is not None else None
+        if decoded is None:
+            decoded = DecodedImage()
+            decoded.add(self.__fetch_image(src_img, gif_allowed=False, mode=mode))
+            if key is not None:
+                self.input_cache.put(key, decoded)
+        return decoded
+
+    def __set_input(self, decoded: DecodedImage):
+        # Sets inputarr (read-only) and the image attributes from the decoded image
+        self.inputarr = decoded.arrays[0]
+        self.img_mode = decoded.modes[0]
+        self.img_height, self.img_width = self.inputarr.shape[:2]
+        self.pixel_tuple_len = len(ImageMode.getmode(self.img_mode).bands)
+        # render_frame must not render earlier seekable calls' frames from the new input
+        self.frame_params = None
+
     @overload
     def glitch_image(self, src_img: Union[str, Image.Image], glitch_amount: Union[int, float], seed: Optional[Union[int, float]] = None, glitch_change: Union[int, float] = 0.0,
-                     color_offset: bool = False, scan_lines: bool = False, gif: Literal[False] = False, cycle: bool = False, frames: int = 23, step: int = 1) -> Image.Image:
+                     color_offset: bool = False, scan_lines: bool = False, gif: Literal[False] = False, cycle: bool = False, frames: int = 23, step: int = 1,
+                     seekable: bool = False, threads: int = 1, mode: Optional[str] = None,
+                     progress: Optional[Callable[[int, int, float], None]] = None, cancel=None, deadline: Optional[float] = None,
+                     roi: Optional[Tuple[int, int, int, int]] = None, mask: Optional[Union[Image.Image, np.ndarray]] = None,
+                     workers: int = 1) -> Image.Image:
         ...
 
     @overload
     def glitch_image(self, src_img: Union[str, Image.Image], glitch_amount: Union[int, float], seed: Optional[Union[int, float]] = None, glitch_change: Union[int, float] = 0.0,
-                     color_offset: bool = False, scan_lines: bool = False, gif: Literal[True] = False, cycle: bool = False, frames: int = 23, step: int = 1) -> List[Image.Image]: # type: ignore
+                     color_offset: bool = False, scan_lines: bool = False, gif: Literal[True] = False, cycle: bool = False, frames: int = 23, step: int = 1,
+                     seekable: bool = False, threads: int = 1, mode: Optional[str] = None,
+                     progress: Optional[Callable[[int, int, float], None]] = None, cancel=None, deadline: Optional[float] = None,
+                     roi: Optional[Tuple[int, int, int, int]] = None, mask: Optional[Union[Image.Image, np.ndarray]] = None,
+                     workers: int = 1) -> List[Image.Image]: # type: ignore
         ...
 
     def glitch_image(self, src_img: Union[str, Image.Image], glitch_amount: Union[int, float], seed: Optional[Union[int, float]] = None, glitch_change: Union[int, float] = 0.0,
-                     color_offset: bool = False, scan_lines: bool = False, gif: bool = False, cycle: bool = False, frames: int = 23, step: int = 1) -> Union[Image.Image, List[Image.Image]]:
+                     color_offset: bool = False, scan_lines: bool = False, gif: bool = False, cycle: bool = False, frames: int = 23, step: int = 1,
+                     seekable: bool = False, threads: int = 1, mode: Optional[str] = None,
+                     progress: Optional[Callable[[int, int, float], None]] = None, cancel=None, deadline: Optional[float] = None,
+                     roi: Optional[Tuple[int, int, int, int]] = None, mask: Optional[Union[Image.Image, np.ndarray]] = None,
+                     workers: int = 1) -> Union[Image.Image, List[Image.Image]]:
         """
          Sets up values needed for glitching the image
 
@@ -149,6 +319,25 @@ class ImageGlitcher:
 
          seed: Set a random seed for generating similar images across runs,
                defaults to None (random seed).
+
+         seekable: Use a counter-based RNG keyed by (seed, frame, shift) instead of `random`,
+                   every frame then only depends on the source, the seed and its index
+                   and can be rendered on its own through render_frame(),
+                   a random seed is picked when none was given, defaults to False
+
+         workers: Number of frames rendered in parallel (threads) if gif=True, requires seekable=True
+                  as only then frames don't depend on each other, defaults to 1
+                  Frames are the same for any number of workers
+
+         progress, cancel, deadline: Only used if gif=True, see glitch_gif
+
+         roi: Box (left, upper, right, lower) to limit the glitch to, like PIL's crop box
+              Shifts wrap around within the box, pixels outside of it are kept as they are
+              The glitch costs time and memory in proportion to the box, not the whole image
+
+         mask: Image (nonzero pixels) or array (truthy values) the size of the image,
+               only the pixels it selects are glitched
+               The glitch is limited to the mask's bounding box (or to roi, if given)
         """
 
         # Sanity checking the inputs
@@ -179,16 +368,36 @@ class ImageGlitcher:
             raise ValueError('scan_lines param must be a boolean')
         if not isinstance(gif, bool):
             raise ValueError('gif param must be a boolean')
+        if not isinstance(seekable, bool):
+            raise ValueError('seekable param must be a boolean')
+        if not (isinstance(threads, int) and threads > 0):
+            raise ValueError(
+                'threads parameter must be a positive integer value greater than 0')
+        if not (isinstance(workers, int) and workers > 0):
+            raise ValueError(
+                'workers parameter must be a positive integer value greater than 0')
+        if workers > 1 and not seekable:
+            raise ValueError('workers parameter requires seekable=True')
+        if mode is not None and mode != 'native':
+            try:
+                ImageMode.getmode(mode)
+            except KeyError:
+                raise ValueError(f"mode param must be 'native' or a valid PIL image mode, not {mode}")
+        self.__check_job_params(progress, cancel, deadline)
+        self.threads = threads
 
         self.seed = seed
-        if self.seed:
+        if seekable and self.seed is None:
+            # Pick a seed so that every frame can still be rendered again later
+            self.seed = random.getrandbits(64)
+        elif self.seed:
             # Set the seed if it was given
             self.__reset_rng_seed()
 
         try:
-            # Get Image, whether input was an str path or Image object
+            # Get the decoded image, whether input was an str path or Image object
             # GIF input is NOT allowed in this method
-            img = self.__fetch_image(src_img, gif_allowed=False)
+            decoded = self.__fetch_decoded(src_img, mode)
         except FileNotFoundError:
             # Throw DETAILED exception here (Traceback will be present from previous exceptions)
             raise FileNotFoundError(f'No image found at given path: {src_img}')
@@ -197,64 +406,262 @@ class ImageGlitcher:
             raise Exception(
                 'File format not supported - must be a non-animated image file')
 
-        # Fetching image attributes
-        self.pixel_tuple_len = len(img.getbands())
-        self.img_width, self.img_height = img.size
-        self.img_mode = img.mode
-
-        # Assigning the 3D arrays with pixel data
-        self.inputarr = np.asarray(img)
-        self.outputarr = np.array(img)
+        # Fetching image attributes and assigning the 3D arrays with pixel data
+        self.__set_input(decoded)
+        self.region = None
+        if roi is not None or mask is not None:
+            # Only the region is glitched, as if it was the whole image
+            # It's put back into the rest of the image for every output (see __output_image)
+            top, bottom, left, right, region_mask = self.__get_region(roi, mask)
+            self.region = (self.inputarr, top, bottom, left, right, region_mask)
+            self.inputarr = self.inputarr[top:bottom, left:right]
+            self.img_width, self.img_height = right - left, bottom - top
+        self.outputarr = np.array(self.inputarr)
+        self.input_key = self.__get_input_key() if self.stage_cache is not None else None
+
+        self.frame_params = None
+        if seekable:
+            # Frames are rendered independently from inputarr, no shared outputarr or temp files
+            self.frame_params = {'glitch_amount': glitch_amount, 'glitch_change': glitch_change, 'cycle': cycle,
+                                 'color_offset': color_offset, 'scan_lines': scan_lines, 'step': step}
+            if not gif:
+                return self.render_frame(0)
+            started = monotonic()
+            glitched_imgs = []
+            if workers > 1 and frames > 1:
+                # render_frame is thread safe, frames are collected in order as they finish
+                with ThreadPoolExecutor(max_workers=min(workers, frames)) as pool:
+                    futures = [pool.submit(self.render_frame, i) for i in range(frames)]
+                    try:
+                        for i, future in enumerate(futures):
+                            self.__check_job(i, frames, started, progress, cancel, deadline)
+                            self.__keep_frame(glitched_imgs, future.result())
+                    finally:
+                        # Frames not started yet are dropped if the job was stopped
+                        for future in futures:
+                            future.cancel()
+            else:
+                for i in range(frames):
+                    self.__check_job(i, frames, started, progress, cancel, deadline)
+                    self.__keep_frame(glitched_imgs, self.render_frame(i))
+            self.__check_job(frames, frames, started, progress, cancel, deadline)
+            return glitched_imgs
 
         # Glitching begins here
         if not gif:
             # Return glitched image
-            return self.__get_glitched_img(glitch_amount, color_offset, scan_lines)
+            return self.__get_glitched_img(glitch_amount, color_offset, scan_lines, from_input=True)
 
         # Return glitched GIF
-        # Set up directory for storing glitched images
-        if os.path.isdir(self.gif_dirpath):
-            shutil.rmtree(self.gif_dirpath)
-        os.mkdir(self.gif_dirpath)
-
         # Set up decimal precision for glitch_change
         original_prec = getcontext().prec
         getcontext().prec = 4
 
+        started = monotonic()
         glitched_imgs = []
-        for i in range(frames):
-            """
-             * Glitch the image for n times
-             * Where n is 0,1,2...frames
-             * Save the image the in temp directory
-             * Open the image and append a copy of it to the list
-            """
-            if not i % step == 0:
-                # Only every step'th frame should be glitched
-                # Other frames will be appended as they are
-                glitched_imgs.append(img.copy())
+        try:
+            for i in range(frames):
+                """
+                 * Glitch the image for n times
+                 * Where n is 0,1,2...frames
+                 * Encode the image as PNG in memory
+                 * Decode the image and append a copy of it to the list
+                """
+                self.__check_job(i, frames, started, progress, cancel, deadline)
+                if not i % step == 0:
+                    # Only every step'th frame should be glitched
+                    # Other frames will be appended as they are
+                    self.__keep_frame(glitched_imgs, decoded.image(0), copy=True)
+                    continue
+                glitched_img = self.__get_glitched_img(
+                    glitch_amount, color_offset, scan_lines)
+                if self.__atlas is not None:
+                    # Copied into the atlas right away, nothing to detach
+                    self.__atlas.put(glitched_img)
+                elif mode is not None:
+                    # Not every mode can be saved as PNG, the frame only needs
+                    # to be detached from outputarr, which the next frame reuses
+                    glitched_imgs.append(glitched_img.copy())
+                else:
+                    glitched_imgs.append(self.__png_roundtrip(glitched_img).copy())
+                # Change glitch_amount by given value
+                glitch_amount = self.__change_glitch(
+                    glitch_amount, glitch_change, cycle)
+            self.__check_job(frames, frames, started, progress, cancel, deadline)
+        finally:
+            # Set decimal precision back to original value, even if the job was stopped
+            getcontext().prec = original_prec
+        return glitched_imgs
+
+    def render_frame(self, frame: int) -> Image.Image:
+        """
+         Renders a single frame of the last glitch_image() call made with seekable=True
+
+         Frame k only depends on the source image, the seed and k
+         So any frame can be rendered (or re-rendered) on its own, in any order,
+         and any subset of frames can be rendered in parallel from multiple threads
+
+         PARAMETERS:-
+
+         frame: Index of the frame to render, frame 0 is also the glitched still image
+        """
+        if self.frame_params is None:
+            raise Exception('render_frame requires a previous glitch_image call with seekable=True')
+        if not (isinstance(frame, int) and frame >= 0):
+            raise ValueError('frame param must be a non-negative integer')
+
+        params = self.frame_params
+        if not frame % params['step'] == 0:
+            # Only every step'th frame is glitched
+            # Other frames are the source image as it is
+            return self.__output_image(self.inputarr)
+
+        # glitch_amount after every glitched frame before this one
+        # Decimal contexts are per thread, so set the precision locally
+        glitch_amount = params['glitch_amount']
+        with localcontext() as ctx:
+            ctx.prec = 4
+            for _ in range(frame // params['step']):
+                glitch_amount = self.__change_glitch(
+                    glitch_amount, params['glitch_change'], params['cycle'])
+
+        plan, color = self.__draw_seekable_plan(
+            frame, glitch_amount, params['color_offset'])
+        return self.__output_image(self.__render(plan, color, params['scan_lines']))
+
+    def glitch_sweep(self, src_img: Union[str, Image.Image], amounts: Sequence[Union[int, float]], seeds: Sequence[Optional[Union[int, float]]] = (None,),
+                     color_offset: bool = False, scan_lines: bool = False, seekable: bool = False, mode: Optional[str] = None,
+                     threads: int = 1, workers: int = 1, output: str = 'list', columns: Optional[int] = None) -> Union[List[Image.Image], np.ndarray, Image.Image]:
+        """
+         Glitches one image with every combination of seeds and amounts
+         The source is decoded once and every variant is rendered straight into one preallocated array
+
+         Variants are ordered seed by seed, i.e [(seeds[0], amounts[0]), (seeds[0], amounts[1]), ...]
+         Each variant is the same as glitch_image(src_img, amount, seed=seed, ...) would return
+
+         Returns one of the following (see output):
+         * List of Image objects
+         * numpy array stack of shape (variants, height, width[, channels])
+         * A single contact sheet Image, with the variants tiled row by row
+
+         PARAMETERS:-
+
+         src_img: Either the path to input Image or an Image object itself
+
+         amounts: glitch_amount of each variant, every one in [0.1, 10.0] (inclusive)
+
+         seeds: seed of each variant, None for a random seed, defaults to (None,)
+
+         color_offset, scan_lines, seekable, threads, mode: Same as in glitch_image
+
+         workers: How many variants to render in parallel (threads), defaults to 1
+
+         output: 'list', 'stack' or 'sheet', defaults to 'list'
+
+         columns: Number of variants per contact sheet row, defaults to len(amounts)
+        """
+
+        # Sanity checking the inputs
+        if not amounts or not seeds:
+            raise ValueError('amounts and seeds parameters must not be empty')
+        for glitch_amount in amounts:
+            if not ((isinstance(glitch_amount, float)
+                     or isinstance(glitch_amount, int))
+                    and self.glitch_min <= glitch_amount <= self.glitch_max):
+                raise ValueError('amounts parameter must only hold positive numbers '
+                                 f'in range {self.glitch_min} to {self.glitch_max}, inclusive')
+        for seed in seeds:
+            if seed is not None and not (isinstance(seed, float) or isinstance(seed, int)):
+                raise ValueError('seeds parameter must only hold numbers or None')
+        if not isinstance(color_offset, bool):
+            raise ValueError('color_offset param must be a boolean')
+        if not isinstance(scan_lines, bool):
+            raise ValueError('scan_lines param must be a boolean')
+        if not isinstance(seekable, bool):
+            raise ValueError('seekable param must be a boolean')
+        if not (isinstance(threads, int) and threads > 0):
+            raise ValueError(
+                'threads parameter must be a positive integer value greater than 0')
+        if not (isinstance(workers, int) and workers > 0):
+            raise ValueError(
+                'workers parameter must be a positive integer value greater than 0')
+        if output not in ('list', 'stack', 'sheet'):
+            raise ValueError("output param must be one of 'list', 'stack' or 'sheet'")
+        if columns is not None and not (isinstance(columns, int) and columns > 0):
+            raise ValueError(
+                'columns parameter must be a positive integer value greater than 0')
+
+        try:
+            # Decode the image once, for every variant
+            decoded = self.__fetch_decoded(src_img, mode)
+        except FileNotFoundError:
+            # Throw DETAILED exception here (Traceback will be present from previous exceptions)
+            raise FileNotFoundError(f'No image found at given path: {src_img}')
+        except:
+            # Throw DETAILED exception here (Traceback will be present from previous exceptions)
+            raise Exception(
+                'File format not supported - must be a non-animated image file')
+
+        self.__set_input(decoded)
+        self.outputarr = None
+        self.frame_params = None
+        self.region = None
+        self.threads = threads
+
+        # Draw every variant's plan up front, the global RNG is not thread safe
+        plans = []
+        for seed, glitch_amount in product(seeds, amounts):
+            self.seed = seed
+            if seekable:
+                if self.seed is None:
+                    self.seed = random.getrandbits(64)
+                plans.append(self.__draw_seekable_plan(0, glitch_amount, color_offset))
                 continue
-            glitched_img = self.__get_glitched_img(
-                glitch_amount, color_offset, scan_lines)
-            file_path = os.path.join(self.gif_dirpath, 'glitched_frame.png')
-            glitched_img.save(file_path, compress_level=3)
-            glitched_imgs.append(Image.open(file_path).copy())
-            # Change glitch_amount by given value
-            glitch_amount = self.__change_glitch(
-                glitch_amount, glitch_change, cycle)
+            if self.seed:
+                self.__reset_rng_seed()
+            plans.append(self.__draw_plan(glitch_amount, color_offset))
+
+        # Every variant is rendered into its own view of one preallocated array
+        variant_count = len(plans)
+        if output == 'sheet':
+            columns = columns or len(amounts)
+            rows = -(-variant_count // columns)
+            sheet = np.zeros((rows * self.img_height, columns * self.img_width) + self.inputarr.shape[2:],
+                             dtype=self.inputarr.dtype)
+            views = [sheet[(i // columns) * self.img_height:(i // columns + 1) * self.img_height,
+                           (i % columns) * self.img_width:(i % columns + 1) * self.img_width]
+                     for i in range(variant_count)]
+        else:
+            stack = np.empty((variant_count,) + self.inputarr.shape, dtype=self.inputarr.dtype)
+            views = list(stack)
+
+        def render(index: int):
+            plan, color = plans[index]
+            np.copyto(views[index], self.inputarr)
+            self.__apply_plan(self.inputarr, views[index], plan, color, scan_lines)
+
+        if workers > 1 and variant_count > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, variant_count)) as pool:
+                # Consume the results to surface any exception raised in a variant
+                list(pool.map(render, range(variant_count)))
+        else:
+            for index in range(variant_count):
+                render(index)
 
-        # Set decimal precision back to original value
-        getcontext().prec = original_prec
-        # Cleanup
-        shutil.rmtree(self.gif_dirpath)
-        return glitched_imgs
+        if output == 'sheet':
+            return self.__array_to_image(sheet)
+        if output == 'stack':
+            return stack
+        return [self.__array_to_image(view) for view in views]
 
     def glitch_gif(self, src_gif: Union[str, Image.Image], glitch_amount: Union[int, float], seed: Union[int, float] = None, glitch_change: Union[int, float] = 0.0,
-                   color_offset: bool = False, scan_lines: bool = False, gif: bool = False, cycle: bool = False, step=1) -> Tuple[List[Image.Image], float, int]:
+                   color_offset: bool = False, scan_lines: bool = False, gif: bool = False, cycle: bool = False, step=1,
+                   keep_palette: bool = False, threads: int = 1, progress: Optional[Callable[[int, int, float], None]] = None,
+                   cancel=None, deadline: Optional[float] = None, pipelined: bool = False) -> Tuple[List[Image.Image], float, int]:
         """
          Glitch each frame of input GIF
          Returns the following:
-         * List of PngImage objects,
+         * List of Image objects (palette Image objects if keep_palette=True),
          * Average duration (in centiseconds)
            of each frame in the original GIF,
          * Number of frames in the original GIF
@@ -273,6 +680,22 @@ class ImageGlitcher:
          step: Glitch every step'th frame, defaults to 1 (i.e all frames)
          seed: Set a random seed for generating similar images across runs,
                defaults to None (random seed)
+         keep_palette: Glitch the 1 byte palette indices of P mode frames directly,
+                       keeping each frame's palette and transparency index
+                       color_offset is applied to the palette entries instead,
+                       defaults to False (frames are converted to RGBA)
+         threads: Split each frame's glitch into row bands glitched by this many threads,
+                  small frames automatically use fewer threads, defaults to 1
+         progress: Called as progress(frames_done, total_frames, elapsed_seconds)
+                   before the first frame and after every frame
+         cancel: A cancellation token, i.e a threading.Event, checked before every frame
+                 Once it is set, the job stops by raising concurrent.futures.CancelledError
+         deadline: A time.monotonic() timestamp, checked before every frame
+                   Once it has passed, the job stops by raising TimeoutError
+         Stopped jobs keep no frames around and leave the decimal precision as it was
+         pipelined: Decode the next frame while the current one is glitched, on 2 threads (see pipeline.py),
+                    instead of one after the other, with glitch_gif_encoded the previous one is encoded meanwhile
+                    Frames are the same either way, only used if keep_palette=False, defaults to False
         """
 
         # Sanity checking the params
@@ -298,7 +721,22 @@ class ImageGlitcher:
             raise ValueError('color_offset param must be a boolean')
         if not isinstance(scan_lines, bool):
             raise ValueError('scan_lines param must be a boolean')
-        if not self.__isgif(src_gif):
+        if not isinstance(keep_palette, bool):
+            raise ValueError('keep_palette param must be a boolean')
+        if not (isinstance(threads, int) and threads > 0):
+            raise ValueError(
+                'threads parameter must be a positive integer value greater than 0')
+        if not isinstance(pipelined, bool):
+            raise ValueError('pipelined param must be a boolean')
+        self.__check_job_params(progress, cancel, deadline)
+        self.threads = threads
+        self.region = None
+        # Frames are glitched from the GIF's, render_frame has nothing to render from anymore
+        self.frame_params = None
+        # Frames decoded by an earlier call, the keep_palette path glitches the frames as they are stored
+        key = self.__input_cache_key(src_gif, 'frames') if not keep_palette else None
+        decoded = self.input_cache.get(key) if key is not None else None
+        if decoded is None and not self.__isgif(src_gif):
             raise Exception(
                 'Input image must be a path to a GIF or be a GIF Image object')
 
@@ -307,6 +745,9 @@ class ImageGlitcher:
             # Set the seed if it was given
             self.__reset_rng_seed()
 
+        if decoded is not None:
+            return self.__glitch_gif_frames(None, glitch_amount, glitch_change, color_offset, scan_lines, cycle, step,
+                                            progress, cancel, deadline, pipelined, decoded=decoded)
         try:
             # Get Image, whether input was an str path or Image object
             # GIF input is allowed in this method
@@ -318,27 +759,48 @@ class ImageGlitcher:
             # Throw DETAILED exception here (Traceback will be present from previous exceptions)
             raise Exception('File format not supported - must be an image file')
 
-        # Set up directory for storing glitched images
-        if os.path.isdir(self.gif_dirpath):
-            shutil.rmtree(self.gif_dirpath)
-        os.mkdir(self.gif_dirpath)
-
-        # Set up decimal precision for glitch_change
-        original_prec = getcontext().prec
-        getcontext().prec = 4
+        try:
+            if keep_palette:
+                # Frames are glitched in memory, no temp directory is needed
+                # Like the glitch_image calls of the RGBA path, frames continue the once seeded stream
+                self.seed = None
+                return self.__glitch_gif_palette(gif, glitch_amount, glitch_change, color_offset, scan_lines, cycle, step,
+                                                 progress, cancel, deadline)
+            return self.__glitch_gif_frames(gif, glitch_amount, glitch_change, color_offset, scan_lines, cycle, step,
+                                            progress, cancel, deadline, pipelined, key=key)
+        finally:
+            if isinstance(src_gif, str):
+                # Opened here, so closed here too (i.e when the job was stopped)
+                gif.close()
+
+    def __glitch_gif_frames(self, gif: Optional[Image.Image], glitch_amount: Union[int, float], glitch_change: Union[int, float],
+                            color_offset: bool, scan_lines: bool, cycle: bool, step: int,
+                            progress: Optional[Callable[[int, int, float], None]], cancel, deadline: Optional[float],
+                            pipelined: bool = False, decoded: Optional[DecodedImage] = None,
+                            key: Optional[Tuple] = None) -> Tuple[List[Image.Image], float, int]:
+        """
+         glitch_gif with keep_palette=False, see glitch_gif for the parameters and return values
+
+         Every frame goes through 3 stages:
+         * decode: Decode the next frame (a copy of it, the GIF moves on to the next one)
+         * glitch: Glitch the decoded image
+         * encode: Encode the glitched image with pillow's GIF encoder, on the calling thread
+           Only for glitch_gif_encoded, otherwise the frames are kept in a list
+         Either one frame after the other, or pipelined (see pipeline.py) with pipelined=True
+         Each stage handles the frames in order, so both give the same frames
+
+         With decoded (the frames of an earlier decode stage, from input_cache) given,
+         frames start at the glitch stage. With key given, the decoded frames are
+         stored in input_cache under it once every frame went through
+        """
+        # Index of the next frame and its glitch_amount, only used (and changed) by the glitch stage
+        glitch_state = {'index': 0, 'glitch_amount': glitch_amount}
+        # Output of the decode stage, kept for input_cache
+        decoded_frames = DecodedImage() if key is not None else None
 
-        i = 0
-        duration = 0
-        glitched_imgs = []
-        for frame in ImageSequence.Iterator(gif):
-            """
-             * Save each frame in the temp directory (always png)
-             * Glitch the saved image
-             * Save the glitched image in temp directory
-             * Open the image and append a copy of it to the list
-            """
+        def decode(frame: Image.Image) -> Tuple[int, Image.Image]:
             try:
-                duration += frame.info['duration']
+                frame_duration = frame.info['duration']
             except KeyError as e:
                 # Override error message to provide more info
                 e.args = (
@@ -346,30 +808,589 @@ class ImageGlitcher:
                     'This means PIL(pillow) could not extract necessary information from the input image',
                 )
                 raise
-            src_frame_path = os.path.join(self.gif_dirpath, 'frame.png')
-            frame.save(src_frame_path, compress_level=3)
-            if not i % step == 0:
+            frame = frame.copy()
+            if decoded_frames is not None:
+                decoded_frames.add(frame, frame_duration)
+            return frame_duration, frame
+
+        def glitch(decoded: Tuple[int, Image.Image]) -> Tuple[int, Image.Image]:
+            frame_duration, src_frame = decoded
+            index = glitch_state['index']
+            glitch_state['index'] += 1
+            if not index % step == 0:
                 # Only every step'th frame should be glitched
                 # Other frames will be appended as they are
-                glitched_imgs.append(Image.open(src_frame_path).copy())
-                i += 1
-                continue
-            glitched_img: Image.Image = self.glitch_image(src_frame_path, glitch_amount,
-                                                          color_offset=color_offset, scan_lines=scan_lines)
-            file_path = os.path.join(self.gif_dirpath, 'glitched_frame.png')
-            glitched_img.save(file_path, compress_level=3)
-            glitched_imgs.append(Image.open(file_path).copy())
+                return frame_duration, src_frame
+            # Frames are glitched as RGBA, decoded frames have no format to tell that
+            glitched_img: Image.Image = self.glitch_image(src_frame, glitch_state['glitch_amount'],
+                                                          color_offset=color_offset, scan_lines=scan_lines,
+                                                          threads=self.threads, mode='RGBA')
             # Change glitch_amount by given value
-            glitch_amount = self.__change_glitch(
-                glitch_amount, glitch_change, cycle)
-            i += 1
-
-        # Set decimal precision back to original value
-        getcontext().prec = original_prec
-        # Cleanup
-        shutil.rmtree(self.gif_dirpath)
+            # Decimal contexts are per thread, so set the precision locally
+            with localcontext() as ctx:
+                ctx.prec = 4
+                glitch_state['glitch_amount'] = self.__change_glitch(
+                    glitch_state['glitch_amount'], glitch_change, cycle)
+            return frame_duration, glitched_img
+
+        if decoded is not None:
+            frames = ((decoded.durations[index], decoded.image(index)) for index in range(len(decoded)))
+            stages = (glitch,)
+            total = len(decoded)
+        else:
+            frames = gif_frames(gif)
+            stages = (decode, glitch)
+            total = getattr(gif, 'n_frames', 1)
+        if pipelined:
+            results = pipeline(frames, stages)
+        else:
+            results = sequential(frames, stages)
+
+        # Number of frames and sum of their durations, so far
+        counts = {'frames': 0, 'duration': 0}
+        started = monotonic()
+
+        def finished_frames() -> Iterator[Image.Image]:
+            while True:
+                self.__check_job(counts['frames'], total, started, progress, cancel, deadline)
+                try:
+                    frame_duration, glitched_img = next(results)
+                except StopIteration:
+                    return
+                counts['duration'] += frame_duration
+                counts['frames'] += 1
+                yield glitched_img
+
+        glitched_imgs = []
+        # Closing the results stops the pipeline's stages, even if the job was stopped
+        with closing(results):
+            if self.__gif_writer is not None:
+                # The encode stage, pillow's GIF encoder takes every frame as it's finished
+                self.__gif_writer(finished_frames())
+            else:
+                for glitched_img in finished_frames():
+                    self.__keep_frame(glitched_imgs, glitched_img)
+        if decoded_frames is not None:
+            self.input_cache.put(key, decoded_frames)
+        return glitched_imgs, counts['duration'] / counts['frames'], counts['frames']
+
+    def glitch_gif_encoded(self, src_gif: Union[str, Image.Image], glitch_amount: Union[int, float],
+                           fp: Union[str, BinaryIO], duration: Union[int, float] = 200, loop: int = 0,
+                           **kwargs) -> Tuple[float, int]:
+        """
+         Glitches each frame of input GIF like glitch_gif, and saves the glitched frames as a GIF
+         at fp (a path or a binary file object)
+         Returns the average duration (in centiseconds) of each frame in the original GIF,
+         and the number of frames in the original GIF
+
+         Frames are handed to pillow's GIF encoder as they are glitched, no list of frames is kept
+         With pipelined=True the encoder (which maps each frame to a palette and diffs it with the previous one
+         as it gets it) runs on the calling thread while the next frames are decoded and glitched, see pipeline.py
+         keep_palette=True glitches every frame first, and then encodes them
+
+         PARAMETERS:-
+
+         src_gif: Either the path to input GIF or a GIF Image object itself
+
+         glitch_amount: Level of glitch intensity, [0.1, 10.0] (inclusive)
+
+         fp: Path or binary file object to save the GIF to
+
+         duration: Duration of each frame (in milliseconds), it must be known before the first frame is encoded
+
+         loop: How many times the GIF should loop, 0 means infinite loop
+
+         kwargs: Passed on to glitch_gif (i.e seed, color_offset, step, pipelined)
+        """
+        if not (isinstance(duration, (int, float)) and duration > 0):
+            raise ValueError('duration parameter must be a positive number')
+
+        def write(frames: Iterator[Image.Image]):
+            # Pillow pulls the frames after the first one from the iterator as it goes
+            first = next(frames)
+            first.save(fp, format='GIF', append_images=frames, save_all=True, duration=duration, loop=loop)
+
+        self.__gif_writer = write
+        try:
+            glitched, src_duration, frame_count = self.glitch_gif(src_gif, glitch_amount, **kwargs)
+        finally:
+            self.__gif_writer = None
+        if glitched:
+            # The keep_palette path doesn't go through the encode stage
+            write(iter(glitched))
+        return src_duration, frame_count
+
+    def glitch_bytes(self, data: bytes, glitch_amount: Union[int, float], format: Optional[str] = None,
+                     duration: Optional[Union[int, float]] = None, loop: int = 0, optimize_gif: bool = False, **kwargs) -> bytes:
+        """
+         Glitches an encoded image (i.e the contents of a PNG/JPEG/GIF file)
+         Returns the encoded glitched image, without touching the filesystem
+
+         Animated GIFs go through glitch_gif, every other image through glitch_image
+
+         PARAMETERS:-
+
+         data: Bytes of the encoded input image
+
+         glitch_amount: Level of glitch intensity, [0.1, 10.0] (inclusive)
+
+         format: Image format to encode the output in (i.e PNG, JPEG),
+                 defaults to GIF for GIF outputs and to the input's format otherwise
+
+         duration: Duration of each frame of GIF outputs (in milliseconds),
+                   defaults to the input GIF's average duration, or 200
+                   Given for an input GIF (and without optimize_gif), frames are encoded
+                   as they are glitched, see glitch_gif_encoded
+
+         loop: How many times GIF outputs should loop, 0 means infinite loop
+
+         optimize_gif: Encode GIF outputs with gif_optimizer.save_optimized_gif
+
+         kwargs: Passed on to glitch_gif/glitch_image (i.e seed, color_offset, gif, mode)
+        """
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            raise ValueError('data parameter must be a bytes-like object')
+        try:
+            img = Image.open(io.BytesIO(data))
+        except:
+            raise Exception('File format not supported - must be an image file')
+
+        animated = getattr(img, 'is_animated', False) and img.format == 'GIF'
+        if animated and format is not None and format.upper() != 'GIF':
+            raise ValueError(f'format parameter must be GIF for GIF outputs, not {format}')
+        buffer = io.BytesIO()
+        if self.input_cache is not None:
+            # img is only opened (lazily) here, it's identified by the hash of data in input_cache keys
+            self.__source = (img, hashlib.sha1(data).hexdigest())
+        try:
+            if animated and duration and not optimize_gif:
+                # Frames are encoded as they are glitched
+                self.glitch_gif_encoded(img, glitch_amount, buffer, duration=duration, loop=loop, **kwargs)
+                return buffer.getvalue()
+            if animated:
+                glitched, src_duration, _ = self.glitch_gif(img, glitch_amount, **kwargs)
+                duration = duration or src_duration
+            else:
+                glitched = self.glitch_image(img, glitch_amount, **kwargs)
+                duration = duration or 200
+        finally:
+            self.__source = None
+
+        if isinstance(glitched, list):
+            if format is not None and format.upper() != 'GIF':
+                raise ValueError(f'format parameter must be GIF for GIF outputs, not {format}')
+            if optimize_gif:
+                save_optimized_gif(glitched, buffer, duration=duration, loop=loop)
+            else:
+                glitched[0].save(buffer, format='GIF', append_images=glitched[1:], save_all=True,
+                                 duration=duration, loop=loop)
+        else:
+            glitched = convert_for_format(glitched, format or img.format)
+            glitched.save(buffer, format=format or img.format, compress_level=3)
+        return buffer.getvalue()
+
+    def glitch_renditions(self, src_img: Union[str, Image.Image], glitch_amount: Union[int, float],
+                          renditions: Sequence[Tuple[Optional[Union[int, Tuple[int, int]]], str, Optional[int]]],
+                          duration: Optional[Union[int, float]] = None, loop: int = 0, optimize_gif: bool = False,
+                          workers: Optional[int] = None, **kwargs) -> List[bytes]:
+        """
+         Glitches an image (or GIF) once and encodes it in several sizes and formats
+         Returns the encoded renditions, in the same order as renditions
+
+         Animated GIFs go through glitch_gif, every other image through glitch_image
+         Smaller sizes are downscaled from larger ones and encoded in parallel, see renditions.py
+
+         PARAMETERS:-
+
+         src_img: Either the path to input Image or an Image object itself
+
+         glitch_amount: Level of glitch intensity, [0.1, 10.0] (inclusive)
+
+         renditions: List of (size, format, quality) tuples, i.e [(None, 'PNG', None), (1200, 'JPEG', 85), (256, 'WEBP', 80)]
+                     size is None for the full size, an int to fit the longest side in, or a (width, height) box to fit in
+                     quality is the encoder quality (i.e for JPEG/WEBP), None for the format's default
+                     GIF outputs can only be rendered in animated formats (i.e GIF, PNG, WEBP)
+
+         duration: Duration of each frame of GIF outputs (in milliseconds),
+                   defaults to the input GIF's duration, or 200
+
+         loop: How many times GIF outputs should loop, 0 means infinite loop
+
+         optimize_gif: Encode GIF renditions of GIF outputs with gif_optimizer.save_optimized_gif
+
+         workers: Number of encoding threads, defaults to one per rendition (at most one per CPU)
+
+         kwargs: Passed on to glitch_gif/glitch_image (i.e seed, color_offset, gif, mode)
+        """
+        # Validate the renditions before glitching, GIF outputs need animated formats
+        input_gif = self.__isgif(src_img)
+        check_renditions(renditions, animated=input_gif or bool(kwargs.get('gif')))
+
+        if input_gif:
+            glitched, src_duration, _ = self.glitch_gif(src_img, glitch_amount, **kwargs)
+            duration = duration or src_duration
+        else:
+            glitched = self.glitch_image(src_img, glitch_amount, **kwargs)
+            duration = duration or 200
+        return render_renditions(glitched, renditions, duration=duration, loop=loop,
+                                 optimize_gif=optimize_gif, workers=workers)
+
+    def glitch_budgeted(self, src_img: Union[str, Image.Image], glitch_amount: Union[int, float],
+                        max_bytes: Optional[int] = None, max_seconds: Optional[float] = None, frames: int = 23,
+                        duration: Union[int, float] = 200, loop: int = 0, mode: Optional[str] = None,
+                        **kwargs) -> Tuple[bytes, Dict[str, Union[int, float, Tuple[int, int]]]]:
+        """
+         Glitches an image into a GIF that fits a byte size and/or time budget, in one pass
+         Returns the encoded GIF (see gif_optimizer) and the settings that were used:
+         scale, frames, colors (palette size), duration, size, predicted_bytes, predicted_seconds, bytes, seconds
+
+         A small pilot render is timed and encoded first, the frame count, scale and palette size
+         are then chosen from it so the full render fits the budget (see budget.py)
+         Should the full render still come out too large, its frames are downscaled
+         (not glitched again) until it fits
+
+         PARAMETERS:-
+
+         src_img: Either the path to input Image or an Image object itself
+
+         glitch_amount: Level of glitch intensity, [0.1, 10.0] (inclusive)
+
+         max_bytes: Largest size (in bytes) the GIF may have
+
+         max_seconds: Time (in seconds) the whole call should take at most, the pilot included
+                      This is a best effort, unlike max_bytes
+
+         frames: Number of frames wanted, fewer are rendered only if the budget calls for it
+
+         duration: Duration of each frame (in milliseconds) for the wanted number of frames
+                   Fewer frames last longer each, so the GIF loops in the same time
+
+         loop: How many times the GIF should loop, 0 means infinite loop
+
+         mode: Same as in glitch_image
+
+         kwargs: Passed on to glitch_image (i.e seed, color_offset, scan_lines, step, seekable)
+        """
+        if max_bytes is None and max_seconds is None:
+            raise ValueError('max_bytes or max_seconds parameter must be given')
+        if max_bytes is not None and not (isinstance(max_bytes, int) and max_bytes > 0):
+            raise ValueError('max_bytes parameter must be a positive integer value greater than 0')
+        if max_seconds is not None and not (isinstance(max_seconds, (int, float)) and max_seconds > 0):
+            raise ValueError('max_seconds parameter must be a number greater than 0')
+        if not (isinstance(frames, int) and frames > 0):
+            raise ValueError('frames param must be a positive integer value greater than 0')
+        fixed = {'gif', 'frames', 'roi', 'mask'} & set(kwargs)
+        if fixed:
+            raise ValueError(f'{", ".join(sorted(fixed))} cannot be used with glitch_budgeted')
+
+        started = monotonic()
+        try:
+            img = self.__fetch_image(src_img, gif_allowed=False, mode=mode)
+        except FileNotFoundError:
+            # Throw DETAILED exception here (Traceback will be present from previous exceptions)
+            raise FileNotFoundError(f'No image found at given path: {src_img}')
+        except:
+            # Throw DETAILED exception here (Traceback will be present from previous exceptions)
+            raise Exception(
+                'File format not supported - must be a non-animated image file')
+        area = img.size[0] * img.size[1]
+
+        # Pilot render, downscaled, with a few frames
+        pilot_start = monotonic()
+        pilot_scale = min(1.0, math.sqrt(PILOT_PIXELS / area))
+        pilot_img = img.resize(scaled_size(img.size, pilot_scale), Image.LANCZOS) if pilot_scale < 1.0 else img
+        resize_seconds = monotonic() - pilot_start
+        pilot_frames = min(frames, PILOT_FRAMES)
+        pilot_start = monotonic()
+        # Resized images have no format, 'native' keeps their mode as is
+        pilot = self.glitch_image(pilot_img, glitch_amount, gif=True, frames=pilot_frames, mode='native', **kwargs)
+        all_bytes = {COLORS[0]: len(encode_gif(pilot, duration, loop, COLORS[0]))}
+        pilot_seconds = monotonic() - pilot_start
+        first_bytes = {}
+        for colors in COLORS:
+            first_bytes[colors] = len(encode_gif(pilot[:1], duration, loop, colors))
+            if colors not in all_bytes:
+                all_bytes[colors] = len(encode_gif(pilot, duration, loop, colors))
+        model = BudgetModel(img.size, pilot_img.size, pilot_frames, first_bytes, all_bytes,
+                            pilot_seconds / (pilot_frames * pilot_img.size[0] * pilot_img.size[1]),
+                            resize_seconds / area if pilot_scale < 1.0 else 0.0)
+
+        # The pilot already used up part of the time budget
+        remaining_seconds = None if max_seconds is None else max_seconds - (monotonic() - started)
+        settings = model.choose(frames, max_bytes, remaining_seconds)
+
+        scale = settings['scale']
+        full_img = img.resize(scaled_size(img.size, scale), Image.LANCZOS) if scale < 1.0 else img
+        glitched = self.glitch_image(full_img, glitch_amount, gif=True, frames=settings['frames'], mode='native', **kwargs)
+        frame_duration = duration * frames / settings['frames']
+        data = encode_gif(glitched, frame_duration, loop, settings['colors'])
+        while max_bytes is not None and len(data) > max_bytes and min(glitched[0].size) > MIN_SIDE:
+            # The prediction was off, shrink the rendered frames in proportion to the excess
+            glitched = downscale_frames(glitched, 0.95 * math.sqrt(max_bytes / len(data)))
+            data = encode_gif(glitched, frame_duration, loop, settings['colors'])
+        if max_bytes is not None and len(data) > max_bytes:
+            raise ValueError(f'Cannot fit the GIF in {max_bytes} bytes, even at {glitched[0].size}')
+
+        settings.update({'duration': round(frame_duration), 'size': glitched[0].size,
+                         'bytes': len(data), 'seconds': monotonic() - started})
+        return data, settings
+
+    def glitch_atlas(self, src_img: Union[str, Image.Image], glitch_amount: Union[int, float], columns: Optional[int] = None,
+                     duration: Optional[Union[int, float]] = None, loop: int = 0, **kwargs) -> Tuple[Image.Image, Dict]:
+        """
+         Glitches an image (into frames, like glitch_image(gif=True)) or a GIF (like glitch_gif)
+         into a sprite sheet: one atlas Image with every frame tiled row by row, and a JSON-able frame map
+         Returns the atlas and its frame map, see atlas.py (atlas.save_atlas saves both)
+
+         Frames are copied straight into the preallocated atlas as they are glitched,
+         no list of frames is kept and nothing is encoded until the atlas is saved
+
+         PARAMETERS:-
+
+         src_img: Either the path to input Image or an Image object itself
+
+         glitch_amount: Level of glitch intensity, [0.1, 10.0] (inclusive)
+
+         columns: Number of frames per atlas row, defaults to a roughly square atlas
+
+         duration: Duration of each frame (in milliseconds) in the frame map,
+                   defaults to the input GIF's average duration, or 200
+
+         loop: How many times the animation should loop in the frame map, 0 means infinite loop
+
+         kwargs: Passed on to glitch_gif/glitch_image (i.e seed, color_offset, frames, seekable, workers)
+        """
+        if 'gif' in kwargs:
+            raise ValueError('gif cannot be used with glitch_atlas, frames are always made')
+        is_gif = self.__isgif(src_img)
+        gif = Image.open(src_img) if is_gif and isinstance(src_img, str) else src_img
+        try:
+            if is_gif:
+                frame_count = getattr(gif, 'n_frames', 1)
+            else:
+                frame_count = kwargs.get('frames', 23)
+                if not (isinstance(frame_count, int) and frame_count > 0):
+                    raise ValueError('frames param must be a positive integer value greater than 0')
+
+            self.__atlas = AtlasBuilder(frame_count, columns)
+            if is_gif:
+                _, src_duration, _ = self.glitch_gif(gif, glitch_amount, **kwargs)
+                duration = duration or src_duration
+            else:
+                self.glitch_image(src_img, glitch_amount, gif=True, **kwargs)
+                duration = duration or 200
+            atlas = self.__atlas
+        finally:
+            self.__atlas = None
+            if gif is not src_img:
+                # Opened here, so closed here too
+                gif.close()
+        return atlas.image(), atlas.frame_map(duration, loop)
+
+    def estimate(self, src_img: Union[str, bytes, Image.Image], **params) -> Dict[str, Union[int, float, str]]:
+        """
+         Predicts the cost of glitching src_img with params, before accepting the job
+         Only the header of src_img is read (size, mode and number of frames), nothing is decoded
+
+         Animated GIFs are estimated as glitch_gif, every other image as glitch_image
+         Rates come from cost_model (see estimate.py, and `glitch_this calibrate` to fit them)
+
+         Returns a dict of:
+         width, height: Size of the input
+         mode: Mode the frames are glitched in
+         frames: Number of output frames
+         peak_bytes: Memory held at once by the images and arrays of the job
+         output_bytes: Size of the encoded output (the input's format for still images, GIF otherwise)
+         seconds: Render time, without saving the output
+
+         PARAMETERS:-
+
+         src_img: Path, bytes or Image object of the input
+
+         params: glitch_image/glitch_gif parameters (i.e gif, frames, step, mode, color_offset, keep_palette, roi, mask),
+                 the ones that don't change the cost (i.e glitch_amount, seed) are ignored
+        """
+        model = self.cost_model or CostModel()
+        if isinstance(src_img, str) and not os.path.isfile(src_img):
+            raise FileNotFoundError(f'No image found at given path: {src_img}')
+        try:
+            img, animated = read_header(src_img)
+        except:
+            raise Exception('File format not supported - must be an image file')
+
+        try:
+            if animated:
+                mode = 'P' if params.get('keep_palette', False) else 'RGBA'
+                cost = model.estimate_gif(img.size, img.n_frames, step=params.get('step', 1),
+                                          color_offset=params.get('color_offset', False),
+                                          scan_lines=params.get('scan_lines', False),
+                                          keep_palette=params.get('keep_palette', False),
+                                          pipelined=params.get('pipelined', False),
+                                          data_bytes=encoded_size(src_img))
+            else:
+                mode = self.__estimate_mode(src_img, img, params.get('mode'))
+                cost = model.estimate_image(img.size, img.mode, mode, img.format, gif=params.get('gif', False),
+                                            frames=params.get('frames', 23), step=params.get('step', 1),
+                                            color_offset=params.get('color_offset', False),
+                                            scan_lines=params.get('scan_lines', False),
+                                            seekable=params.get('seekable', False), workers=params.get('workers', 1),
+                                            roundtrip=params.get('mode') is None,
+                                            region=region_fraction(img.size, params.get('roi'), params.get('mask')))
+        finally:
+            if img is not src_img:
+                # Opened here, so closed here too
+                img.close()
+        return dict({'width': img.size[0], 'height': img.size[1], 'mode': mode}, **cost)
+
+    def __estimate_mode(self, src_img: Union[str, bytes, Image.Image], img: Image.Image, mode: Optional[str]) -> str:
+        # The mode __fetch_image would convert img (opened from src_img) to, without converting it
+        if mode is None:
+            if img.format == 'GIF' and isinstance(src_img, Image.Image):
+                # Do not convert GIF file
+                return img.mode
+            is_png = src_img.endswith('.png') if isinstance(src_img, str) else img.format == 'PNG'
+            return 'RGBA' if is_png else 'RGB'
+        if mode != 'native':
+            return mode
+        if img.mode == 'PA' or (img.mode == 'P' and 'transparency' in img.info):
+            return 'RGBA'
+        return 'RGB' if img.mode == 'P' else img.mode
+
+    def __png_roundtrip(self, img: Image.Image) -> Image.Image:
+        # Encodes img as PNG and decodes it back, in memory
+        # The result has the exact mode and pixels of img saved to and opened from a PNG file
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG', compress_level=3)
+        buffer.seek(0)
+        png_img = Image.open(buffer)
+        png_img.load()
+        return png_img
+
+    def __glitch_gif_palette(self, gif: Image.Image, glitch_amount: Union[int, float], glitch_change: Union[int, float],
+                             color_offset: bool, scan_lines: bool, cycle: bool, step: int,
+                             progress: Optional[Callable[[int, int, float], None]], cancel, deadline: Optional[float]) -> Tuple[List[Image.Image], float, int]:
+        # glitch_gif with keep_palette=True, see glitch_gif for the parameters and return values
+        # Keep every frame with the same palette as the first one in P mode (pillow >= 9.1)
+        # Frames with a palette of their own are still decoded to RGB(A) by pillow and glitched as such
+        # Swapped in only while seeking frames, see gif_frames
+        strategy = getattr(GifImagePlugin, 'LoadingStrategy', None)
+        if strategy is not None:
+            strategy = strategy.RGB_AFTER_DIFFERENT_PALETTE_ONLY
+
+        # Set up decimal precision for glitch_change
+        original_prec = getcontext().prec
+        getcontext().prec = 4
+
+        i = 0
+        duration = 0
+        total = getattr(gif, 'n_frames', 1)
+        started = monotonic()
+        glitched_imgs = []
+        try:
+            for frame in gif_frames(gif, strategy):
+                self.__check_job(i, total, started, progress, cancel, deadline)
+                try:
+                    duration += frame.info['duration']
+                except KeyError as e:
+                    # Override error message to provide more info
+                    e.args = (
+                        'The key "duration" does not exist in frame.'
+                        'This means PIL(pillow) could not extract necessary information from the input image',
+                    )
+                    raise
+                if not i % step == 0:
+                    # Only every step'th frame should be glitched
+                    # Other frames will be appended as they are
+                    self.__keep_frame(glitched_imgs, frame, copy=True)
+                    i += 1
+                    continue
+                self.__keep_frame(glitched_imgs, self.__get_glitched_frame(
+                    frame, glitch_amount, color_offset, scan_lines))
+                # Change glitch_amount by given value
+                glitch_amount = self.__change_glitch(
+                    glitch_amount, glitch_change, cycle)
+                i += 1
+            self.__check_job(i, total, started, progress, cancel, deadline)
+        finally:
+            # Set decimal precision back to original value
+            getcontext().prec = original_prec
         return glitched_imgs, duration / i, i
 
+    def __get_glitched_frame(self, frame: Image.Image, glitch_amount: Union[int, float], color_offset: bool, scan_lines: bool) -> Image.Image:
+        """
+         Glitches a GIF frame in its own mode
+
+         P mode frames are glitched on their palette indices,
+         the color offset rotates one channel of the palette entries
+         and scan lines use the darkest palette entry
+        """
+        self.img_width, self.img_height = frame.size
+        self.img_mode = frame.mode
+        self.inputarr = np.asarray(frame)
+        self.outputarr = np.array(frame)
+        if frame.mode != 'P':
+            self.pixel_tuple_len = len(frame.getbands())
+            return self.__get_glitched_img(glitch_amount, color_offset, scan_lines)
+
+        # The palette's R, G and B are the channels to pick from for the color offset
+        self.pixel_tuple_len = 3
+        plan, color = self.__draw_plan(glitch_amount, color_offset)
+        self.__apply_plan(self.inputarr, self.outputarr, plan, None, False)
+
+        palette = np.array(frame.getpalette()[:768], dtype=np.uint8).reshape(-1, 3)
+        transparency = frame.info.get('transparency')
+        if color:
+            channel_index, offset_x, _ = color
+            palette[:, channel_index] = np.roll(palette[:, channel_index], offset_x)
+        if scan_lines:
+            # Make every other row use the darkest opaque palette entry
+            # Transparent pixels are left untouched, like alpha in RGBA images
+            brightness = palette.astype(np.int32).sum(axis=1)
+            if isinstance(transparency, int) and transparency < len(brightness):
+                brightness[transparency] = brightness.max() + 1
+            scan_rows = self.outputarr[::2]
+            if isinstance(transparency, int):
+                scan_rows[scan_rows != transparency] = np.argmin(brightness)
+            else:
+                scan_rows[...] = np.argmin(brightness)
+
+        glitched_frame = Image.fromarray(self.outputarr, 'P')
+        glitched_frame.putpalette(palette.tobytes())
+        if transparency is not None:
+            glitched_frame.info['transparency'] = transparency
+        glitched_frame.info['duration'] = frame.info['duration']
+        return glitched_frame
+
+    def __keep_frame(self, glitched_imgs: List[Image.Image], frame: Image.Image, copy: bool = False):
+        # Adds a finished frame to glitched_imgs (copied, if copy=True)
+        # Or straight into the atlas being built instead (see glitch_atlas)
+        if self.__atlas is not None:
+            self.__atlas.put(frame)
+        else:
+            glitched_imgs.append(frame.copy() if copy else frame)
+
+    def __check_job_params(self, progress: Optional[Callable[[int, int, float], None]], cancel, deadline: Optional[float]):
+        # Sanity checks the progress, cancel and deadline params of GIF jobs
+        if progress is not None and not callable(progress):
+            raise ValueError('progress param must be callable')
+        if cancel is not None and not callable(getattr(cancel, 'is_set', None)):
+            raise ValueError('cancel param must be a threading.Event (or have an is_set method)')
+        if deadline is not None and not isinstance(deadline, (int, float)):
+            raise ValueError('deadline param must be a time.monotonic() timestamp')
+
+    def __check_job(self, done: int, total: int, started: float, progress: Optional[Callable[[int, int, float], None]],
+                    cancel, deadline: Optional[float]):
+        # Reports the progress of a GIF job, called before every frame and once all frames are done
+        # Stops the job (by raising) if it was cancelled or its deadline passed, unless it is done anyway
+        if progress is not None:
+            progress(done, total, monotonic() - started)
+        if done >= total:
+            return
+        if cancel is not None and cancel.is_set():
+            raise CancelledError(f'Glitching was cancelled after {done} of {total} frames')
+        if deadline is not None and monotonic() >= deadline:
+            raise TimeoutError(f'Deadline passed after {done} of {total} frames')
+
     def __change_glitch(self, glitch_amount: Union[int, float], glitch_change: Union[int, float], cycle: bool) -> float:
         # A function to change glitch_amount by given increment/decrement
         glitch_amount = float(Decimal(glitch_amount) + Decimal(glitch_change))
@@ -386,13 +1407,87 @@ class ImageGlitcher:
                 self.glitch_max)) if cycle else self.glitch_max
         return glitch_amount
 
-    def __get_glitched_img(self, glitch_amount: Union[int, float], color_offset: int, scan_lines: bool) -> Image.Image:
+    def __get_glitched_img(self, glitch_amount: Union[int, float], color_offset: int, scan_lines: bool,
+                           from_input: bool = False) -> Image.Image:
         """
          Glitches the image located at given path
          Intensity of glitch depends on glitch_amount
+
+         from_input: True if outputarr is still an untouched copy of inputarr,
+                     the glitch can then start from a cached stage (see __render)
+        """
+        plan, color = self.__draw_plan(glitch_amount, color_offset)
+        if from_input:
+            self.outputarr = self.__render(plan, color, scan_lines)
+        else:
+            self.__apply_plan(self.inputarr, self.outputarr, plan, color, scan_lines)
+
+        # Creating glitched image from output array
+        return self.__output_image(self.outputarr)
+
+    def __output_image(self, arr: np.ndarray) -> Image.Image:
+        # Creates the output Image from a glitched (or untouched) inputarr sized array
+        # With a region set, arr is put back into a copy of the whole image first
+        if self.region is None:
+            return self.__array_to_image(arr)
+        fullarr, top, bottom, left, right, region_mask = self.region
+        outputarr = np.array(fullarr)
+        if region_mask is None:
+            outputarr[top:bottom, left:right] = arr
+        else:
+            np.copyto(outputarr[top:bottom, left:right], arr, where=region_mask)
+        return self.__array_to_image(outputarr)
+
+    def __get_region(self, roi: Optional[Tuple[int, int, int, int]],
+                     mask: Optional[Union[Image.Image, np.ndarray]]) -> Tuple[int, int, int, int, Optional[np.ndarray]]:
+        """
+         Sanity checks roi and mask and returns the region to glitch
+         as (top, bottom, left, right, mask), the mask being None or
+         a boolean array of the region (with a channel axis for multi channel images)
+        """
+        if roi is not None:
+            if not (isinstance(roi, (tuple, list)) and len(roi) == 4 and all(isinstance(value, int) for value in roi)):
+                raise ValueError('roi param must be a (left, upper, right, lower) tuple of integers')
+            left, top, right, bottom = roi
+            if not (0 <= left < right <= self.img_width and 0 <= top < bottom <= self.img_height):
+                raise ValueError(f'roi param must be a non-empty box within the image size {self.img_width}x{self.img_height}')
+        if mask is None:
+            return top, bottom, left, right, None
+
+        if isinstance(mask, Image.Image):
+            mask = np.asarray(mask.convert('L')) if mask.mode != '1' else np.asarray(mask)
+        mask = np.asarray(mask)
+        if mask.shape != (self.img_height, self.img_width):
+            raise ValueError(f'mask param must have the image size {self.img_width}x{self.img_height}')
+        mask = mask.astype(bool)
+        if roi is None:
+            # Limit the glitch to the mask's bounding box
+            rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+            if not rows.size:
+                raise ValueError('mask param must select at least one pixel')
+            top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        region_mask = mask[top:bottom, left:right]
+        if self.inputarr.ndim == 3:
+            region_mask = region_mask[:, :, None]
+        return int(top), int(bottom), int(left), int(right), region_mask
+
+    def __array_to_image(self, arr: np.ndarray) -> Image.Image:
+        # Creates an Image of self.img_mode from arr
+        # Wider dtypes (i.e 16 bit) already tell pillow their mode
+        if arr.dtype.itemsize == 1:
+            return Image.fromarray(arr, self.img_mode)
+        return Image.fromarray(arr)
+
+    def __draw_plan(self, glitch_amount: Union[int, float], color_offset: bool) -> Tuple[List[Tuple[int, int, int]], Optional[Tuple[int, int, int]]]:
+        """
+         Draws every random value needed for one glitch from the `random` module
+
+         Returns the shift plan, a list of (offset, start_y, stop_y)
+         And the color offset, a tuple of (channel, offset_x, offset_y) - None if not needed
         """
         max_offset = int((glitch_amount ** 2 / 100) * self.img_width)
         doubled_glitch_amount = int(glitch_amount * 2)
+        plan = []
         for shift_number in range(0, doubled_glitch_amount):
 
             if self.seed:
@@ -407,157 +1502,229 @@ class ImageGlitcher:
             if current_offset == 0:
                 # Can't wrap left OR right when offset is 0, End of Array
                 continue
-            if current_offset < 0:
-                # Grab a rectangle of specific width and heigh, shift it left
-                # by a specified offset
-                # Wrap around the lost pixel data from the right
-                self.__glitch_left(-current_offset)
-            else:
-                # Grab a rectangle of specific width and height, shift it right
-                # by a specified offset
-                # Wrap around the lost pixel data from the left
-                self.__glitch_right(current_offset)
+
+            # Setting up values that will determine the rectangle height
+            start_y = random.randint(0, self.img_height)
+            # Regions (or images) less than 4 rows tall still get 1 row chunks
+            chunk_height = random.randint(1, max(1, int(self.img_height / 4)))
+            chunk_height = min(chunk_height, self.img_height - start_y)
+            plan.append((current_offset, start_y, start_y + chunk_height))
 
         if self.seed:
             # Get the same channels on the next call, we have to reset the rng seed
             # as the previous loop isn't fixed in size of iterations and depends on glitch amount
             self.__reset_rng_seed()
 
+        color = None
         if color_offset:
             # Get the next random channel we'll offset, needs to be before the random.randints
             # arguments because they will use up the original seed (if a custom seed is used)
             random_channel = self.__get_random_channel()
+            color = (random_channel,
+                     random.randint(-doubled_glitch_amount, doubled_glitch_amount),
+                     random.randint(-doubled_glitch_amount, doubled_glitch_amount))
+        return plan, color
+
+    def __draw_seekable_plan(self, frame: int, glitch_amount: Union[int, float], color_offset: bool) -> Tuple[List[Tuple[int, int, int]], Optional[Tuple[int, int, int]]]:
+        """
+         Same as __draw_plan, but draws from a Philox counter-based generator
+         keyed by (seed, frame, shift) instead of the global `random` state
+
+         The seed is the Philox key and the frame index is the highest counter word
+         All draws for the frame come from a single vectorized call, row 0 belongs
+         to the color offset and row i + 1 to the i'th shift - so a shift's values
+         never depend on how many shifts (or frames) came before it
+        """
+        max_offset = int((glitch_amount ** 2 / 100) * self.img_width)
+        doubled_glitch_amount = int(glitch_amount * 2)
+
+        rng = np.random.Generator(np.random.Philox(key=self.__philox_key(),
+                                                   counter=[0, 0, 0, frame]))
+        draws = rng.random((doubled_glitch_amount + 1, 3))
+
+        # Scale the [0, 1) draws to integers in [low, high] (inclusive), like random.randint
+        low = np.array([[0, -doubled_glitch_amount, -doubled_glitch_amount],
+                        [-max_offset, 0, 1]])
+        high = np.array([[self.pixel_tuple_len - 1, doubled_glitch_amount, doubled_glitch_amount],
+                         [max_offset, self.img_height, max(1, int(self.img_height / 4))]])
+        color_row = low[0] + (draws[0] * (high[0] - low[0] + 1)).astype(np.int64)
+        shift_rows = low[1] + (draws[1:] * (high[1] - low[1] + 1)).astype(np.int64)
+
+        color = tuple(int(value) for value in color_row) if color_offset else None
+
+        offsets, start_ys, chunk_heights = shift_rows.T
+        chunk_heights = np.minimum(chunk_heights, self.img_height - start_ys)
+        # Can't wrap left OR right when offset is 0, those shifts are dropped
+        keep = offsets != 0
+        plan = np.stack((offsets, start_ys, start_ys + chunk_heights), axis=1)[keep]
+        return [tuple(shift) for shift in plan.tolist()], color
+
+    def __render(self, plan: List[Tuple[int, int, int]], color: Optional[Tuple[int, int, int]], scan_lines: bool) -> np.ndarray:
+        """
+         Glitches a fresh copy of inputarr and returns it
+
+         With a stage_cache, the array after the shifts and the array after the color offset
+         are cached, keyed by the input and everything drawn up to that stage
+         So a render that only changes a later stage (i.e scan_lines) starts from there
+        """
+        if self.stage_cache is None or self.input_key is None:
+            outputarr = np.array(self.inputarr)
+            self.__apply_plan(self.inputarr, outputarr, plan, color, scan_lines)
+            return outputarr
+
+        shift_key = ('shift', self.input_key, tuple(plan))
+        stage = self.stage_cache.get(shift_key)
+        if stage is None:
+            stage = np.array(self.inputarr)
+            self.__apply_plan(self.inputarr, stage, plan, None, False)
+            self.stage_cache.put(shift_key, stage)
+
+        if color:
+            color_key = ('color', self.input_key, tuple(plan), color)
+            colored = self.stage_cache.get(color_key)
+            if colored is None:
+                colored = np.array(stage)
+                self.__apply_plan(self.inputarr, colored, [], color, False)
+                self.stage_cache.put(color_key, colored)
+            stage = colored
+
+        # Cached stages are read-only, the output is a copy
+        outputarr = np.array(stage)
+        if scan_lines:
+            self.__apply_plan(self.inputarr, outputarr, [], None, True)
+        return outputarr
+
+    def __get_input_key(self) -> Tuple:
+        # Identifies inputarr by its content, for stage_cache keys
+        digest = hashlib.sha1(np.ascontiguousarray(self.inputarr)).hexdigest()
+        return (self.img_mode, self.inputarr.shape, self.inputarr.dtype.str, digest)
+
+    def __apply_plan(self, inputarr: np.ndarray, outputarr: np.ndarray, plan: List[Tuple[int, int, int]],
+                     color: Optional[Tuple[int, int, int]], scan_lines: bool):
+        """
+         Applies a shift plan and the optional color offset/scan lines
+         Reads from inputarr and writes into outputarr
+
+         Every output row only depends on the shifts covering it (in order)
+         So with multiple threads, each one applies the whole plan to its own
+         band of rows - giving the exact same result as a single thread
+        """
+        if inputarr.ndim == 2:
+            # Single channel images (i.e L, I;16) - glitch them through a channel axis view
+            inputarr, outputarr = inputarr[:, :, None], outputarr[:, :, None]
+        if color:
+            # Offsets past the array's size (i.e of a small roi) wrap around, like smaller ones do
+            channel_index, offset_x, offset_y = color
+            img_height, img_width = inputarr.shape[:2]
+            if abs(offset_x) >= img_width or abs(offset_y) >= img_height:
+                color = (channel_index, offset_x % img_width, offset_y % img_height)
+        shift_kernel, color_offset_kernel = self.__get_kernels(inputarr, plan, color)
+        bands = self.__row_bands(inputarr.shape[0], inputarr.shape[1])
+        if len(bands) > 1:
+            with ThreadPoolExecutor(max_workers=len(bands)) as pool:
+                # Consume the results to surface any exception raised in a band
+                list(pool.map(lambda band: self.__apply_plan_rows(inputarr, outputarr, plan, color, scan_lines,
+                                                                  shift_kernel, *band),
+                              bands))
+            return
+
+        for offset, start_y, stop_y in plan:
+            # Shift a rectangle of rows left/right by offset (see kernels.py)
+            # Wrapping around the lost pixel data from the other side
+            shift_kernel(inputarr, outputarr, start_y, stop_y, offset)
+
+        if color:
             # Add color channel offset if checked true
-            self.__color_offset(random.randint(-doubled_glitch_amount, doubled_glitch_amount),
-                                random.randint(-doubled_glitch_amount,
-                                               doubled_glitch_amount),
-                                random_channel)
+            channel_index, offset_x, offset_y = color
+            color_offset_kernel(inputarr, outputarr, offset_x, offset_y, channel_index)
 
         if scan_lines:
             # Add scan lines if checked true
-            self.__add_scan_lines()
+            self.__add_scan_lines(outputarr)
+
+    def __get_kernels(self, inputarr: np.ndarray, plan: List[Tuple[int, int, int]],
+                      color: Optional[Tuple[int, int, int]]) -> Tuple[Callable, Callable]:
+        # (shift, color offset) kernels for inputarr, the reference ones unless a kernel_registry is set
+        # Only the ops that are actually needed are looked up (and autotuned)
+        if self.kernel_registry is None:
+            return shift_reference, color_offset_reference
+        return (self.kernel_registry.select('shift', inputarr) if plan else shift_reference,
+                self.kernel_registry.select('color_offset', inputarr) if color else color_offset_reference)
+
+    def __row_bands(self, img_height: int, img_width: int) -> List[Tuple[int, int]]:
+        # Splits the rows into (start_y, stop_y) bands, one per thread
+        # Never more bands than the image has room for (see thread_min_pixels)
+        band_count = min(self.threads, img_height,
+                         (img_height * img_width) // self.thread_min_pixels)
+        band_count = max(band_count, 1)
+        edges = np.linspace(0, img_height, band_count + 1).astype(int)
+        return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+    def __apply_plan_rows(self, inputarr: np.ndarray, outputarr: np.ndarray, plan: List[Tuple[int, int, int]],
+                          color: Optional[Tuple[int, int, int]], scan_lines: bool, shift_kernel: Callable,
+                          band_start: int, band_stop: int):
+        # __apply_plan limited to output rows band_start to band_stop (exclusive)
+        for offset, start_y, stop_y in plan:
+            # Only the part of the rectangle inside this band
+            start_y, stop_y = max(start_y, band_start), min(stop_y, band_stop)
+            if start_y >= stop_y:
+                continue
+            shift_kernel(inputarr, outputarr, start_y, stop_y, offset)
 
-        # Creating glitched image from output array
-        return Image.fromarray(self.outputarr, self.img_mode)
+        if color:
+            channel_index, offset_x, offset_y = color
+            self.__color_offset_rows(inputarr, outputarr, offset_x, offset_y, channel_index,
+                                     band_start, band_stop)
 
-    def __add_scan_lines(self):
+        if scan_lines:
+            # Same rows as __add_scan_lines, every even row of the image
+            channels, values = self.__scan_line_channels(outputarr)
+            outputarr[band_start + band_start % 2:band_stop:2, :, channels] = values
+
+    def __add_scan_lines(self, outputarr: np.ndarray):
         # Make every other row have only black pixels
-        # Only the R, G, and B channels are assigned 0 values
+        # Only the color channels are assigned (i.e R, G and B are assigned 0 values)
         # Alpha is left untouched (if present)
-        self.outputarr[::2, :, :3] = [0, 0, 0]
-
-    def __glitch_left(self, offset: int):
-        """
-         Grabs a rectange from inputarr and shifts it leftwards
-         Any lost pixel data is wrapped back to the right
-         Rectangle's Width and Height are determined from offset
-
-         Consider an array like so-
-         [[ 0, 1, 2, 3],
-         [ 4, 5, 6, 7],
-         [ 8, 9, 10, 11],
-         [12, 13, 14, 15]]
-         If we were to left shift the first row only, starting from the 1st index;
-         i.e a rectangle of width = 3, height = 1, starting at (0, 0)
-         We'd grab [1, 2, 3] and left shift it until the start of row
-         so it'd look like [[1, 2, 3, 3]]
-         Now we wrap around the lost values, i.e 0
-         now it'd look like [[1, 2, 3, 0]]
-         That's the end result!
-        """
-        # Setting up values that will determine the rectangle height
-        start_y = random.randint(0, self.img_height)
-        chunk_height = random.randint(1, int(self.img_height / 4))
-        chunk_height = min(chunk_height, self.img_height - start_y)
-        stop_y = start_y + chunk_height
-
-        # For copy
-        start_x = offset
-        # For paste
-        stop_x = self.img_width - start_x
-
-        left_chunk = self.inputarr[start_y:stop_y, start_x:]
-        wrap_chunk = self.inputarr[start_y:stop_y, :start_x]
-        self.outputarr[start_y:stop_y, :stop_x] = left_chunk
-        self.outputarr[start_y:stop_y, stop_x:] = wrap_chunk
-
-    def __glitch_right(self, offset: int):
-        """
-         Grabs a rectange from inputarr and shifts it rightwards
-         Any lost pixel data is wrapped back to the left
-         Rectangle's Width and Height are determined from offset
-
-         Consider an array like so-
-         [[ 0, 1, 2, 3],
-         [ 4, 5, 6, 7],
-         [ 8, 9, 10, 11],
-         [12, 13, 14, 15]]
-         If we were to right shift the first row only, starting from
-         the 0th index;
-         i.e a rectangle of width = 3, height = 1 starting at (0, 0)
-         We'd grab [0, 1, 2] and right shift it until the end of row
-         so it'd look like [[0, 0, 1, 2]]
-         Now we wrap around the lost values, i.e 3
-         now it'd look like [[3, 0, 1, 2]]
-         That's the end result!
-        """
-        # Setting up values that will determine the rectangle height
-        start_y = random.randint(0, self.img_height)
-        chunk_height = random.randint(1, int(self.img_height / 4))
-        chunk_height = min(chunk_height, self.img_height - start_y)
-        stop_y = start_y + chunk_height
-
-        # For copy
-        stop_x = self.img_width - offset
-        # For paste
-        start_x = offset
-
-        right_chunk = self.inputarr[start_y:stop_y, :stop_x]
-        wrap_chunk = self.inputarr[start_y:stop_y, stop_x:]
-        self.outputarr[start_y:stop_y, start_x:] = right_chunk
-        self.outputarr[start_y:stop_y, :start_x] = wrap_chunk
-
-    def __color_offset(self, offset_x: int, offset_y: int, channel_index: int):
-        """
-         Takes the given channel's color value from inputarr,
-         starting from (0, 0)
-         and puts it in the same channel's slot in outputarr,
-         starting from (offset_y, offset_x)
-        """
-        # Make sure offset_x isn't negative in the actual algo
-        offset_x = offset_x if offset_x >= 0 else self.img_width + offset_x
-        offset_y = offset_y if offset_y >= 0 else self.img_height + offset_y
-
-        # Assign values from 0th row of inputarr to offset_y th
-        # row of outputarr
-        # If outputarr's columns run out before inputarr's does,
-        # wrap the remaining values around
-        self.outputarr[offset_y,
-                       offset_x:,
-                       channel_index] = self.inputarr[0,
-                                                      :self.img_width - offset_x,
-                                                      channel_index]
-        self.outputarr[offset_y,
-                       :offset_x,
-                       channel_index] = self.inputarr[0,
-                                                      self.img_width - offset_x:,
-                                                      channel_index]
-
-        # Continue afterwards till end of outputarr
-        # Make sure the width and height match for both slices
-        self.outputarr[offset_y + 1:,
-                       :,
-                       channel_index] = self.inputarr[1:self.img_height - offset_y,
-                                                      :,
-                                                      channel_index]
-
-        # Restart from 0th row of outputarr and go until the offset_y th row
-        # This will assign the remaining values in inputarr to outputarr
-        self.outputarr[:offset_y,
-                       :,
-                       channel_index] = self.inputarr[self.img_height - offset_y:,
-                                                      :,
-                                                      channel_index]
+        channels, values = self.__scan_line_channels(outputarr)
+        outputarr[::2, :, channels] = values
+
+    def __scan_line_channels(self, outputarr: np.ndarray) -> Tuple[List[int], List[Union[int, float]]]:
+        # Channel indices to assign for scan lines, and their values, for self.img_mode
+        channel_count = outputarr.shape[2]
+        values = self.scan_line_values.get(self.img_mode, (0, 0, 0)[:channel_count])
+        if np.issubdtype(outputarr.dtype, np.integer):
+            max_value = np.iinfo(outputarr.dtype).max
+        else:
+            max_value = 1
+        channels = [index for index, value in enumerate(values) if value is not None]
+        return channels, [max_value if values[index] == 'max' else values[index] for index in channels]
+
+    def __color_offset_rows(self, inputarr: np.ndarray, outputarr: np.ndarray, offset_x: int, offset_y: int,
+                            channel_index: int, band_start: int, band_stop: int):
+        """
+         color_offset_reference (see kernels.py) limited to output rows band_start to band_stop (exclusive)
+
+         Output row offset_y gets inputarr's 0th row wrapped by offset_x,
+         every other output row y gets inputarr's row (y - offset_y), wrapped vertically
+        """
+        img_height, img_width = inputarr.shape[:2]
+        offset_x = offset_x if offset_x >= 0 else img_width + offset_x
+        offset_y = offset_y if offset_y >= 0 else img_height + offset_y
+
+        if band_start <= offset_y < band_stop:
+            outputarr[offset_y, offset_x:, channel_index] = inputarr[0, :img_width - offset_x, channel_index]
+            outputarr[offset_y, :offset_x, channel_index] = inputarr[0, img_width - offset_x:, channel_index]
+
+        # Rows after offset_y
+        start_y, stop_y = max(band_start, offset_y + 1), band_stop
+        if start_y < stop_y:
+            outputarr[start_y:stop_y, :, channel_index] = inputarr[start_y - offset_y:stop_y - offset_y, :, channel_index]
+
+        # Rows before offset_y
+        start_y, stop_y = band_start, min(band_stop, offset_y)
+        if start_y < stop_y:
+            outputarr[start_y:stop_y, :, channel_index] = inputarr[start_y + img_height - offset_y:stop_y + img_height - offset_y,
+                                                                   :, channel_index]
 
     def __get_random_channel(self) -> int:
         # Returns a random index from 0 to pixel_tuple_len
@@ -565,6 +1732,15 @@ class ImageGlitcher:
 
         return random.randint(0, self.pixel_tuple_len - 1)
 
+    def __philox_key(self) -> int:
+        # Philox takes an unsigned 128 bit key
+        # Non-integral float seeds are keyed by their bit pattern
+        if isinstance(self.seed, float) and not self.seed.is_integer():
+            key = int.from_bytes(struct.pack('<d', self.seed), 'little')
+        else:
+            key = int(self.seed)
+        return key % 2 ** 128
+
     def __reset_rng_seed(self, offset: int = 0):
         """
         Calls random.seed() with self.seed variable
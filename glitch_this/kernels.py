@@ -0,0 +1,353 @@
+"""
+ Kernels doing the actual pixel moving of a glitch, and a registry to pick between them
+
+ There are two kinds (ops) of kernels:
+ * 'shift': kernel(inputarr, outputarr, start_y, stop_y, offset)
+   Copies rows start_y to stop_y (exclusive) of inputarr into outputarr,
+   shifted right by offset (left if negative), wrapping around
+ * 'color_offset': kernel(inputarr, outputarr, offset_x, offset_y, channel_index)
+   Copies one channel of inputarr into outputarr, offset by (offset_y, offset_x), wrapping around
+
+ Arrays are (height, width, channels), offsets are within the image's width/height
+ The 'reference' kernels are the plain slicing ones every seeded output was made with,
+ every other kernel must give the exact same result (see KernelRegistry.verify)
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+OPS = ('shift', 'color_offset')
+
+# Rows shifted by one call of the threaded kernel are split into chunks of at least this many pixels
+THREAD_MIN_PIXELS = 2 ** 18
+
+# Thread pool of the threaded kernel, created on first use
+kernel_pool = None
+kernel_pool_lock = Lock()
+
+
+def glitch_left(inputarr: np.ndarray, outputarr: np.ndarray, start_y: int, stop_y: int, offset: int):
+    """
+     Grabs a rectange from inputarr and shifts it leftwards
+     Any lost pixel data is wrapped back to the right
+     Rectangle's Width and Height are determined from offset
+
+     Consider an array like so-
+     [[ 0, 1, 2, 3],
+     [ 4, 5, 6, 7],
+     [ 8, 9, 10, 11],
+     [12, 13, 14, 15]]
+     If we were to left shift the first row only, starting from the 1st index;
+     i.e a rectangle of width = 3, height = 1, starting at (0, 0)
+     We'd grab [1, 2, 3] and left shift it until the start of row
+     so it'd look like [[1, 2, 3, 3]]
+     Now we wrap around the lost values, i.e 0
+     now it'd look like [[1, 2, 3, 0]]
+     That's the end result!
+    """
+    # For copy
+    start_x = offset
+    # For paste
+    stop_x = inputarr.shape[1] - start_x
+
+    left_chunk = inputarr[start_y:stop_y, start_x:]
+    wrap_chunk = inputarr[start_y:stop_y, :start_x]
+    outputarr[start_y:stop_y, :stop_x] = left_chunk
+    outputarr[start_y:stop_y, stop_x:] = wrap_chunk
+
+
+def glitch_right(inputarr: np.ndarray, outputarr: np.ndarray, start_y: int, stop_y: int, offset: int):
+    """
+     Grabs a rectange from inputarr and shifts it rightwards
+     Any lost pixel data is wrapped back to the left
+     Rectangle's Width and Height are determined from offset
+
+     Consider an array like so-
+     [[ 0, 1, 2, 3],
+     [ 4, 5, 6, 7],
+     [ 8, 9, 10, 11],
+     [12, 13, 14, 15]]
+     If we were to right shift the first row only, starting from
+     the 0th index;
+     i.e a rectangle of width = 3, height = 1 starting at (0, 0)
+     We'd grab [0, 1, 2] and right shift it until the end of row
+     so it'd look like [[0, 0, 1, 2]]
+     Now we wrap around the lost values, i.e 3
+     now it'd look like [[3, 0, 1, 2]]
+     That's the end result!
+    """
+    # For copy
+    stop_x = inputarr.shape[1] - offset
+    # For paste
+    start_x = offset
+
+    right_chunk = inputarr[start_y:stop_y, :stop_x]
+    wrap_chunk = inputarr[start_y:stop_y, stop_x:]
+    outputarr[start_y:stop_y, start_x:] = right_chunk
+    outputarr[start_y:stop_y, :start_x] = wrap_chunk
+
+
+def shift_reference(inputarr: np.ndarray, outputarr: np.ndarray, start_y: int, stop_y: int, offset: int):
+    if offset < 0:
+        # Grab a rectangle of specific width and heigh, shift it left
+        # by a specified offset
+        # Wrap around the lost pixel data from the right
+        glitch_left(inputarr, outputarr, start_y, stop_y, -offset)
+    else:
+        # Grab a rectangle of specific width and height, shift it right
+        # by a specified offset
+        # Wrap around the lost pixel data from the left
+        glitch_right(inputarr, outputarr, start_y, stop_y, offset)
+
+
+def shift_gather(inputarr: np.ndarray, outputarr: np.ndarray, start_y: int, stop_y: int, offset: int):
+    # Output column x takes input column (x - offset), wrapped, in one indexed copy
+    columns = (np.arange(inputarr.shape[1]) - offset) % inputarr.shape[1]
+    np.take(inputarr[start_y:stop_y], columns, axis=1, out=outputarr[start_y:stop_y], mode='clip')
+
+
+def shift_threaded(inputarr: np.ndarray, outputarr: np.ndarray, start_y: int, stop_y: int, offset: int,
+                   min_pixels: int = THREAD_MIN_PIXELS, chunks: Optional[int] = None):
+    # Splits the rows across a thread pool (numpy releases the GIL while copying)
+    # Rows are independent, so each chunk is simply the reference kernel on fewer rows
+    # Into chunks (default - number of CPUs) chunks of at least min_pixels pixels
+    global kernel_pool
+    chunks = min(chunks or os.cpu_count() or 1, max(stop_y - start_y, 0) * inputarr.shape[1] // min_pixels)
+    if chunks <= 1:
+        shift_reference(inputarr, outputarr, start_y, stop_y, offset)
+        return
+    with kernel_pool_lock:
+        if kernel_pool is None:
+            kernel_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+    edges = np.linspace(start_y, stop_y, chunks + 1).astype(int).tolist()
+    list(kernel_pool.map(lambda chunk: shift_reference(inputarr, outputarr, chunk[0], chunk[1], offset),
+                         zip(edges[:-1], edges[1:])))
+
+
+def color_offset_reference(inputarr: np.ndarray, outputarr: np.ndarray, offset_x: int, offset_y: int, channel_index: int):
+    """
+     Takes the given channel's color value from inputarr,
+     starting from (0, 0)
+     and puts it in the same channel's slot in outputarr,
+     starting from (offset_y, offset_x)
+    """
+    img_height, img_width = inputarr.shape[:2]
+    # Make sure offset_x isn't negative in the actual algo
+    offset_x = offset_x if offset_x >= 0 else img_width + offset_x
+    offset_y = offset_y if offset_y >= 0 else img_height + offset_y
+
+    # Assign values from 0th row of inputarr to offset_y th
+    # row of outputarr
+    # If outputarr's columns run out before inputarr's does,
+    # wrap the remaining values around
+    outputarr[offset_y,
+              offset_x:,
+              channel_index] = inputarr[0,
+                                        :img_width - offset_x,
+                                        channel_index]
+    outputarr[offset_y,
+              :offset_x,
+              channel_index] = inputarr[0,
+                                        img_width - offset_x:,
+                                        channel_index]
+
+    # Continue afterwards till end of outputarr
+    # Make sure the width and height match for both slices
+    outputarr[offset_y + 1:,
+              :,
+              channel_index] = inputarr[1:img_height - offset_y,
+                                        :,
+                                        channel_index]
+
+    # Restart from 0th row of outputarr and go until the offset_y th row
+    # This will assign the remaining values in inputarr to outputarr
+    outputarr[:offset_y,
+              :,
+              channel_index] = inputarr[img_height - offset_y:,
+                                        :,
+                                        channel_index]
+
+
+def color_offset_gather(inputarr: np.ndarray, outputarr: np.ndarray, offset_x: int, offset_y: int, channel_index: int):
+    # Output row y takes input row (y - offset_y), wrapped, in one indexed copy
+    # Except for row offset_y, which takes input row 0 wrapped by offset_x
+    img_height, img_width = inputarr.shape[:2]
+    offset_x = offset_x if offset_x >= 0 else img_width + offset_x
+    offset_y = offset_y if offset_y >= 0 else img_height + offset_y
+    rows = (np.arange(img_height) - offset_y) % img_height
+    outputarr[:, :, channel_index] = inputarr[rows, :, channel_index]
+    outputarr[offset_y, :, channel_index] = np.roll(inputarr[0, :, channel_index], offset_x)
+
+
+# (op, name, kernel, extra keyword arguments verify runs it with) of the kernels every registry starts with
+# The threaded kernel only splits rows on images larger than verify's, it's verified split into chunks as well
+BUILTIN_KERNELS = (
+    ('shift', 'reference', shift_reference, None),
+    ('shift', 'gather', shift_gather, None),
+    ('shift', 'threaded', shift_threaded, {'min_pixels': 1, 'chunks': 3}),
+    ('color_offset', 'reference', color_offset_reference, None),
+    ('color_offset', 'gather', color_offset_gather, None),
+)
+
+
+class KernelRegistry:
+    """
+     Holds the kernels of each op and picks one per image size class
+
+     A kernel is only ever picked if it gives the exact same output as the reference
+     kernel on random inputs (see verify), among those the fastest one for the size class
+     is found by timing them on the first image of that class (see autotune)
+     The choices are kept in memory, and in a JSON file if a path is given
+
+     PARAMETERS:-
+
+     path: JSON file to load earlier choices from and save new ones to, None keeps them in memory only
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        # size class -> kernel name
+        self.choices: Dict[str, str] = {}
+        self.__kernels: Dict[str, Dict[str, Callable]] = {op: {} for op in OPS}
+        # (op, name) -> whether the kernel matched the reference
+        self.__verified: Dict[Tuple[str, str], bool] = {}
+        # (op, name) -> extra keyword arguments verify also runs the kernel with
+        self.__verify_params: Dict[Tuple[str, str], Dict] = {}
+        self.__lock = Lock()
+        for op, name, kernel, verify_params in BUILTIN_KERNELS:
+            self.__kernels[op][name] = kernel
+            if verify_params:
+                self.__verify_params[(op, name)] = verify_params
+        if path is not None and os.path.isfile(path):
+            with open(path, 'r') as choices_file:
+                self.choices.update(json.load(choices_file))
+
+    def register(self, op: str, name: str, kernel: Callable, verify_params: Optional[Dict] = None):
+        """
+         Adds (or replaces) a kernel, the reference kernels can't be replaced
+         verify_params: Extra keyword arguments verify also runs the kernel with, for code paths
+                        the (small) verify inputs don't reach otherwise (i.e lower thresholds)
+        """
+        if op not in OPS:
+            raise ValueError(f'op parameter must be one of {", ".join(OPS)}')
+        if name == 'reference':
+            raise ValueError('The reference kernels cannot be replaced')
+        with self.__lock:
+            self.__kernels[op][name] = kernel
+            self.__verified.pop((op, name), None)
+            self.__verify_params.pop((op, name), None)
+            if verify_params:
+                self.__verify_params[(op, name)] = verify_params
+            # Earlier choices were made without it
+            self.choices = {key: choice for key, choice in self.choices.items() if not key.startswith(f'{op}/')}
+
+    def names(self, op: str) -> List[str]:
+        return list(self.__kernels[op])
+
+    def kernel(self, op: str, name: str) -> Callable:
+        return self.__kernels[op][name]
+
+    def verify(self, op: str, name: str, trials: int = 50, seed: int = 0) -> bool:
+        """
+         Runs the kernel and the reference kernel on the same random inputs
+         Returns True if every output matched bit for bit
+
+         Inputs cover every dtype glitch_this works on, 1 to 4 channels,
+         single row/column images and the full range of offsets
+         Kernels registered with verify_params are run with and without them
+        """
+        rng = np.random.default_rng(seed)
+        kernel, reference = self.__kernels[op][name], self.__kernels[op]['reference']
+        variants = [{}]
+        if (op, name) in self.__verify_params:
+            variants.append(self.__verify_params[(op, name)])
+        for _ in range(trials):
+            dtype = rng.choice(['uint8', 'uint16', 'int32', 'float32'])
+            shape = (int(rng.integers(1, 48)), int(rng.integers(1, 48)), int(rng.integers(1, 5)))
+            inputarr = (rng.random(shape) * 255).astype(dtype)
+            # Start both from the same (random) output, so pixels a kernel wrongly skips show up too
+            start = (rng.random(shape) * 255).astype(dtype)
+            expected = np.array(start)
+            height, width, channels = shape
+            if op == 'shift':
+                start_y = int(rng.integers(0, height + 1))
+                args = (start_y, int(rng.integers(start_y, height + 1)), int(rng.integers(-width, width + 1)))
+            else:
+                args = (int(rng.integers(-width + 1, width)), int(rng.integers(-height + 1, height)),
+                        int(rng.integers(0, channels)))
+            reference(inputarr, expected, *args)
+            for params in variants:
+                outputarr = np.array(start)
+                kernel(inputarr, outputarr, *args, **params)
+                if not np.array_equal(expected, outputarr):
+                    return False
+        return True
+
+    def verified(self, op: str) -> List[str]:
+        # Names of the op's kernels that match the reference, verifying any new ones
+        names = []
+        for name in self.names(op):
+            key = (op, name)
+            if key not in self.__verified:
+                self.__verified[key] = name == 'reference' or self.verify(op, name)
+            if self.__verified[key]:
+                names.append(name)
+        return names
+
+    def size_class(self, op: str, arr: np.ndarray) -> str:
+        # Images within a factor of 4 in pixel count (of the same dtype and channel count) share a class
+        pixels = max(arr.shape[0] * arr.shape[1], 1)
+        return f'{op}/{arr.dtype.str}/{arr.shape[2]}/{int(np.log2(pixels)) // 2}'
+
+    def select(self, op: str, inputarr: np.ndarray) -> Callable:
+        # Returns the kernel to use on inputarr, autotuning its size class the first time it is seen
+        key = self.size_class(op, inputarr)
+        name = self.choices.get(key)
+        if name not in self.__kernels[op]:
+            name = self.autotune(op, inputarr)
+        return self.__kernels[op][name]
+
+    def autotune(self, op: str, inputarr: np.ndarray, repeats: int = 3) -> str:
+        """
+         Times every verified kernel of op on inputarr (best of repeats)
+         Remembers and returns the name of the fastest one, for inputarr's size class
+        """
+        height, width, channels = inputarr.shape
+        outputarr = np.empty_like(inputarr)
+        if op == 'shift':
+            # A typical plan, shifts of a few row bands by a fraction of the width, both ways
+            calls = [(height * index // 8, height * (index + 1) // 8, (width // 3) * (-1) ** index)
+                     for index in range(8)]
+        else:
+            calls = [(-(width // 7), height // 5, channels - 1)]
+
+        timings = {}
+        for name in self.verified(op):
+            kernel = self.__kernels[op][name]
+            best = None
+            for _ in range(repeats):
+                started = perf_counter()
+                for args in calls:
+                    kernel(inputarr, outputarr, *args)
+                elapsed = perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+        name = min(timings, key=timings.get)
+
+        with self.__lock:
+            self.choices[self.size_class(op, inputarr)] = name
+            if self.path is not None:
+                self.save(self.path)
+        return name
+
+    def save(self, path: str):
+        # Writes the choices to path as JSON, atomically
+        tmp_path = f'{path}.tmp{os.getpid()}'
+        with open(tmp_path, 'w') as choices_file:
+            json.dump(self.choices, choices_file, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
@@ -0,0 +1,110 @@
+"""
+ Pipelined stage executor
+
+ Every stage runs on a thread of its own, stages are connected by bounded queues
+ So stage 0 can work on item k + 1 while stage 1 works on item k and stage 2 on item k - 1,
+ and the wall time gets close to the one of the slowest stage (as long as the stages
+ release the GIL, like pillow's codecs and numpy's copies do) rather than the sum of all of them
+
+ Items come out in the same order they went in, each stage sees them one at a time and in order,
+ so stages may keep state from one item to the next (i.e the glitch stage's RNG)
+"""
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from typing import Any, Callable, Iterable, Iterator, Sequence
+
+# How often (in seconds) blocked stages check whether the pipeline was stopped
+POLL_INTERVAL = 0.05
+
+# Marks the end of the items
+END = object()
+
+
+class StageError:
+    # Carries an exception raised in a stage down to the consumer
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def pipeline(source: Iterable, stages: Sequence[Callable[[Any], Any]], maxsize: int = 2) -> Iterator:
+    """
+     Yields stages[-1](...(stages[0](item))) for every item of source, in order
+     The source is iterated on stage 0's thread
+
+     An exception raised by the source or a stage is raised again by the consumer
+     Closing the generator (i.e on an exception in the consumer, or with contextlib.closing)
+     stops every stage after the item it is working on
+
+     PARAMETERS:-
+
+     source: Items to run through the stages
+
+     stages: Functions taking an item and returning the item handed to the next stage
+
+     maxsize: Number of items waiting between two stages at most, bounds the memory in flight
+    """
+    if not stages:
+        raise ValueError('stages parameter must not be empty')
+    if not (isinstance(maxsize, int) and maxsize > 0):
+        raise ValueError('maxsize parameter must be a positive integer value greater than 0')
+    stop = Event()
+    queues = [Queue(maxsize) for _ in stages]
+
+    def put(queue: Queue, item) -> bool:
+        # Blocks until item is queued, False if the pipeline was stopped first
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=POLL_INTERVAL)
+                return True
+            except Full:
+                continue
+        return False
+
+    def get(queue: Queue):
+        # Blocks until an item is available, END if the pipeline was stopped first
+        while not stop.is_set():
+            try:
+                return queue.get(timeout=POLL_INTERVAL)
+            except Empty:
+                continue
+        return END
+
+    def run(index: int):
+        out_queue = queues[index]
+        try:
+            items = iter(source) if index == 0 else iter(lambda: get(queues[index - 1]), END)
+            for item in items:
+                if isinstance(item, StageError):
+                    # Pass errors of earlier stages on, this stage is done
+                    put(out_queue, item)
+                    return
+                if not put(out_queue, stages[index](item)):
+                    return
+        except BaseException as error:
+            put(out_queue, StageError(error))
+            return
+        put(out_queue, END)
+
+    threads = [Thread(target=run, args=(index,), daemon=True) for index in range(len(stages))]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is END:
+                return
+            if isinstance(item, StageError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def sequential(source: Iterable, stages: Sequence[Callable[[Any], Any]]) -> Iterator:
+    # Yields the same items as pipeline, with every stage run on the calling thread, one item after the other
+    for item in source:
+        for stage in stages:
+            item = stage(item)
+        yield item
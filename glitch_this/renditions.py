@@ -0,0 +1,179 @@
+"""
+ Several renditions (sizes and formats) of one glitched image or GIF
+
+ The glitch runs once, every smaller size is then downscaled from the
+ smallest rendition already made that is at least as large (not from the full image),
+ and each rendition is encoded on a thread pool as soon as it is ready,
+ pillow's encoders release the GIL so the encodes run in parallel
+
+ A rendition is a (size, format, quality) tuple:
+ * size: None for the full size, an int to fit the longest side in, or a (width, height) box to fit in
+         Renditions are never upscaled and always keep the aspect ratio
+ * format: Image format to encode in (i.e PNG, JPEG, WEBP, GIF)
+ * quality: Encoder quality (i.e for JPEG/WEBP), None for the format's default
+"""
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple, Union
+
+from PIL import Image
+
+from glitch_this.gif_optimizer import save_optimized_gif
+
+Size = Optional[Union[int, Tuple[int, int]]]
+Rendition = Tuple[Size, str, Optional[int]]
+
+# Modes the JPEG encoder takes as is, everything else is converted to RGB
+JPEG_MODES = ('L', 'RGB', 'CMYK')
+
+
+def convert_for_format(img: Image.Image, format: Optional[str]) -> Image.Image:
+    # img, converted to RGB if format is JPEG and can't hold its mode (i.e RGBA or P)
+    if format is not None and format.upper() == 'JPEG' and img.mode not in JPEG_MODES:
+        return img.convert('RGB')
+    return img
+
+
+def parse_rendition(spec: str) -> Rendition:
+    """
+     Parses a SIZE:FORMAT[:QUALITY] string (i.e 'full:png', '1200:jpeg:85', '320x240:webp')
+     SIZE is 'full', the longest side, or WIDTHxHEIGHT
+    """
+    parts = spec.split(':')
+    if len(parts) not in (2, 3) or not parts[1]:
+        raise ValueError(f'Rendition must be given as SIZE:FORMAT[:QUALITY], not {spec}')
+    try:
+        if parts[0].lower() == 'full':
+            size = None
+        elif 'x' in parts[0].lower():
+            width, height = parts[0].lower().split('x')
+            size = (int(width), int(height))
+        else:
+            size = int(parts[0])
+        quality = int(parts[2]) if len(parts) == 3 else None
+    except ValueError:
+        raise ValueError(f'Rendition must be given as SIZE:FORMAT[:QUALITY], not {spec}')
+    return size, parts[1].upper(), quality
+
+
+def check_renditions(renditions: Sequence[Rendition], animated: bool) -> List[Rendition]:
+    # Validates renditions, returns them as a list of (size, FORMAT, quality) tuples
+    if not renditions:
+        raise ValueError('renditions parameter must not be empty')
+    # Makes sure every format plugin is registered
+    Image.init()
+    checked = []
+    for rendition in renditions:
+        if isinstance(rendition, str):
+            rendition = parse_rendition(rendition)
+        if len(rendition) == 2:
+            rendition = (*rendition, None)
+        size, format, quality = rendition
+        if isinstance(size, int):
+            sizes = (size,)
+        elif size is None:
+            sizes = ()
+        else:
+            sizes = tuple(size)
+            if len(sizes) != 2:
+                raise ValueError('Rendition size must be None, an int or a (width, height) tuple')
+            size = sizes
+        if not all(isinstance(value, int) and value > 0 for value in sizes):
+            raise ValueError('Rendition size must be a positive integer value')
+        if quality is not None and not isinstance(quality, int):
+            raise ValueError('Rendition quality must be an integer value or None')
+        # Extensions (i.e jpg, tif) are taken as the format they stand for
+        format = Image.registered_extensions().get(f'.{format.lower()}', format.upper())
+        if format not in Image.SAVE:
+            raise ValueError(f'Unknown rendition format: {format}')
+        if animated and format not in Image.SAVE_ALL:
+            raise ValueError(f'Rendition format {format} cannot hold an animation')
+        checked.append((size, format, quality))
+    return checked
+
+
+def fit_size(width: int, height: int, size: Size) -> Tuple[int, int]:
+    # Size of a width x height image fitted in size, keeping the aspect ratio, never upscaled
+    if size is None:
+        return width, height
+    box_width, box_height = (size, size) if isinstance(size, int) else size
+    scale = min(box_width / width, box_height / height, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def resize_frames(frames: List[Image.Image], size: Tuple[int, int]) -> List[Image.Image]:
+    resized = []
+    for frame in frames:
+        if frame.size == size:
+            resized.append(frame)
+            continue
+        if frame.mode == 'P':
+            # Palette images can only be resized with nearest neighbour
+            frame = frame.convert('RGBA' if 'transparency' in frame.info else 'RGB')
+        resized.append(frame.resize(size, Image.LANCZOS))
+    return resized
+
+
+def encode(frames: List[Image.Image], animated: bool, format: str, quality: Optional[int],
+           duration: Union[int, float], loop: int, optimize_gif: bool) -> bytes:
+    # Encodes frames (a single image unless animated) as format
+    buffer = io.BytesIO()
+    params = {} if quality is None else {'quality': quality}
+    frames = [convert_for_format(frame, format) for frame in frames]
+    if not animated:
+        frames[0].save(buffer, format=format, compress_level=3, **params)
+    elif format == 'GIF' and optimize_gif:
+        save_optimized_gif(frames, buffer, duration=duration, loop=loop)
+    else:
+        frames[0].save(buffer, format=format, append_images=frames[1:], save_all=True,
+                       duration=duration, loop=loop, compress_level=3, **params)
+    return buffer.getvalue()
+
+
+def render_renditions(output: Union[Image.Image, List[Image.Image]], renditions: Sequence[Rendition],
+                      duration: Union[int, float] = 200, loop: int = 0, optimize_gif: bool = False,
+                      workers: Optional[int] = None) -> List[bytes]:
+    """
+     Encodes renditions of an already glitched image (or list of GIF frames)
+     Returns the encoded renditions, in the same order as renditions
+
+     PARAMETERS:-
+
+     output: The glitched image, or list of frames (i.e the output of glitch_image/glitch_gif)
+
+     renditions: List of (size, format, quality) tuples, see the module docstring
+                 Strings in the SIZE:FORMAT[:QUALITY] form (see parse_rendition) are taken too
+
+     duration: Duration of each frame of animated renditions (in milliseconds)
+
+     loop: How many times animated renditions should loop, 0 means infinite loop
+
+     optimize_gif: Encode GIF renditions of frames with gif_optimizer.save_optimized_gif
+
+     workers: Number of encoding threads, defaults to one per rendition (at most one per CPU)
+    """
+    animated = isinstance(output, list)
+    frames = output if animated else [output]
+    renditions = check_renditions(renditions, animated)
+    if workers is not None and not (isinstance(workers, int) and workers > 0):
+        raise ValueError('workers parameter must be a positive integer value')
+
+    width, height = frames[0].size
+    targets = [fit_size(width, height, size) for size, _, _ in renditions]
+    # (size, frames) of the sizes made so far, from largest to smallest
+    # Sizes are made largest first, so each one is downscaled from the previous ones
+    chain = [((width, height), frames)]
+    futures = [None] * len(renditions)
+    with ThreadPoolExecutor(max_workers=workers or min(len(renditions), os.cpu_count() or 1)) as executor:
+        for target in sorted(set(targets), key=lambda target: target[0] * target[1], reverse=True):
+            source_frames = next(resized for size, resized in reversed(chain)
+                                 if size[0] >= target[0] and size[1] >= target[1])
+            target_frames = resize_frames(source_frames, target)
+            chain.append((target, target_frames))
+            # Start encoding this size right away, while the next one is being downscaled
+            for index, (_, format, quality) in enumerate(renditions):
+                if targets[index] == target:
+                    futures[index] = executor.submit(encode, target_frames, animated, format, quality,
+                                                     duration, loop, optimize_gif)
+        return [future.result() for future in futures]
@@ -0,0 +1,301 @@
+"""
+ Priority scheduling of glitch jobs, for services mixing small and large jobs
+
+ GlitchScheduler runs jobs on a fixed number of worker slots (threads, or processes),
+ every idle slot takes the next job from one shared queue, picked by:
+ * priority class: HIGH before NORMAL before LOW, slots can be reserved for HIGH jobs
+ * tenant fairness: within a class, tenants take turns (round robin), so one tenant
+   submitting many jobs doesn't hold up the others
+ * memory budget: a job only starts if its estimated peak memory (see ImageGlitcher.estimate)
+   fits in what's left of the budget. Jobs that don't fit are passed over by smaller ones,
+   at most max_bypass times, after which nothing else starts until they fit
+ Wait times (submit to start) and run times are kept per class and tenant, see metrics()
+"""
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from threading import Condition, Thread
+from time import monotonic
+from typing import Any, Deque, Dict, Hashable, List, Optional, Union
+
+from PIL import Image
+
+from glitch_this.estimate import read_header
+from glitch_this.glitch_this import ImageGlitcher
+from glitch_this.utils import get_worker_glitcher
+
+# Priority classes, lower ones go first
+HIGH, NORMAL, LOW = 0, 1, 2
+PRIORITIES = (HIGH, NORMAL, LOW)
+PRIORITY_NAMES = {HIGH: 'high', NORMAL: 'normal', LOW: 'low'}
+
+# Methods jobs may call
+METHODS = ('glitch_image', 'glitch_gif', 'glitch_bytes')
+
+# Number of recent wait/run times kept per class and tenant, for metrics
+METRICS_WINDOW = 1024
+
+
+def run_job(method: str, src_img: Union[str, bytes, Image.Image], glitch_amount: Union[int, float],
+            params: Dict[str, Any]):
+    # Runs a job on this thread's (or process') ImageGlitcher
+    return getattr(get_worker_glitcher(), method)(src_img, glitch_amount, **params)
+
+
+def summarize(times: List[float]) -> Dict[str, float]:
+    # count, mean, p50, p95 and max of times (in seconds)
+    if not times:
+        return {'count': 0, 'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+    ordered = sorted(times)
+    return {'count': len(ordered), 'mean': sum(ordered) / len(ordered),
+            'p50': ordered[len(ordered) // 2], 'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            'max': ordered[-1]}
+
+
+class Job:
+    # A submitted job, along with what the scheduler needs to know about it
+    def __init__(self, method: str, src_img, glitch_amount, params: Dict, priority: int, tenant: Hashable,
+                 peak_bytes: int):
+        self.method = method
+        self.src_img = src_img
+        self.glitch_amount = glitch_amount
+        self.params = params
+        self.priority = priority
+        self.tenant = tenant
+        self.peak_bytes = peak_bytes
+        self.future = Future()
+        self.submitted = monotonic()
+        # Times a later job was started ahead of this one, for lack of memory
+        self.bypassed = 0
+
+
+class GlitchScheduler:
+    """
+     Runs glitch jobs on worker slots, by priority, tenant and memory budget (see the module's docstring)
+
+     PARAMETERS:-
+
+     workers: Number of jobs running at once, default - number of CPUs
+
+     memory_budget: Bytes the estimated peak memory of running jobs must fit in, None for no limit
+                    A job larger than the whole budget still runs, once nothing else does
+
+     reserved: Number of the workers that only run HIGH priority jobs,
+               so small urgent jobs don't wait for long running ones
+
+     use_processes: Run jobs in worker processes instead of threads (no GIL contention,
+                    inputs and outputs are pickled though)
+
+     max_bypass: Times a job that doesn't fit in the memory left may be passed over by later ones
+
+     cost_model: CostModel for the estimates, None uses the default rates
+    """
+
+    def __init__(self, workers: Optional[int] = None, memory_budget: Optional[int] = None, reserved: int = 0,
+                 use_processes: bool = False, max_bypass: int = 8, cost_model=None):
+        workers = workers or os.cpu_count() or 1
+        if not (isinstance(workers, int) and workers > 0):
+            raise ValueError('workers parameter must be a positive integer value greater than 0')
+        if memory_budget is not None and not (isinstance(memory_budget, int) and memory_budget > 0):
+            raise ValueError('memory_budget parameter must be a positive integer value greater than 0')
+        if not (isinstance(reserved, int) and 0 <= reserved < workers):
+            raise ValueError('reserved parameter must be an integer value from 0 to workers - 1')
+        if not (isinstance(max_bypass, int) and max_bypass >= 0):
+            raise ValueError('max_bypass parameter must be a non-negative integer value')
+        self.workers = workers
+        self.memory_budget = memory_budget
+        self.reserved = reserved
+        self.max_bypass = max_bypass
+
+        # Used for estimates only
+        self.__estimator = ImageGlitcher()
+        self.__estimator.cost_model = cost_model
+        # priority -> tenant -> queued jobs, tenants are rotated to take turns
+        self.__queues: Dict[int, 'OrderedDict[Hashable, Deque[Job]]'] = {priority: OrderedDict()
+                                                                          for priority in PRIORITIES}
+        self.__condition = Condition()
+        self.__running = 0
+        self.__memory_in_use = 0
+        self.__shutdown = False
+        # (priority name, tenant) -> recent wait/run times
+        self.__waits: Dict[tuple, Deque[float]] = {}
+        self.__runs: Dict[tuple, Deque[float]] = {}
+
+        self.__pool = ProcessPoolExecutor(max_workers=workers) if use_processes else None
+        self.__threads = [Thread(target=self.__work, args=(index < reserved,), daemon=True)
+                          for index in range(workers)]
+        for thread in self.__threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.shutdown()
+
+    def submit(self, src_img: Union[str, bytes, Image.Image], glitch_amount: Union[int, float],
+               priority: int = NORMAL, tenant: Hashable = None, method: Optional[str] = None,
+               peak_bytes: Optional[int] = None, **params) -> Future:
+        """
+         Queues a job, returns a Future of its result (cancel it to drop the job while it's queued)
+
+         PARAMETERS:-
+
+         src_img, glitch_amount, params: Passed on to method
+
+         priority: HIGH, NORMAL or LOW
+
+         tenant: Who the job is for, tenants of the same priority take turns
+
+         method: glitch_image, glitch_gif or glitch_bytes, defaults to glitch_bytes for bytes,
+                 glitch_gif for animated GIFs and glitch_image otherwise
+
+         peak_bytes: Memory the job needs, defaults to ImageGlitcher.estimate's peak_bytes
+        """
+        if priority not in PRIORITIES:
+            raise ValueError('priority param must be one of HIGH, NORMAL or LOW')
+        if method is not None and method not in METHODS:
+            raise ValueError(f'method param must be one of {", ".join(METHODS)}')
+        if method is None:
+            method = self.__default_method(src_img)
+        if peak_bytes is None:
+            try:
+                peak_bytes = self.__estimator.estimate(src_img, **params)['peak_bytes']
+            except Exception:
+                # The job itself fails the same way, and says why
+                peak_bytes = 0
+
+        job = Job(method, src_img, glitch_amount, params, priority, tenant, peak_bytes)
+        with self.__condition:
+            if self.__shutdown:
+                raise RuntimeError('Cannot submit jobs after shutdown')
+            self.__queues[priority].setdefault(tenant, deque()).append(job)
+            self.__condition.notify_all()
+        return job.future
+
+    def __default_method(self, src_img: Union[str, bytes, Image.Image]) -> str:
+        if isinstance(src_img, (bytes, bytearray, memoryview)):
+            return 'glitch_bytes'
+        try:
+            img, animated = read_header(src_img)
+        except Exception:
+            # Let glitch_image fail and say why
+            return 'glitch_image'
+        if img is not src_img:
+            img.close()
+        return 'glitch_gif' if animated else 'glitch_image'
+
+    def __fits(self, job: Job) -> bool:
+        if self.memory_budget is None or self.__running == 0:
+            return True
+        return self.__memory_in_use + job.peak_bytes <= self.memory_budget
+
+    def __next_job(self, high_only: bool) -> Optional[Job]:
+        """
+         Takes the next job to start off the queues, or returns None if none can start now
+         Must be called with the condition held
+        """
+        # Jobs passed over for lack of memory, in the order they would have started
+        passed = []
+        for priority in PRIORITIES[:1] if high_only else PRIORITIES:
+            tenants = self.__queues[priority]
+            for tenant in list(tenants):
+                job = tenants[tenant][0]
+                if job.bypassed >= self.max_bypass and not self.__fits(job):
+                    # Waited long enough, nothing else starts until it fits
+                    return None
+                if not self.__fits(job):
+                    passed.append(job)
+                    continue
+                tenants[tenant].popleft()
+                # The tenant's turn is over
+                if tenants[tenant]:
+                    tenants.move_to_end(tenant)
+                else:
+                    del tenants[tenant]
+                for skipped in passed:
+                    skipped.bypassed += 1
+                return job
+        return None
+
+    def __work(self, high_only: bool):
+        while True:
+            with self.__condition:
+                while True:
+                    if self.__shutdown and not any(self.__queues.values()):
+                        return
+                    job = self.__next_job(high_only)
+                    if job is not None:
+                        break
+                    self.__condition.wait()
+                if not job.future.set_running_or_notify_cancel():
+                    # Cancelled while queued
+                    continue
+                self.__running += 1
+                self.__memory_in_use += job.peak_bytes
+                started = monotonic()
+                key = (PRIORITY_NAMES[job.priority], job.tenant)
+                self.__waits.setdefault(key, deque(maxlen=METRICS_WINDOW)).append(started - job.submitted)
+
+            try:
+                if self.__pool is not None:
+                    result = self.__pool.submit(run_job, job.method, job.src_img, job.glitch_amount,
+                                                job.params).result()
+                else:
+                    result = run_job(job.method, job.src_img, job.glitch_amount, job.params)
+            except BaseException as error:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+            finally:
+                with self.__condition:
+                    self.__running -= 1
+                    self.__memory_in_use -= job.peak_bytes
+                    self.__runs.setdefault(key, deque(maxlen=METRICS_WINDOW)).append(monotonic() - started)
+                    self.__condition.notify_all()
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+         Returns a snapshot of:
+         queued: Number of queued jobs per priority class
+         running, memory_in_use: Number and estimated memory of running jobs
+         wait, run: count, mean, p50, p95 and max of the recent wait (submit to start) and run times
+                    (in seconds), per priority class, and per priority class and tenant under by_tenant
+        """
+        with self.__condition:
+            queued = {PRIORITY_NAMES[priority]: sum(len(jobs) for jobs in tenants.values())
+                      for priority, tenants in self.__queues.items()}
+            waits = {key: list(times) for key, times in self.__waits.items()}
+            runs = {key: list(times) for key, times in self.__runs.items()}
+            snapshot = {'queued': queued, 'running': self.__running, 'memory_in_use': self.__memory_in_use}
+
+        for name, times in (('wait', waits), ('run', runs)):
+            classes = {}
+            for (priority_name, _), values in times.items():
+                classes.setdefault(priority_name, []).extend(values)
+            snapshot[name] = {priority_name: summarize(values) for priority_name, values in classes.items()}
+        snapshot['by_tenant'] = {}
+        for (priority_name, tenant), values in waits.items():
+            snapshot['by_tenant'].setdefault(priority_name, {})[tenant] = {
+                'wait': summarize(values), 'run': summarize(runs.get((priority_name, tenant), []))}
+        return snapshot
+
+    def shutdown(self, wait: bool = True, cancel_queued: bool = False):
+        """
+         Stops taking jobs, queued jobs still run unless cancel_queued is set
+         wait: Return only once every job that was started is done
+        """
+        with self.__condition:
+            self.__shutdown = True
+            if cancel_queued:
+                for tenants in self.__queues.values():
+                    for jobs in tenants.values():
+                        for job in jobs:
+                            job.future.cancel()
+                    tenants.clear()
+            self.__condition.notify_all()
+        if wait:
+            for thread in self.__threads:
+                thread.join()
+        if self.__pool is not None:
+            self.__pool.shutdown(wait=wait)
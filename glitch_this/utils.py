@@ -0,0 +1,63 @@
+"""
+ Helpers shared by the long running tools of glitch_this (bench, watch, ...)
+"""
+import os
+import tempfile
+from threading import local
+from typing import List, Optional, Union
+
+from PIL import Image
+
+from glitch_this.gif_optimizer import save_optimized_gif
+from glitch_this.glitch_this import ImageGlitcher
+
+# Per thread/process worker state, see get_worker_glitcher()
+worker_state = local()
+
+
+def get_worker_glitcher() -> ImageGlitcher:
+    """
+     Returns this thread's ImageGlitcher, creating it on first use
+     So every worker (thread or process) keeps a warm glitcher of its own,
+     as ImageGlitcher is not thread safe
+    """
+    if not hasattr(worker_state, 'glitcher'):
+        worker_state.glitcher = ImageGlitcher()
+    return worker_state.glitcher
+
+
+def save_glitched(output: Union[Image.Image, List[Image.Image]], path: str, duration: Union[int, float] = 200,
+                  loop: int = 0, format: Optional[str] = None, optimize_gif: bool = False):
+    """
+     Saves a glitched image (or a list of frames, as a GIF) to path, atomically
+
+     The output is written to a temp file in the same directory and then renamed
+     So path either doesn't exist or holds a complete file, even if interrupted
+
+     format: Image format to save as, defaults to the one of path's extension
+
+     optimize_gif: Save lists of frames with gif_optimizer.save_optimized_gif
+    """
+    if format is None:
+        extension = os.path.splitext(path)[1].lower()
+        format = Image.registered_extensions().get(extension)
+        if format is None:
+            raise ValueError(f'Cannot tell image format from path: {path}')
+
+    out_dir = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', dir=out_dir)
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            if isinstance(output, list) and optimize_gif:
+                save_optimized_gif(output, tmp_file, duration=duration, loop=loop)
+            elif isinstance(output, list):
+                output[0].save(tmp_file, format='GIF', append_images=output[1:], save_all=True,
+                               duration=duration, loop=loop)
+            else:
+                output.save(tmp_file, format=format, compress_level=3)
+        # mkstemp creates the file readable by the owner only
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+ Watch-folder daemon for the glitch_this library
+
+ Polls a directory for new image files, waits until each file is complete
+ (its size and modification time stop changing), glitches it with a preset
+ on a pool of warm worker processes and writes the output atomically
+ Originals are then moved into a done (or failed) folder
+
+ Usage: glitch_this watch <dir> <glitch_level> [options] (see glitch_this watch -h)
+"""
+import argparse
+import json
+import os
+import signal
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from time import sleep, time
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from glitch_this.utils import get_worker_glitcher, save_glitched
+
+# Keys of a preset, along with their defaults
+# glitch_image/glitch_gif parameters, plus how to save GIF outputs
+PRESET_DEFAULTS = {
+    'glitch_amount': None,
+    'color_offset': False,
+    'scan_lines': False,
+    'seed': None,
+    'gif': False,
+    'frames': 23,
+    'step': 1,
+    'glitch_change': 0.0,
+    'cycle': False,
+    'mode': None,
+    'threads': 1,
+    # None keeps the input GIF's average duration (200 for GIFs made from images)
+    'duration': None,
+    'loop': 0,
+    'optimize_gif': False,
+}
+
+
+def output_name(src_path: str, img_format: Optional[str], gif: bool) -> str:
+    """
+     Name of the output glitch_file saves src_path as
+
+     img_format: Format of the image at src_path (Image.format), None keeps its extension
+     gif: Whether the output is a GIF (a list of frames)
+    """
+    name, extension = os.path.splitext(os.path.basename(src_path))
+    if gif:
+        extension = '.gif'
+    elif img_format is not None and Image.registered_extensions().get(extension.lower()) != img_format:
+        # Misleading extension, saved in the format the file really is
+        extension = f'.{img_format.lower()}'
+    return f'glitched_{name}{extension}'
+
+
+def glitch_file(src_path: str, out_dir: str, preset: Dict) -> str:
+    """
+     Glitches the image at src_path with preset and saves it in out_dir
+     Returns the output path
+
+     Animated GIFs go through glitch_gif, every other image through glitch_image
+    """
+    glitcher = get_worker_glitcher()
+    params = {key: preset[key] for key in ('color_offset', 'scan_lines', 'seed', 'glitch_change', 'cycle', 'step', 'threads')}
+    with Image.open(src_path) as img:
+        img_format = img.format
+        if getattr(img, 'is_animated', False) and img.format == 'GIF':
+            output, src_duration, _ = glitcher.glitch_gif(img, preset['glitch_amount'], **params)
+            duration = preset['duration'] or src_duration
+        else:
+            # glitch_image tells PNGs apart by their format, keep the original Image object
+            output = glitcher.glitch_image(img, preset['glitch_amount'], gif=preset['gif'], frames=preset['frames'],
+                                           mode=preset['mode'], **params)
+            duration = preset['duration'] or 200
+    out_path = os.path.join(out_dir, output_name(src_path, img_format, isinstance(output, list)))
+    save_glitched(output, out_path, duration=duration, loop=preset['loop'], optimize_gif=preset['optimize_gif'])
+    return out_path
+
+
+def move_into(path: str, directory: str) -> str:
+    # Moves path into directory (replacing any file of the same name) and returns the new path
+    # A file that was removed (or moved) by someone else in the meantime is left alone
+    new_path = os.path.join(directory, os.path.basename(path))
+    try:
+        os.replace(path, new_path)
+    except FileNotFoundError:
+        pass
+    return new_path
+
+
+class FolderWatcher:
+    """
+     Polls watch_dir and hands complete files over to a pool of workers
+
+     A file is considered complete once its size and modification time
+     haven't changed for settle seconds
+     Outputs go to out_dir, originals are moved to done_dir or failed_dir
+     (along with a .error.txt file holding the traceback, for failures)
+    """
+
+    def __init__(self, watch_dir: str, preset: Dict, out_dir: str, done_dir: str, failed_dir: str,
+                 workers: int = 1, use_threads: bool = False, poll_interval: float = 1.0, settle: float = 1.0):
+        self.watch_dir = watch_dir
+        self.preset = preset
+        self.out_dir = out_dir
+        self.done_dir = done_dir
+        self.failed_dir = failed_dir
+        self.workers = workers
+        self.use_threads = use_threads
+        self.poll_interval = poll_interval
+        self.settle = settle
+
+        # path -> (size, mtime_ns, time the file was first seen in this state)
+        self.candidates: Dict[str, Tuple[int, int, float]] = {}
+        # future -> path, for files being glitched right now
+        self.inflight = {}
+        self.processed = 0
+        self.failed = 0
+        self.running = False
+
+    def scan(self) -> List[str]:
+        # Returns paths in watch_dir that are complete and not being worked on already
+        now = time()
+        seen = set()
+        ready = []
+        with os.scandir(self.watch_dir) as entries:
+            for entry in entries:
+                # Skip directories (i.e done/failed) and hidden/temp files
+                if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                    continue
+                path = entry.path
+                seen.add(path)
+                if path in self.inflight.values():
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                state = (stat.st_size, stat.st_mtime_ns)
+                candidate = self.candidates.get(path)
+                if candidate is None or candidate[:2] != state:
+                    # New file, or still being written to
+                    self.candidates[path] = state + (now,)
+                elif stat.st_size > 0 and now - candidate[2] >= self.settle:
+                    ready.append(path)
+        # Forget files that disappeared
+        for path in list(self.candidates):
+            if path not in seen:
+                del self.candidates[path]
+        return sorted(ready)
+
+    def collect(self, finished):
+        # Moves the originals of finished jobs into done_dir/failed_dir
+        for future in finished:
+            path = self.inflight.pop(future)
+            self.candidates.pop(path, None)
+            try:
+                out_path = future.result()
+            except Exception:
+                self.failed += 1
+                failed_path = move_into(path, self.failed_dir)
+                with open(failed_path + '.error.txt', 'w') as error_file:
+                    error_file.write(traceback.format_exc())
+                print(f'Failed: "{path}" (see "{failed_path}.error.txt")')
+                continue
+            self.processed += 1
+            move_into(path, self.done_dir)
+            print(f'Glitched: "{path}" -> "{out_path}"')
+
+    def run(self, once: bool = False):
+        """
+         Watches until stop() is called (i.e on SIGINT/SIGTERM)
+         once: Only process the files that are already present, then return
+        """
+        for directory in (self.out_dir, self.done_dir, self.failed_dir):
+            os.makedirs(directory, exist_ok=True)
+        executor_class = ThreadPoolExecutor if self.use_threads else ProcessPoolExecutor
+        self.running = True
+        with executor_class(max_workers=self.workers) as executor:
+            while self.running:
+                for path in self.scan():
+                    if len(self.inflight) >= self.workers * 2:
+                        # Keep a small backlog per worker, the rest waits for the next poll
+                        break
+                    future = executor.submit(glitch_file, path, self.out_dir, self.preset)
+                    self.inflight[future] = path
+                if once and not self.inflight and not any(size for size, _, _ in self.candidates.values()):
+                    # Nothing left but (still) empty files
+                    break
+                if self.inflight:
+                    finished, _ = wait(list(self.inflight), timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    self.collect(finished)
+                else:
+                    sleep(self.poll_interval)
+            # Let the jobs that were already handed out finish
+            finished, _ = wait(list(self.inflight))
+            self.collect(finished)
+
+    def stop(self, *_):
+        self.running = False
+
+
+def get_parser() -> argparse.ArgumentParser:
+    argparser = argparse.ArgumentParser(prog='glitch_this watch',
+                                        description='Glitch every image dropped into a directory')
+    argparser.add_argument('watch_dir', metavar='Directory', type=str, help='Directory to watch')
+    argparser.add_argument('glitch_level', metavar='Glitch_Level', type=float, nargs='?', default=None,
+                           help='Number between 0.1 and 10.0, inclusive (optional if given by --preset)')
+    argparser.add_argument('--preset', dest='preset', type=str, default=None,
+                           help='JSON file with glitch parameters, keys: ' + ', '.join(PRESET_DEFAULTS))
+    argparser.add_argument('-c', '--color', dest='color', action='store_true', help='Add color offset')
+    argparser.add_argument('-s', '--scan', dest='scan_lines', action='store_true', help='Add scan lines')
+    argparser.add_argument('-g', '--gif', dest='gif', action='store_true', help='Turn still images into GIFs')
+    argparser.add_argument('-sd', '--seed', dest='seed', type=float, default=None, help='Seed for the glitches')
+    argparser.add_argument('-o', '--outdir', dest='out_dir', type=str, default=None,
+                           help='Directory for outputs, default - <Directory>/glitched')
+    argparser.add_argument('--done-dir', dest='done_dir', type=str, default=None,
+                           help='Directory originals are moved to, default - <Directory>/done')
+    argparser.add_argument('--failed-dir', dest='failed_dir', type=str, default=None,
+                           help='Directory failed originals are moved to, default - <Directory>/failed')
+    argparser.add_argument('-w', '--workers', dest='workers', type=int, default=os.cpu_count() or 1,
+                           help='Number of worker processes, default - number of CPUs')
+    argparser.add_argument('--threads', dest='use_threads', action='store_true',
+                           help='Use worker threads instead of processes')
+    argparser.add_argument('--interval', dest='interval', type=float, default=1.0,
+                           help='Seconds between directory polls, default - 1')
+    argparser.add_argument('--settle', dest='settle', type=float, default=1.0,
+                           help='Seconds a file must stay unchanged to count as complete, default - 1')
+    argparser.add_argument('--once', dest='once', action='store_true',
+                           help='Process the files already in the directory, then exit')
+    return argparser
+
+
+def load_preset(args: argparse.Namespace) -> Dict:
+    # Defaults, overridden by the preset file, overridden by commandline arguments
+    preset = dict(PRESET_DEFAULTS)
+    if args.preset:
+        with open(args.preset, 'r') as preset_file:
+            from_file = json.load(preset_file)
+        unknown = set(from_file) - set(PRESET_DEFAULTS)
+        if unknown:
+            raise ValueError(f'Unknown preset keys: {", ".join(sorted(unknown))}')
+        preset.update(from_file)
+    if args.glitch_level is not None:
+        preset['glitch_amount'] = args.glitch_level
+    preset['color_offset'] = preset['color_offset'] or args.color
+    preset['scan_lines'] = preset['scan_lines'] or args.scan_lines
+    preset['gif'] = preset['gif'] or args.gif
+    if args.seed is not None:
+        preset['seed'] = args.seed
+    return preset
+
+
+def main(argv: Optional[List[str]] = None):
+    args = get_parser().parse_args(argv)
+    preset = load_preset(args)
+
+    # Sanity check inputs
+    if not os.path.isdir(args.watch_dir):
+        raise FileNotFoundError(f'No directory found at given path: {args.watch_dir}')
+    if preset['glitch_amount'] is None:
+        raise ValueError('Glitch level must be given, either as an argument or in the preset')
+    if not args.workers > 0:
+        raise ValueError('Workers must be greater than 0')
+    if not args.interval > 0:
+        raise ValueError('Interval must be greater than 0')
+
+    watcher = FolderWatcher(args.watch_dir, preset,
+                            out_dir=args.out_dir or os.path.join(args.watch_dir, 'glitched'),
+                            done_dir=args.done_dir or os.path.join(args.watch_dir, 'done'),
+                            failed_dir=args.failed_dir or os.path.join(args.watch_dir, 'failed'),
+                            workers=args.workers, use_threads=args.use_threads,
+                            poll_interval=args.interval, settle=args.settle)
+    # Finish the jobs in flight on ctrl+c / kill, then exit
+    signal.signal(signal.SIGINT, watcher.stop)
+    signal.signal(signal.SIGTERM, watcher.stop)
+    print(f'Watching "{args.watch_dir}" with {args.workers} worker(s)...')
+    watcher.run(once=args.once)
+    print(f'Done! Glitched: {watcher.processed}, Failed: {watcher.failed}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+ Work queue mode for the glitch_this library
+
+ A producer fills a spool directory (on any filesystem every host can reach, i.e NFS/SMB)
+ with one job file per input, and any number of workers, on any host, claim jobs,
+ glitch them and report the results back into the spool
+
+ Jobs move between the spool's subdirectories with atomic renames only, no locks:
+ * pending: Jobs waiting for a worker, as <job_id>.<attempt>.json
+ * claimed: Jobs being worked on, the modification time of the file is the worker's lease,
+            renewed while the job runs. Jobs whose lease ran out (i.e their worker died)
+            are put back into pending by any worker
+ * done/failed: One <job_id>.json per finished job, holding its output path or error
+
+ A job may run more than once (i.e if its worker was only too slow to renew its lease),
+ outputs are written atomically so that is harmless
+
+ Usage: glitch_this enqueue <inputs...> -q <spool> -l <glitch_level> -o <out_dir> [options] (see glitch_this enqueue -h)
+        glitch_this worker -q <spool> [options] (see glitch_this worker -h)
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import signal
+import socket
+import tempfile
+import traceback
+from threading import Event, Thread
+from time import monotonic, sleep, time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from glitch_this.batch import list_inputs
+from glitch_this.watch import PRESET_DEFAULTS, glitch_file, load_preset
+
+STATES = ('pending', 'claimed', 'done', 'failed')
+
+
+def job_id(src_path: str, out_dir: str, preset: Dict) -> str:
+    # The same input, output directory and preset always make the same job
+    key = json.dumps([os.path.abspath(src_path), os.path.abspath(out_dir), preset], sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+class Spool:
+    """
+     A work queue kept in a directory, see the module's docstring for its layout
+
+     PARAMETERS:-
+
+     path: Directory of the spool, created if it doesn't exist
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        for directory in STATES + ('tmp',):
+            os.makedirs(os.path.join(path, directory), exist_ok=True)
+
+    def state_path(self, state: str, name: str) -> str:
+        return os.path.join(self.path, state, name)
+
+    def names(self, state: str) -> List[str]:
+        # File names of the jobs in state
+        with os.scandir(os.path.join(self.path, state)) as entries:
+            return [entry.name for entry in entries if entry.name.endswith('.json')]
+
+    def counts(self) -> Dict[str, int]:
+        return {state: len(self.names(state)) for state in STATES}
+
+    def write(self, state: str, name: str, content: Dict):
+        # Writes content to state/name atomically, through a temp file in the spool
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', dir=os.path.join(self.path, 'tmp'))
+        try:
+            with os.fdopen(fd, 'w') as tmp_file:
+                json.dump(content, tmp_file, indent=2)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.state_path(state, name))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def enqueue(self, jobs: Iterable[Dict]) -> Tuple[int, int]:
+        """
+         Adds jobs ({'input', 'out_dir', 'preset'}) to pending
+         Jobs that are already queued, claimed or done are skipped, failed ones are queued again
+         Returns (added, skipped)
+        """
+        known = {name.split('.')[0] for state in ('pending', 'claimed', 'done') for name in self.names(state)}
+        added = skipped = 0
+        for job in jobs:
+            identifier = job_id(job['input'], job['out_dir'], job['preset'])
+            if identifier in known:
+                skipped += 1
+                continue
+            self.write('pending', f'{identifier}.0.json', job)
+            try:
+                os.remove(self.state_path('failed', f'{identifier}.json'))
+            except FileNotFoundError:
+                pass
+            known.add(identifier)
+            added += 1
+        return added, skipped
+
+    def claim(self, names: List[str]) -> Optional[Tuple[str, Dict]]:
+        """
+         Tries to claim the pending jobs of names, in order, until one is claimed
+         Returns (claimed job's name, job) or None if every one was taken by someone else
+        """
+        while names:
+            name = names.pop()
+            claimed_path = self.state_path('claimed', name)
+            try:
+                # Only one worker can move the file, the others get FileNotFoundError
+                os.rename(self.state_path('pending', name), claimed_path)
+            except FileNotFoundError:
+                continue
+            # A rename keeps the modification time, start the lease now
+            os.utime(claimed_path)
+            with open(claimed_path, 'r') as job_file:
+                return name, json.load(job_file)
+        return None
+
+    def renew(self, name: str) -> bool:
+        # Renews the lease of claimed job name, False if it was reclaimed (or finished) in the meantime
+        try:
+            os.utime(self.state_path('claimed', name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def release(self, name: str):
+        # Removes claimed job name
+        try:
+            os.remove(self.state_path('claimed', name))
+        except FileNotFoundError:
+            # Reclaimed in the meantime, the job is finished now anyway
+            pass
+
+    def finish(self, name: str, state: str, result: Dict):
+        # Records the result of claimed job name in done/failed, then releases it
+        self.write(state, name.split('.')[0] + '.json', result)
+        self.release(name)
+
+    def requeue(self, name: str) -> bool:
+        # Moves claimed job name back into pending, as its next attempt
+        identifier, attempt, _ = name.split('.')
+        try:
+            os.rename(self.state_path('claimed', name), self.state_path('pending', f'{identifier}.{int(attempt) + 1}.json'))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def reclaim(self, lease: float, max_attempts: int) -> int:
+        """
+         Puts claimed jobs whose lease ran out more than lease seconds ago back into pending
+         Jobs that ran out of attempts go to failed instead
+         Returns the number of jobs reclaimed
+        """
+        reclaimed = 0
+        now = time()
+        for name in self.names('claimed'):
+            try:
+                stat = os.stat(self.state_path('claimed', name))
+            except FileNotFoundError:
+                continue
+            # Renames and utime both update ctime, so jobs claimed right before their lease started aren't expired
+            if now - max(stat.st_mtime, stat.st_ctime) < lease:
+                continue
+            identifier, attempt, _ = name.split('.')
+            if os.path.exists(self.state_path('done', f'{identifier}.json')):
+                # Finished, but its worker died before releasing it
+                self.release(name)
+                continue
+            if int(attempt) + 1 >= max_attempts:
+                try:
+                    with open(self.state_path('claimed', name), 'r') as job_file:
+                        job = json.load(job_file)
+                except FileNotFoundError:
+                    continue
+                self.finish(name, 'failed', {'job': job, 'error': f'Lease ran out {int(attempt) + 1} times',
+                                             'attempts': int(attempt) + 1, 'finished': time()})
+                print(f'Failed: "{job["input"]}" (lease ran out)')
+                continue
+            if self.requeue(name):
+                reclaimed += 1
+        return reclaimed
+
+
+class Heartbeat(Thread):
+    # Renews the lease of a claimed job every interval seconds, until stopped
+    def __init__(self, spool: Spool, job_name: str, interval: float):
+        super().__init__(daemon=True)
+        self.spool = spool
+        self.job_name = job_name
+        self.interval = interval
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if not self.spool.renew(self.job_name):
+                # Reclaimed, the job still finishes (it may just run twice)
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class Worker:
+    """
+     Claims jobs from a spool and glitches them, one at a time, until stop() is called
+     (i.e on SIGINT/SIGTERM, the job being worked on is finished first)
+
+     lease: Seconds a claimed job is kept without its lease being renewed,
+            leases are renewed every lease / 3 seconds while a job runs
+            Must be well above the clock differences between hosts
+
+     drain: Return once no job is pending or claimed, instead of waiting for new ones
+    """
+
+    def __init__(self, spool: Spool, lease: float = 60.0, poll_interval: float = 1.0, max_attempts: int = 3,
+                 drain: bool = False):
+        self.spool = spool
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.drain = drain
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self.processed = 0
+        self.failed = 0
+        self.running = False
+
+    def process(self, name: str, job: Dict):
+        # Glitches claimed job name, and records its result
+        identifier, attempt, _ = name.split('.')
+        if os.path.exists(self.spool.state_path('done', f'{identifier}.json')):
+            # Done by a worker whose lease ran out, before it was reclaimed
+            self.spool.release(name)
+            return
+        heartbeat = Heartbeat(self.spool, name, self.lease / 3)
+        heartbeat.start()
+        started = monotonic()
+        try:
+            os.makedirs(job['out_dir'], exist_ok=True)
+            out_path = glitch_file(job['input'], job['out_dir'], job['preset'])
+        except Exception:
+            heartbeat.stop()
+            attempts = int(attempt) + 1
+            if attempts < self.max_attempts and self.spool.requeue(name):
+                print(f'Retrying: "{job["input"]}"')
+                return
+            self.failed += 1
+            self.spool.finish(name, 'failed', {'job': job, 'error': traceback.format_exc(), 'attempts': attempts,
+                                               'worker': self.worker_id, 'finished': time()})
+            print(f'Failed: "{job["input"]}"')
+            return
+        heartbeat.stop()
+        self.processed += 1
+        self.spool.finish(name, 'done', {'job': job, 'output': out_path, 'attempts': int(attempt) + 1,
+                                         'worker': self.worker_id, 'seconds': monotonic() - started,
+                                         'finished': time()})
+        print(f'Glitched: "{job["input"]}" -> "{out_path}"')
+
+    def run(self):
+        self.running = True
+        # Pending job names not tried yet, in random order so that workers don't all go for the same ones
+        names = []
+        last_reclaim = None
+        while self.running:
+            if last_reclaim is None or monotonic() - last_reclaim >= self.lease / 3:
+                self.spool.reclaim(self.lease, self.max_attempts)
+                last_reclaim = monotonic()
+            if not names:
+                names = self.spool.names('pending')
+                random.shuffle(names)
+            claimed = self.spool.claim(names)
+            if claimed is not None:
+                self.process(*claimed)
+                continue
+            if self.drain and not self.spool.names('pending') and not self.spool.names('claimed'):
+                break
+            sleep(self.poll_interval)
+
+    def stop(self, *_):
+        self.running = False
+
+
+def add_preset_arguments(argparser: argparse.ArgumentParser):
+    argparser.add_argument('-l', '--level', dest='glitch_level', metavar='Glitch_Level', type=float, default=None,
+                           help='Number between 0.1 and 10.0, inclusive (optional if given by --preset)')
+    argparser.add_argument('--preset', dest='preset', type=str, default=None,
+                           help='JSON file with glitch parameters, keys: ' + ', '.join(PRESET_DEFAULTS))
+    argparser.add_argument('-c', '--color', dest='color', action='store_true', help='Add color offset')
+    argparser.add_argument('-s', '--scan', dest='scan_lines', action='store_true', help='Add scan lines')
+    argparser.add_argument('-g', '--gif', dest='gif', action='store_true', help='Turn still images into GIFs')
+    argparser.add_argument('-sd', '--seed', dest='seed', type=float, default=None, help='Seed for the glitches')
+
+
+def get_enqueue_parser() -> argparse.ArgumentParser:
+    argparser = argparse.ArgumentParser(prog='glitch_this enqueue',
+                                        description='Add jobs to a spool for glitch_this worker processes')
+    argparser.add_argument('inputs', metavar='Input', type=str, nargs='*',
+                           help='Image files, or directories to glitch every image in (recursively)')
+    argparser.add_argument('-q', '--queue', dest='spool', type=str, required=True,
+                           help='Spool directory, on storage shared by every worker')
+    argparser.add_argument('-o', '--outdir', dest='out_dir', type=str, default=None,
+                           help='Directory for outputs, the layout of input directories is kept under it')
+    argparser.add_argument('--status', dest='status', action='store_true',
+                           help='Only print the number of pending, claimed, done and failed jobs')
+    add_preset_arguments(argparser)
+    return argparser
+
+
+def get_worker_parser() -> argparse.ArgumentParser:
+    argparser = argparse.ArgumentParser(prog='glitch_this worker',
+                                        description='Glitch the jobs of a spool, along with any number of other workers')
+    argparser.add_argument('-q', '--queue', dest='spool', type=str, required=True,
+                           help='Spool directory, on storage shared by every worker')
+    argparser.add_argument('--lease', dest='lease', type=float, default=60.0,
+                           help='Seconds before jobs of unresponsive workers are reclaimed, default - 60')
+    argparser.add_argument('--poll', dest='poll_interval', type=float, default=1.0,
+                           help='Seconds between checks for new jobs, default - 1')
+    argparser.add_argument('--max-attempts', dest='max_attempts', type=int, default=3,
+                           help='Stop retrying jobs that failed this many times, default - 3')
+    argparser.add_argument('--drain', dest='drain', action='store_true',
+                           help='Exit once no job is pending or claimed, instead of waiting for new ones')
+    return argparser
+
+
+def enqueue_main(argv: Optional[List[str]] = None):
+    args = get_enqueue_parser().parse_args(argv)
+    spool = Spool(args.spool)
+    if args.status:
+        print(', '.join(f'{state.capitalize()}: {count}' for state, count in spool.counts().items()))
+        return
+
+    preset = load_preset(args)
+    # Sanity check inputs
+    if not args.inputs or args.out_dir is None:
+        raise ValueError('Inputs and an output directory (-o/--outdir) must be given')
+    for path in args.inputs:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'No file or directory found at given path: {path}')
+    if preset['glitch_amount'] is None:
+        raise ValueError('Glitch level must be given, either with -l/--level or in the preset')
+
+    # Recorded by absolute paths, workers on other hosts must see them at the same paths
+    jobs = ({'input': os.path.abspath(path), 'out_dir': os.path.abspath(out_dir), 'preset': preset}
+            for path, out_dir in list_inputs(args.inputs, args.out_dir, gif=preset['gif']))
+    added, skipped = spool.enqueue(jobs)
+    print(f'Queued: {added}, Skipped: {skipped}')
+
+
+def main(argv: Optional[List[str]] = None):
+    args = get_worker_parser().parse_args(argv)
+    if not args.lease > 0:
+        raise ValueError('Lease must be greater than 0')
+    if not args.poll_interval > 0:
+        raise ValueError('Poll interval must be greater than 0')
+    if not args.max_attempts > 0:
+        raise ValueError('Max attempts must be greater than 0')
+
+    worker = Worker(Spool(args.spool), lease=args.lease, poll_interval=args.poll_interval,
+                    max_attempts=args.max_attempts, drain=args.drain)
+    # Finish the job being worked on on ctrl+c / kill, then exit
+    signal.signal(signal.SIGINT, worker.stop)
+    signal.signal(signal.SIGTERM, worker.stop)
+    worker.run()
+    print(f'Done! Glitched: {worker.processed}, Failed: {worker.failed}')
+
+
+if __name__ == '__main__':
+    main()
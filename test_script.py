@@ -96,6 +96,12 @@ def test_image_to_image():
         img, 2, color_offset=True, scan_lines=True, seed=42)
     glitch_img.save(f'Collections/glitched_test_all_obj.{fmt}')
 
+    # Glitch the same image with many amounts and seeds at once
+    # The image is only decoded once, here the variants are tiled into a single contact sheet
+    contact_sheet = glitcher.glitch_sweep(
+        f'test.{fmt}', [1, 2, 4, 8], seeds=[1, 2, 3], scan_lines=True, output='sheet')
+    contact_sheet.save(f'Collections/glitched_test_sweep.{fmt}')
+
 
 def test_image_to_gif():
     """
@@ -214,6 +220,18 @@ def test_image_to_gif():
                         duration=DURATION,
                         loop=LOOP)
 
+    # Now try a seekable GIF
+    # Every frame only depends on the seed and its index, so any frame can be rendered again on its own
+    glitch_imgs = glitcher.glitch_image(
+        f'test.{fmt}', 2, glitch_change=1, cycle=True, gif=True, seed=42, seekable=True)
+    glitch_imgs[7] = glitcher.render_frame(7)
+    glitch_imgs[0].save('Collections/glitched_test_seekable.gif',
+                        format='GIF',
+                        append_images=glitch_imgs[1:],
+                        save_all=True,
+                        duration=DURATION,
+                        loop=LOOP)
+
     # You can also pass an Image object inplace of the path
     # Applicable in all of the examples above
     img = Image.open(f'test.{fmt}')
@@ -469,6 +487,762 @@ def test_gif_to_gif():
                         loop=LOOP)
 
 
+def test_palette_gif_threads():
+    """
+     Checks that keep_palette jobs running in other threads don't change
+     how GIF frames are decoded by the others (pillow's loading strategy is global)
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from PIL import GifImagePlugin
+    from glitch_this.glitch_this import gif_frames
+
+    def decode_modes():
+        with Image.open('test.gif') as gif:
+            return [frame.mode for frame in gif_frames(gif)]
+
+    def palette_modes():
+        return [frame.mode for frame in ImageGlitcher().glitch_gif('test.gif', 2, keep_palette=True)[0]]
+
+    original_strategy = GifImagePlugin.LOADING_STRATEGY
+    expected = {decode_modes: decode_modes(), palette_modes: palette_modes()}
+    # Frames after the first are decoded to RGBA by default, kept in P mode by keep_palette jobs
+    assert set(expected[decode_modes][1:]) == {'RGBA'} and set(expected[palette_modes]) == {'P'}
+    jobs = [decode_modes, palette_modes] * 10
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for job, modes in zip(jobs, executor.map(lambda job: job(), jobs)):
+            assert modes == expected[job]
+    assert GifImagePlugin.LOADING_STRATEGY == original_strategy
+
+    # The first frame is decoded with the strategy it was seeked with too
+    with Image.open('test.gif') as gif:
+        first = next(gif_frames(gif, GifImagePlugin.LoadingStrategy.RGB_ALWAYS))
+        assert first.mode in ('RGB', 'RGBA')
+    assert GifImagePlugin.LOADING_STRATEGY == original_strategy
+
+
+def test_optimized_gif():
+    """
+     Checks that save_optimized_gif only tries a plain pillow save as well when most of
+     the frames changed and colors is 255, and that it's never larger than that save then
+    """
+    import io
+    from glitch_this import gif_optimizer
+    from glitch_this.gif_optimizer import encode_plain_gif, optimize_frames, save_optimized_gif
+
+    checker = ImageGlitcher()
+    outputs = [checker.glitch_gif('test.gif', 2, seed=1)[0],
+               checker.glitch_gif('test.gif', 2, seed=1, step=3)[0],
+               checker.glitch_gif('test.gif', 2, seed=1, keep_palette=True)[0],
+               checker.glitch_image('test.png', 2, gif=True, frames=4, seed=1),
+               checker.glitch_image('test.png', 2, gif=True, frames=4, step=2, seed=1),
+               checker.glitch_gif('test.gif', 0.5, seed=1)[0]]
+    plain_calls = []
+    original_encode_plain_gif = gif_optimizer.encode_plain_gif
+    gif_optimizer.encode_plain_gif = lambda *args: plain_calls.append(args) or original_encode_plain_gif(*args)
+    try:
+        for frames in outputs:
+            changed = optimize_frames(frames, 100)[3]
+            for colors in (255, 16):
+                plain_calls.clear()
+                buffer = io.BytesIO()
+                save_optimized_gif(frames, buffer, duration=100, colors=colors)
+                assert len(plain_calls) == (colors == 255 and changed >= gif_optimizer.PLAIN_MIN_CHANGED)
+                if plain_calls:
+                    assert len(buffer.getvalue()) <= len(encode_plain_gif(frames, 100))
+                buffer.seek(0)
+                assert Image.open(buffer).format == 'GIF'
+    finally:
+        gif_optimizer.encode_plain_gif = original_encode_plain_gif
+
+
+def test_bytes_formats():
+    """
+     Checks that glitch_bytes encodes in the format that was asked for,
+     converting images to a mode the format can hold (i.e RGBA PNGs to RGB JPEGs)
+    """
+    import io
+
+    checker = ImageGlitcher()
+    with open('test.png', 'rb') as png_file:
+        data = png_file.read()
+    for format, expected_format in ((None, 'PNG'), ('JPEG', 'JPEG'), ('jpeg', 'JPEG'), ('WEBP', 'WEBP')):
+        output = Image.open(io.BytesIO(checker.glitch_bytes(data, 2, format=format, seed=1)))
+        assert output.format == expected_format
+        assert output.size == Image.open('test.png').size
+
+
+def test_batch_outputs():
+    """
+     Checks that batch jobs give every input an output of its own,
+     even inputs of the same name in different directories
+    """
+    import tempfile
+    from glitch_this.batch import list_inputs
+    from glitch_this.watch import PRESET_DEFAULTS, glitch_file, output_name
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for directory in ('a', 'b', os.path.join('b', 'c')):
+            os.makedirs(os.path.join(tmp_dir, directory))
+            shutil.copy('test.png', os.path.join(tmp_dir, directory, 'x.png'))
+        Image.open('test.png').convert('RGB').save(os.path.join(tmp_dir, 'b', 'x.jpg'))
+        out_dir = os.path.join(tmp_dir, 'out')
+        inputs = [os.path.join(tmp_dir, 'a', 'x.png'), os.path.join(tmp_dir, 'b', 'x.png'),
+                  os.path.join(tmp_dir, 'a'), os.path.join(tmp_dir, 'b')]
+        listed = list(list_inputs(inputs, out_dir))
+        # Every input once, every output (directory and name) once
+        assert len({path for path, _ in listed}) == len(listed) == 4
+        assert len({(os.path.abspath(directory), os.path.basename(path)) for path, directory in listed}) == len(listed)
+
+        # As GIFs, b/x.png and b/x.jpg would both be glitched_x.gif, in the same directory
+        try:
+            list(list_inputs(inputs, out_dir, gif=True))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('Inputs with the same output must be rejected')
+
+        # A PNG named x.jpg is saved as glitched_x.png, so b/c/x.jpg and b/c/x.png
+        # both collide with b/x.png's output, then with each other's
+        shutil.copy('test.png', os.path.join(tmp_dir, 'b', 'c', 'x.jpg'))
+        try:
+            list(list_inputs([os.path.join(tmp_dir, 'b', 'x.png'), os.path.join(tmp_dir, 'b', 'c')], out_dir))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('Inputs with the same output must be rejected')
+        # Outputs are named the way glitch_file names them
+        preset = dict(PRESET_DEFAULTS, glitch_amount=2, seed=1)
+        os.makedirs(out_dir)
+        out_path = glitch_file(os.path.join(tmp_dir, 'b', 'c', 'x.jpg'), out_dir, preset)
+        assert os.path.basename(out_path) == output_name(os.path.join(tmp_dir, 'b', 'c', 'x.jpg'), 'PNG', False) \
+            == 'glitched_x.png'
+
+
+def test_small_regions():
+    """
+     Checks that a roi or mask less than 4 rows tall is glitched,
+     and that pixels outside of it are left untouched
+    """
+    import numpy as np
+
+    checker = ImageGlitcher()
+    img = Image.open('test.png').convert('RGB')
+    arr = np.asarray(img)
+    for top in (0, 10, img.height - 1):
+        for rows in (1, 2, 3):
+            bottom = min(top + rows, img.height)
+            glitched = np.asarray(checker.glitch_image(img, 10, roi=(0, top, img.width, bottom), seed=1))
+            assert np.array_equal(glitched[:top], arr[:top]) and np.array_equal(glitched[bottom:], arr[bottom:])
+
+            mask = np.zeros(arr.shape[:2], dtype=bool)
+            mask[top:bottom, 5:50] = True
+            glitched = np.asarray(checker.glitch_image(img, 10, mask=mask, color_offset=True, seed=1))
+            assert np.array_equal(glitched[~mask], arr[~mask])
+
+
+def test_kernel_registry():
+    """
+     Checks that every builtin kernel matches the reference kernels, the threaded
+     kernel's split into chunks included, and that a kernel going wrong only when
+     split is caught by verify
+    """
+    from glitch_this.kernels import KernelRegistry, shift_reference, shift_threaded
+
+    registry = KernelRegistry()
+    for op in ('shift', 'color_offset'):
+        assert registry.verified(op) == registry.names(op)
+
+    def shift_split_wrong(inputarr, outputarr, start_y, stop_y, offset, min_pixels=2 ** 18, chunks=None):
+        # Drops the last row when it splits the rows up
+        if (stop_y - start_y) * inputarr.shape[1] >= 2 * min_pixels and (chunks or 1) > 1:
+            stop_y -= 1
+        shift_reference(inputarr, outputarr, start_y, stop_y, offset)
+
+    registry.register('shift', 'split_wrong', shift_split_wrong, verify_params={'min_pixels': 1, 'chunks': 3})
+    assert not registry.verify('shift', 'split_wrong')
+    registry.register('shift', 'split_wrong', shift_split_wrong)
+    assert registry.verify('shift', 'split_wrong')
+    assert registry.verify('shift', 'threaded')
+
+
+def test_render_frame():
+    """
+     Checks that render_frame renders the same frames as the seekable glitch_image call,
+     in any order, and refuses to once another call replaced the input
+    """
+    import numpy as np
+
+    checker = ImageGlitcher()
+    frames = checker.glitch_image('test.png', 3, gif=True, frames=6, seed=7, seekable=True, glitch_change=1)
+    for index in (5, 2, 0, 3):
+        assert np.array_equal(np.asarray(checker.render_frame(index)), np.asarray(frames[index]))
+
+    for other_call in (lambda: checker.glitch_gif('test.gif', 2),
+                       lambda: checker.glitch_image('test.png', 2, roi=(0, 0, 10 ** 6, 10)),
+                       lambda: checker.glitch_sweep('test.png', [2])):
+        checker.glitch_image('test.png', 3, gif=True, frames=2, seed=7, seekable=True)
+        try:
+            other_call()
+        except ValueError:
+            # Failed after the input was replaced (roi out of the image)
+            pass
+        try:
+            checker.render_frame(1)
+        except Exception as error:
+            assert 'seekable=True' in str(error)
+        else:
+            raise AssertionError('render_frame must not render after another call replaced the input')
+
+
+def test_sweep_threads():
+    """
+     Checks that glitch_sweep glitches with its own threads, not the previous call's,
+     and that its variants are the same for any number of threads
+    """
+    import numpy as np
+
+    checker = ImageGlitcher()
+    expected = checker.glitch_sweep('test.png', [2, 6], seeds=[1, 2], color_offset=True, output='stack')
+    checker.glitch_image('test.png', 2, threads=4)
+    assert np.array_equal(checker.glitch_sweep('test.png', [2, 6], seeds=[1, 2], color_offset=True, output='stack'),
+                          expected)
+    assert checker.threads == 1
+    assert np.array_equal(checker.glitch_sweep('test.png', [2, 6], seeds=[1, 2], color_offset=True, threads=3,
+                                               output='stack'), expected)
+    assert checker.threads == 3
+
+
+def test_renditions_animated():
+    """
+     Checks that glitch_renditions refuses formats that can't hold an animation
+     for GIF outputs, before glitching, and encodes them for still outputs
+    """
+    checker = ImageGlitcher()
+    for src_img, kwargs in (('test.png', {'gif': True, 'frames': 3}), ('test.gif', {})):
+        try:
+            checker.glitch_renditions(src_img, 2, [(64, 'GIF', None), (64, 'JPEG', 85)], **kwargs)
+        except ValueError as error:
+            assert 'JPEG' in str(error)
+        else:
+            raise AssertionError('JPEG renditions of GIF outputs must be refused')
+    gif_output, jpeg_output = checker.glitch_renditions('test.png', 2, [(64, 'GIF', None), (64, 'JPEG', 85)])
+    assert gif_output.startswith(b'GIF') and jpeg_output.startswith(b'\xff\xd8')
+
+
+def test_atlas_closes():
+    """
+     Checks that glitch_atlas closes a GIF it opened from a path, even when it fails
+    """
+    from unittest import mock
+
+    checker = ImageGlitcher()
+    opened = []
+    real_open = Image.open
+
+    def tracking_open(*args, **kwargs):
+        opened.append(real_open(*args, **kwargs))
+        return opened[-1]
+
+    with mock.patch('glitch_this.glitch_this.Image.open', tracking_open):
+        atlas, frame_map = checker.glitch_atlas('test.gif', 2, seed=1)
+        assert atlas.size[0] > 0 and frame_map
+        # The last one opened is glitch_atlas' own
+        assert opened[-1].fp is None
+        try:
+            # Fails before glitching, columns must be positive
+            checker.glitch_atlas('test.gif', 2, columns=0)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('columns=0 must be refused')
+        assert opened[-1].fp is None
+
+
+def test_calibrated_estimate():
+    """
+     Checks that calibrate measures every rate (none is left at 0),
+     and that the GIF render time estimated with them is close to glitch_gif's
+    """
+    from glitch_this.estimate import best_time, calibrate
+
+    model = calibrate(size=(192, 128), repeats=2)
+    assert all(rate > 0 for name, rate in model.rates.items() if not name.endswith('_data'))
+    checker = ImageGlitcher()
+    for cost_model in (None, model):
+        checker.cost_model = cost_model
+        for params in ({}, {'step': 3, 'color_offset': True}, {'scan_lines': True}):
+            seconds = best_time(lambda: checker.glitch_gif('test.gif', 2, **params), 3)
+            assert seconds / 2 <= checker.estimate('test.gif', **params)['seconds'] <= seconds * 2
+
+
+def test_region_estimate():
+    """
+     Checks that estimate scales the glitch by the roi/mask region,
+     the same for a roi and a mask of the same box
+    """
+    import numpy as np
+
+    checker = ImageGlitcher()
+    with Image.open('test.png') as img:
+        width, height = img.size
+    mask = np.zeros((height, width), dtype=bool)
+    mask[:, :width // 2] = True
+    whole = checker.estimate('test.png', mode='RGB')
+    half = checker.estimate('test.png', mode='RGB', roi=(0, 0, width // 2, height))
+    assert half['seconds'] < whole['seconds'] and half['output_bytes'] == whole['output_bytes']
+    for region_mask in (mask, Image.fromarray(mask.astype(np.uint8) * 255, 'L')):
+        assert checker.estimate('test.png', mode='RGB', mask=region_mask) == half
+
+
+def test_threads():
+    """
+     Checks that glitching in row bands on several threads gives the same outputs as on one thread
+    """
+    import numpy as np
+
+    checker = ImageGlitcher()
+    # Small enough images are never split, allow a band per few rows
+    checker.thread_min_pixels = 1024
+    for params in ({}, {'color_offset': True, 'scan_lines': True}, {'seekable': True}):
+        expected = np.asarray(checker.glitch_image('test.png', 6, seed=5, **params))
+        for threads in (2, 3, 8):
+            assert np.array_equal(np.asarray(checker.glitch_image('test.png', 6, seed=5, threads=threads, **params)),
+                                  expected)
+    expected, _, _ = checker.glitch_gif('test.gif', 3, seed=5, color_offset=True)
+    glitched, _, _ = checker.glitch_gif('test.gif', 3, seed=5, color_offset=True, threads=4)
+    for frame, expected_frame in zip(glitched, expected):
+        assert np.array_equal(np.asarray(frame), np.asarray(expected_frame))
+
+
+def test_bench():
+    """
+     Checks that a short bench run reports every job and its latency percentiles in order,
+     that jobs glitch in the mode of their source, and that memory reads 0 without the resource module
+    """
+    from glitch_this import bench
+    from glitch_this.bench import get_parser, make_source, run_bench, run_job
+
+    args = get_parser().parse_args(['-n', '6', '-c', '2', '--sizes', '64x48', '--kinds', 'image', 'gif', 'gif-in',
+                                    '--modes', 'RGB', 'L', '--frames', '3', '--encode', '--seed', '1'])
+    report = run_bench(args)
+    assert report['jobs'] == 6
+    latency = report['latency']
+    assert 0 < latency['p50'] <= latency['p95'] <= latency['p99'] <= latency['max']
+
+    glitched_modes = []
+    original_glitch_image = ImageGlitcher.glitch_image
+    ImageGlitcher.glitch_image = lambda self, img, *args, **kwargs: glitched_modes.append(kwargs.get('mode'))
+    try:
+        for mode in ('L', 'RGB'):
+            run_job({'kind': 'image', 'mode': mode, 'level': 2, 'color': False, 'scan': False, 'threads': 1,
+                     'frames': 3, 'encode': False}, make_source((32, 24), mode))
+    finally:
+        ImageGlitcher.glitch_image = original_glitch_image
+    assert glitched_modes == ['L', 'RGB']
+
+    original_resource = bench.resource
+    bench.resource = None
+    try:
+        assert bench.peak_rss() == 0
+    finally:
+        bench.resource = original_resource
+
+
+def test_native_modes():
+    """
+     Checks that mode='native' glitches images in their own mode and dtype, moving pixels around
+     and nothing else, the same as converting them to that mode would
+    """
+    import numpy as np
+
+    checker = ImageGlitcher()
+    with Image.open('test.png') as img:
+        rgb = img.convert('RGB')
+    sources = [rgb.convert(mode) for mode in ('L', 'LA', 'RGB', 'CMYK')]
+    sources.append(Image.fromarray(np.asarray(rgb.convert('L')).astype(np.uint16) * 257))
+    for src in sources:
+        glitched = checker.glitch_image(src, 5, seed=2, mode='native')
+        assert glitched.mode == src.mode and glitched.size == src.size
+        src_arr, glitched_arr = np.asarray(src), np.asarray(glitched)
+        assert glitched_arr.dtype == src_arr.dtype
+        assert np.array_equal(np.sort(glitched_arr, axis=None), np.sort(src_arr, axis=None))
+        assert np.array_equal(glitched_arr, np.asarray(checker.glitch_image(src, 5, seed=2, mode=src.mode)))
+
+
+def test_stage_cache():
+    """
+     Checks that renders are the same with and without a stage cache,
+     including renders that reuse cached stages
+    """
+    import numpy as np
+    from glitch_this import ArrayCache
+
+    cached, uncached = ImageGlitcher(), ImageGlitcher()
+    cached.stage_cache = ArrayCache(64 * 2 ** 20)
+    for _ in range(2):
+        for params in ({}, {'scan_lines': True}, {'color_offset': True}, {'color_offset': True, 'scan_lines': True},
+                       {'seekable': True}, {'seekable': True, 'scan_lines': True}):
+            assert np.array_equal(np.asarray(cached.glitch_image('test.png', 4, seed=9, **params)),
+                                  np.asarray(uncached.glitch_image('test.png', 4, seed=9, **params)))
+    frames = cached.glitch_image('test.png', 4, seed=9, gif=True, frames=4, seekable=True, glitch_change=1)
+    expected = uncached.glitch_image('test.png', 4, seed=9, gif=True, frames=4, seekable=True, glitch_change=1)
+    for frame, expected_frame in zip(frames, expected):
+        assert np.array_equal(np.asarray(frame), np.asarray(expected_frame))
+    assert len(cached.stage_cache) > 0
+
+
+def test_watch():
+    """
+     Checks that the watch folder daemon saves the same output as glitch_image,
+     and moves processed inputs into the done folder
+     GIFs keep their own duration, unless the preset has one
+    """
+    import tempfile
+
+    import numpy as np
+    from glitch_this.watch import PRESET_DEFAULTS, FolderWatcher, glitch_file
+
+    preset = dict(PRESET_DEFAULTS, glitch_amount=3, seed=4, color_offset=True)
+    expected = np.asarray(ImageGlitcher().glitch_image('test.png', 3, seed=4, color_offset=True))
+    with tempfile.TemporaryDirectory() as folder:
+        out_path = glitch_file('test.png', folder, preset)
+        with Image.open(out_path) as output:
+            assert np.array_equal(np.asarray(output), expected)
+
+        watched = os.path.join(folder, 'in')
+        os.mkdir(watched)
+        shutil.copy('test.png', watched)
+        watcher = FolderWatcher(watched, preset, os.path.join(folder, 'out'), os.path.join(folder, 'done'),
+                                os.path.join(folder, 'failed'), use_threads=True, poll_interval=0.05, settle=0)
+        watcher.run(once=True)
+        assert watcher.processed == 1 and os.listdir(os.path.join(folder, 'done')) == ['test.png']
+        assert not os.path.exists(os.path.join(watched, 'test.png'))
+        with Image.open(os.path.join(folder, 'out', 'glitched_test.png')) as output:
+            assert np.array_equal(np.asarray(output), expected)
+
+        # test.gif's average duration is 33.3 ms, GIFs hold centiseconds
+        for duration, expected_duration in ((None, 30), (120, 120)):
+            out_path = glitch_file('test.gif', folder, dict(preset, duration=duration))
+            with Image.open(out_path) as output:
+                assert output.info['duration'] == expected_duration
+
+
+def test_progress_cancel():
+    """
+     Checks that GIF jobs report progress for every frame, and stop as soon as
+     they're cancelled or their deadline passed
+    """
+    from concurrent.futures import CancelledError
+    from threading import Event
+    from time import monotonic
+
+    checker = ImageGlitcher()
+    for glitch in (lambda **params: checker.glitch_gif('test.gif', 2, **params),
+                   lambda **params: checker.glitch_image('test.png', 2, gif=True, frames=5, **params)):
+        reports = []
+        glitch(progress=lambda done, total, elapsed: reports.append((done, total)))
+        total = reports[0][1]
+        assert reports == [(done, total) for done in range(total + 1)]
+
+        cancel = Event()
+
+        def cancel_after_two(done, total, elapsed):
+            if done == 2:
+                cancel.set()
+        try:
+            glitch(progress=cancel_after_two, cancel=cancel)
+        except CancelledError:
+            pass
+        else:
+            raise AssertionError('A cancelled job must raise CancelledError')
+        try:
+            glitch(deadline=monotonic() - 1)
+        except TimeoutError:
+            pass
+        else:
+            raise AssertionError('A job past its deadline must raise TimeoutError')
+
+
+def test_parallel_frames():
+    """
+     Checks that seekable frames rendered on several workers are the same as on one
+    """
+    import numpy as np
+
+    checker = ImageGlitcher()
+    params = {'seed': 8, 'gif': True, 'frames': 7, 'step': 2, 'glitch_change': 1, 'cycle': True,
+              'color_offset': True, 'seekable': True}
+    expected = [np.asarray(frame) for frame in checker.glitch_image('test.png', 3, **params)]
+    for workers in (2, 3):
+        frames = checker.glitch_image('test.png', 3, workers=workers, **params)
+        assert len(frames) == len(expected)
+        assert all(np.array_equal(np.asarray(frame), expected_frame) for frame, expected_frame in zip(frames, expected))
+
+
+def test_batch_resume():
+    """
+     Checks that a batch job glitches every input once, and that running it again
+     skips the inputs that are done and unchanged
+    """
+    import tempfile
+
+    from glitch_this.batch import BatchJob
+    from glitch_this.watch import PRESET_DEFAULTS
+
+    preset = dict(PRESET_DEFAULTS, glitch_amount=2, seed=1)
+    with tempfile.TemporaryDirectory() as folder:
+        inputs = []
+        for name in ('a.png', 'b.png'):
+            inputs.append(os.path.join(folder, name))
+            shutil.copy('test.png', inputs[-1])
+        manifest = os.path.join(folder, 'manifest.db')
+        out_dir = os.path.join(folder, 'out')
+
+        job = BatchJob(manifest, preset, out_dir, use_threads=True)
+        job.run(inputs)
+        job.close()
+        assert (job.processed, job.skipped, job.failed) == (2, 0, 0)
+        assert sorted(os.listdir(out_dir)) == ['glitched_a.png', 'glitched_b.png']
+
+        # b changed, a is done
+        Image.open('test.gif').convert('RGB').save(inputs[1])
+        job = BatchJob(manifest, preset, out_dir, use_threads=True)
+        job.run(inputs)
+        job.close()
+        assert (job.processed, job.skipped, job.failed) == (1, 1, 0)
+
+
+def test_budgeted():
+    """
+     Checks that budgeted GIFs always fit in max_bytes, and hold the frames and colors they say
+    """
+    import io
+    import numpy as np
+
+    checker = ImageGlitcher()
+    for max_bytes in (20000, 100000, 400000):
+        output, settings = checker.glitch_budgeted('test.png', 3, max_bytes=max_bytes, frames=10, seed=1)
+        assert len(output) == settings['bytes'] <= max_bytes
+        with Image.open(io.BytesIO(output)) as gif:
+            assert gif.size == tuple(settings['size'])
+            assert getattr(gif, 'n_frames', 1) <= settings['frames'] <= 10
+            # One more index, for transparency
+            assert gif.mode == 'P' and len(np.unique(np.asarray(gif))) <= settings['colors'] + 1
+
+
+def test_atlas():
+    """
+     Checks that every frame of an atlas is where its frame map says, and is the glitched frame
+    """
+    import numpy as np
+
+    checker = ImageGlitcher()
+    atlas, frame_map = checker.glitch_atlas('test.png', 3, columns=3, frames=5, seed=6, glitch_change=1)
+    frames = checker.glitch_image('test.png', 3, gif=True, frames=5, seed=6, glitch_change=1)
+    assert len(frame_map['frames']) == len(frames) and frame_map['meta']['columns'] == 3
+    assert atlas.size == (frame_map['meta']['size']['w'], frame_map['meta']['size']['h'])
+    for cell, frame in zip(frame_map['frames'], frames):
+        box = (cell['x'], cell['y'], cell['x'] + cell['w'], cell['y'] + cell['h'])
+        assert np.array_equal(np.asarray(atlas.crop(box)), np.asarray(frame.convert(atlas.mode)))
+
+
+def test_pipelined():
+    """
+     Checks that pipelined GIF jobs give the same frames as sequential ones,
+     and that GIFs encoded as their frames are glitched are the same as the frames saved afterwards
+    """
+    import io
+    import numpy as np
+
+    checker = ImageGlitcher()
+    for params in ({}, {'step': 2, 'glitch_change': 1, 'color_offset': True, 'scan_lines': True}):
+        expected, expected_duration, expected_count = checker.glitch_gif('test.gif', 3, seed=2, **params)
+        frames, duration, count = checker.glitch_gif('test.gif', 3, seed=2, pipelined=True, **params)
+        assert (duration, count) == (expected_duration, expected_count)
+        assert all(np.array_equal(np.asarray(frame), np.asarray(expected_frame))
+                   for frame, expected_frame in zip(frames, expected))
+
+        expected_gif = io.BytesIO()
+        expected[0].save(expected_gif, format='GIF', append_images=expected[1:], save_all=True, duration=120, loop=0)
+        for pipelined in (False, True):
+            encoded = io.BytesIO()
+            assert checker.glitch_gif_encoded('test.gif', 3, encoded, duration=120, seed=2, pipelined=pipelined,
+                                              **params) == (expected_duration, expected_count)
+            assert encoded.getvalue() == expected_gif.getvalue()
+
+
+def test_input_cache():
+    """
+     Checks that outputs are the same with and without an input cache, cache hits included
+    """
+    import numpy as np
+    from glitch_this import InputCache
+
+    cached, uncached = ImageGlitcher(), ImageGlitcher()
+    cached.input_cache = InputCache(64 * 2 ** 20)
+    for _ in range(2):
+        for params in ({}, {'color_offset': True}, {'mode': 'L'}):
+            assert np.array_equal(np.asarray(cached.glitch_image('test.png', 3, seed=4, **params)),
+                                  np.asarray(uncached.glitch_image('test.png', 3, seed=4, **params)))
+        frames, duration, count = cached.glitch_gif('test.gif', 3, seed=4)
+        expected, expected_duration, expected_count = uncached.glitch_gif('test.gif', 3, seed=4)
+        assert (duration, count) == (expected_duration, expected_count)
+        assert all(np.array_equal(np.asarray(frame), np.asarray(expected_frame))
+                   for frame, expected_frame in zip(frames, expected))
+    assert len(cached.input_cache) > 0
+
+
+def test_workqueue():
+    """
+     Checks that enqueued jobs are glitched once by a draining worker,
+     and that enqueuing them again doesn't add them twice
+    """
+    import tempfile
+
+    from glitch_this.workqueue import Spool, Worker, enqueue_main
+
+    with tempfile.TemporaryDirectory() as folder:
+        spool_path, out_dir = os.path.join(folder, 'spool'), os.path.join(folder, 'out')
+        argv = ['test.png', 'test.gif', '-q', spool_path, '-o', out_dir, '-l', '2', '-sd', '1']
+        enqueue_main(argv)
+        enqueue_main(argv)
+        spool = Spool(spool_path)
+        assert spool.counts()['pending'] == 2
+
+        worker = Worker(spool, poll_interval=0.05, drain=True)
+        worker.run()
+        assert (worker.processed, worker.failed) == (2, 0)
+        assert spool.counts() == {'pending': 0, 'claimed': 0, 'done': 2, 'failed': 0}
+        assert sorted(os.listdir(out_dir)) == ['glitched_test.gif', 'glitched_test.png']
+
+
+def test_scheduler():
+    """
+     Checks that scheduled jobs give the same outputs as direct calls,
+     and that queued jobs start by priority, then in the order they came
+    """
+    from threading import Event
+
+    import numpy as np
+    from glitch_this import GlitchScheduler
+    from glitch_this.scheduler import HIGH, LOW
+
+    expected = np.asarray(ImageGlitcher().glitch_image('test.png', 3, seed=2, scan_lines=True))
+    started, release = Event(), Event()
+
+    def block(done, total, elapsed):
+        started.set()
+        release.wait()
+
+    order = []
+    with GlitchScheduler(workers=1) as scheduler:
+        # Keeps the only worker busy until every other job is queued
+        blocker = scheduler.submit('test.gif', 2, progress=block)
+        started.wait()
+        futures = {}
+        for name, priority in (('low', LOW), ('normal 1', None), ('high', HIGH), ('normal 2', None)):
+            params = {'priority': priority} if priority is not None else {}
+            futures[name] = scheduler.submit('test.png', 3, seed=2, scan_lines=True, **params)
+            futures[name].add_done_callback(lambda _, name=name: order.append(name))
+        release.set()
+        blocker.result()
+        for future in futures.values():
+            assert np.array_equal(np.asarray(future.result()), expected)
+    assert order == ['high', 'normal 1', 'normal 2', 'low']
+
+
+def test_glitch_batch():
+    """
+     Checks that glitch_batch glitches every sample like the reference kernels would with its draw,
+     for both ways of shifting rows, and that the same rng state gives the same batch
+    """
+    import numpy as np
+    from glitch_this import augment, glitch_batch
+    from glitch_this.kernels import color_offset_reference, shift_reference
+
+    with Image.open('test.png') as img:
+        sample = np.asarray(img.convert('RGB').resize((64, 48)))
+    batch = np.stack([np.roll(sample, index * 5, axis=1) for index in range(6)])
+    default_run_min_bytes = augment.RUN_MIN_BYTES
+    try:
+        # Rows shifted in runs, then with one gather
+        for run_min_bytes in (0, 2 ** 30):
+            augment.RUN_MIN_BYTES = run_min_bytes
+            for params in ({}, {'color_offset': True, 'scan_lines': True}):
+                glitched = glitch_batch(batch, (1.0, 8.0), np.random.default_rng(3), **params)
+                assert np.array_equal(glitch_batch(batch, (1.0, 8.0), np.random.default_rng(3), **params), glitched)
+                plans = augment.draw_plans(np.random.default_rng(3), *batch.shape, (1.0, 8.0), params != {})
+                for index, inputarr in enumerate(batch):
+                    outputarr = inputarr.copy()
+                    for offset, start_y, stop_y in zip(plans['offsets'][index], plans['start_ys'][index],
+                                                       plans['stop_ys'][index]):
+                        if offset != 0:
+                            shift_reference(inputarr, outputarr, int(start_y), int(stop_y), int(offset))
+                    if params:
+                        channel_index, offset_x, offset_y = plans['colors'][index].tolist()
+                        color_offset_reference(inputarr, outputarr, offset_x, offset_y, channel_index)
+                        outputarr[::2] = 0
+                    assert np.array_equal(glitched[index], outputarr)
+    finally:
+        augment.RUN_MIN_BYTES = default_run_min_bytes
+
+
+def test_archive():
+    """
+     Checks that every image of an archive is glitched into the output archive under its name,
+     in order and with the same content as glitch_bytes, and that other members are copied as they are
+    """
+    import io
+    import tempfile
+    import zipfile
+
+    import numpy as np
+    from glitch_this import glitch_archive
+    from glitch_this.archive import read_members
+
+    with open('test.png', 'rb') as png_file:
+        png = png_file.read()
+    expected = ImageGlitcher().glitch_bytes(png, 2, seed=3)
+    with tempfile.TemporaryDirectory() as folder:
+        src_path = os.path.join(folder, 'in.zip')
+        with zipfile.ZipFile(src_path, 'w') as archive:
+            archive.writestr('images/a.png', png)
+            archive.writestr('notes.txt', b'not an image')
+            archive.writestr('images/b.png', png)
+        for dst_name in ('out.zip', 'out.tar.gz'):
+            dst_path = os.path.join(folder, dst_name)
+            counts = glitch_archive(src_path, dst_path, {'glitch_amount': 2, 'seed': 3}, use_threads=True,
+                                    keep_others=True)
+            assert counts == {'glitched': 2, 'skipped': 1, 'failed': 0}
+            members = {member.name: member.data for member in read_members(dst_path)}
+            assert list(members) == ['images/a.png', 'notes.txt', 'images/b.png']
+            assert members['notes.txt'] == b'not an image'
+            for name in ('images/a.png', 'images/b.png'):
+                with Image.open(io.BytesIO(members[name])) as output, Image.open(io.BytesIO(expected)) as reference:
+                    assert np.array_equal(np.asarray(output), np.asarray(reference))
+
+
+def test_palette_gif():
+    """
+     Checks that keep_palette glitches the palette indices of every frame,
+     keeping each frame's palette and which indices it holds
+    """
+    import numpy as np
+    from PIL.GifImagePlugin import LoadingStrategy
+    from glitch_this.glitch_this import gif_frames
+
+    checker = ImageGlitcher()
+    glitched_frames, _, frame_count = checker.glitch_gif('test.gif', 4, seed=3, keep_palette=True)
+    assert len(glitched_frames) == frame_count
+    with Image.open('test.gif') as gif:
+        # Decoded the way keep_palette decodes them, as P unless their palette changed
+        for glitched, frame in zip(glitched_frames, gif_frames(gif, LoadingStrategy.RGB_AFTER_DIFFERENT_PALETTE_ONLY)):
+            assert glitched.mode == frame.mode == 'P' and glitched.size == frame.size
+            assert glitched.getpalette() == frame.getpalette()
+            # Shifts only move indices around
+            assert np.array_equal(np.sort(np.asarray(glitched), axis=None), np.sort(np.asarray(frame), axis=None))
+
+
 if __name__ == '__main__':
     # Create the ImageGlitcher object
     glitcher = ImageGlitcher()
@@ -504,6 +1278,180 @@ if __name__ == '__main__':
     t1 = time()
     print(f'Done! Time taken: {t1 - t0}')
 
+    print('Testing palette GIF jobs in threads....')
+    t0 = time()
+    test_palette_gif_threads()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing GIF optimizer....')
+    t0 = time()
+    test_optimized_gif()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing bytes in/out formats....')
+    t0 = time()
+    test_bytes_formats()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing batch output paths....')
+    t0 = time()
+    test_batch_outputs()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing small roi and mask regions....')
+    t0 = time()
+    test_small_regions()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing kernel verification....')
+    t0 = time()
+    test_kernel_registry()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing render_frame....')
+    t0 = time()
+    test_render_frame()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing glitch_sweep threads....')
+    t0 = time()
+    test_sweep_threads()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing glitch_renditions animated checks....')
+    t0 = time()
+    test_renditions_animated()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing glitch_atlas closing its input....')
+    t0 = time()
+    test_atlas_closes()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing calibrated estimates....')
+    t0 = time()
+    test_calibrated_estimate()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing region estimates....')
+    t0 = time()
+    test_region_estimate()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing threaded row bands....')
+    t0 = time()
+    test_threads()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing bench report....')
+    t0 = time()
+    test_bench()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing native mode glitching....')
+    t0 = time()
+    test_native_modes()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing stage cache....')
+    t0 = time()
+    test_stage_cache()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing watch folder glitching....')
+    t0 = time()
+    test_watch()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing progress, cancel and deadline....')
+    t0 = time()
+    test_progress_cancel()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing parallel seekable frames....')
+    t0 = time()
+    test_parallel_frames()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing batch job resuming....')
+    t0 = time()
+    test_batch_resume()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing budgeted rendering....')
+    t0 = time()
+    test_budgeted()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing sprite sheet atlas....')
+    t0 = time()
+    test_atlas()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing pipelined GIF stages....')
+    t0 = time()
+    test_pipelined()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing decoded input cache....')
+    t0 = time()
+    test_input_cache()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing work queue....')
+    t0 = time()
+    test_workqueue()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing job scheduler....')
+    t0 = time()
+    test_scheduler()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing batched augmentation....')
+    t0 = time()
+    test_glitch_batch()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing archive glitching....')
+    t0 = time()
+    test_archive()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
+    print('Testing palette index glitching....')
+    t0 = time()
+    test_palette_gif()
+    t1 = time()
+    print(f'Done! Time taken: {t1 - t0}')
+
     print('Testing infinite stress test.....\nNOTE: Use ctrl+c to stop the test')
     test_loop()
     print('Done!')